@@ -12,6 +12,9 @@ from aiogram.types import (
     Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 )
 
+import storage
+from step_registry import StepRegistry
+
 # Global variables (will be initialized from main.py)
 dp: Any = None
 users_data: Dict[int, Dict[str, Any]] = {}
@@ -24,6 +27,9 @@ bot: Any = None
 START_TIME: float = 0
 send_token_notification_to_admin: Any = None
 
+# Text steps of account creation / login, see handle_text_input
+account_steps = StepRegistry("account_creation")
+
 # ========== ISP-256 PROTOCOL IMPLEMENTATION ==========
 import random
 import re
@@ -792,20 +798,24 @@ async def handle_text_input(message):
         return  # Ignore old messages
 
     user_id = message.from_user.id
-    text = message.text.strip()
 
     # Check if user is in account creation flow
     current_step = user_state.get(user_id, {}).get("current_step")
 
-    print(f"🔍 ACCOUNT_CREATION DEBUG: User {user_id} sent text: '{text}'")
-    print(f"🔍 ACCOUNT_CREATION DEBUG: User {user_id} current_step: {current_step}")
-    print(f"🔍 ACCOUNT_CREATION DEBUG: Full user_state for {user_id}: {user_state.get(user_id, {})}")
+    print(f"🔍 ACCOUNT_CREATION DEBUG: User {user_id} sent text: '{message.text.strip()}' (step: {current_step})")
 
-    # Handle cancel & enter manually for contact sharing
-    if current_step == "waiting_contact_permission" and text == "⌨️ Type Manually Instead":
-        user_state[user_id]["current_step"] = "waiting_manual_phone"
+    # Steps of other flows have no handler here and are left alone
+    await account_steps.dispatch(current_step, message, user_id)
 
-        text = """
+@account_steps.step("waiting_contact_permission")
+async def handle_contact_permission_text(message, user_id):
+    """Cancel contact sharing and enter the number manually instead"""
+    if message.text.strip() != "⌨️ Type Manually Instead":
+        return
+
+    user_state[user_id]["current_step"] = "waiting_manual_phone"
+
+    text = """
 📱 <b>Manual Phone Number Entry</b>
 
 📝 <b>Account Creation - Step 2/3</b>
@@ -834,37 +844,17 @@ async def handle_text_input(message):
 🚀 <b>Type your complete phone number in correct format:</b>
 """
 
-        await message.answer(text)
-        return
-
-    # Only handle account creation related steps, ignore others
-    account_creation_steps = ["waiting_login_phone", "waiting_custom_name", "waiting_manual_phone", "waiting_email", "waiting_access_token", "waiting_contact_permission"]
-
-    if current_step not in account_creation_steps:
-        return  # Let other handlers deal with non-account creation text
-
-    if current_step == "waiting_login_phone":
-        await handle_login_phone_verification(message, user_id)
-    elif current_step == "waiting_custom_name":
-        await handle_custom_name_input(message, user_id)
-    elif current_step == "waiting_manual_phone":
-        await handle_manual_phone_input(message, user_id)
-    elif current_step == "waiting_email":
-        await handle_email_input(message, user_id)
-    elif current_step == "waiting_access_token":
-        await handle_access_token_login(message, user_id)
+    await message.answer(text)
 
 # Helper functions for text input handling
+@account_steps.step("waiting_login_phone")
 async def handle_login_phone_verification(message, user_id):
     """Handle login phone verification"""
     phone = message.text.strip()
 
-    # Find user with matching phone number
-    matching_user = None
-    for uid, data in users_data.items():
-        if data.get('phone_number') == phone:
-            matching_user = uid
-            break
+    # Find user with matching phone number (normalized phone index)
+    matches = storage.find_users_by_phone(phone)
+    matching_user = user_id if user_id in matches else (matches[0] if matches else None)
 
     if matching_user and matching_user == user_id:
         # Phone matches, complete login
@@ -954,6 +944,7 @@ async def handle_login_phone_verification(message, user_id):
 
         await message.answer(text, reply_markup=options_keyboard)
 
+@account_steps.step("waiting_custom_name")
 async def handle_custom_name_input(message, user_id):
     """Handle custom name input with validation"""
     custom_name = message.text.strip()
@@ -1025,6 +1016,7 @@ async def handle_custom_name_input(message, user_id):
 
     await message.answer(success_text, reply_markup=phone_choice_keyboard)
 
+@account_steps.step("waiting_manual_phone")
 async def handle_manual_phone_input(message, user_id):
     """Handle manual phone number entry with comprehensive Indian validation"""
     phone_input = message.text.strip()
@@ -1135,12 +1127,12 @@ async def handle_manual_phone_input(message, user_id):
 
     await message.answer(success_text)
 
+@account_steps.step("waiting_email")
 async def handle_email_input(message, user_id):
     """Handle email input for account creation completion"""
     email = message.text.strip()
 
     # Enhanced email validation with better error messages
-    import re
     email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
 
     if not re.match(email_pattern, email):
@@ -1442,6 +1434,7 @@ async def cb_login_with_token(callback: CallbackQuery):
     await safe_edit_message(callback, text)
     await callback.answer()
 
+@account_steps.step("waiting_access_token")
 async def handle_access_token_login(message, user_id):
     """Handle access token login verification"""
     access_token = message.text.strip()
@@ -1496,14 +1489,16 @@ async def handle_access_token_login(message, user_id):
         decoded_email = decoded_data.get('email', '')
         is_telegram_name = decoded_data.get('is_telegram_name', False)
 
-        # Find matching user in database by phone and email combination
+        # Find matching user: stored access token first, then phone + email index
         matching_user_id = None
-        for uid, data in users_data.items():
-            if (data.get('phone_number') == decoded_phone and 
-                data.get('email') == decoded_email and 
-                data.get('full_name') == decoded_username):
-                matching_user_id = uid
-                break
+        for uid in storage.find_users_by_access_token(access_token):
+            matching_user_id = uid
+            break
+        if matching_user_id is None:
+            for uid in storage.find_users_by_phone_and_email(decoded_phone, decoded_email):
+                if users_data[uid].get('full_name') == decoded_username:
+                    matching_user_id = uid
+                    break
 
         if matching_user_id:
             # Existing account found - login the user
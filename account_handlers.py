@@ -4,6 +4,8 @@ My Account Handlers - India Social Panel
 All account-related functionality and handlers
 """
 
+import html
+import re
 import time
 from datetime import datetime, timezone
 from typing import Dict, Any, Optional, Callable, Union
@@ -11,12 +13,15 @@ from aiogram import F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 import pytz
 
+import storage
+from step_registry import StepRegistry
+
 # Global variables (will be initialized from main.py)
 
 # Initialize with proper default values to avoid None type errors
 dp: Any = None
 users_data: Dict[int, Dict[str, Any]] = {}
-orders_data: Dict[str, Dict[str, Any]] = {}
+orders_data: storage.StoredCollection = storage.orders_data  # Shared authoritative order store
 user_state: Dict[int, Dict[str, Any]] = {}  # Fixed type to match main.py
 format_currency: Optional[Callable[[float], str]] = None
 format_time: Optional[Callable[[str], str]] = None
@@ -25,6 +30,12 @@ require_account: Optional[Callable] = None
 is_account_created: Optional[Callable[[int], bool]] = None
 is_admin: Optional[Callable[[int], bool]] = None
 
+# Orders shown per order history page
+ORDER_HISTORY_PAGE_SIZE = 15
+
+# Text steps of the profile editor, see handle_profile_edit_input
+profile_steps = StepRegistry("profile_edit")
+
 def format_join_date_with_timezone(join_date_str: str, user_timezone: str = "Asia/Kolkata") -> str:
     """Format join date with timezone information"""
     try:
@@ -96,7 +107,7 @@ def init_account_handlers(main_dp, main_users_data, main_orders_data, main_requi
     # Initialize all global variables
     dp = main_dp
     users_data = main_users_data if main_users_data is not None else {}
-    orders_data = main_orders_data if main_orders_data is not None else {}
+    orders_data = main_orders_data if main_orders_data is not None else storage.orders_data
     require_account = main_require_account
     format_currency = main_format_currency
     format_time = main_format_time
@@ -110,6 +121,7 @@ def init_account_handlers(main_dp, main_users_data, main_orders_data, main_requi
         # Register handlers after initialization
         dp.callback_query.register(require_account(cb_my_account), F.data == "my_account")
         dp.callback_query.register(require_account(cb_order_history), F.data == "order_history")
+        dp.callback_query.register(require_account(cb_order_history), F.data.startswith("order_history_page_"))
         dp.callback_query.register(require_account(cb_refill_history), F.data == "refill_history")
         dp.callback_query.register(require_account(cb_api_key), F.data == "api_key")
         dp.callback_query.register(require_account(cb_edit_profile), F.data == "edit_profile")
@@ -273,51 +285,34 @@ async def cb_order_history(callback: CallbackQuery):
 
     user_id = callback.from_user.id
 
-    # CRITICAL FIX: Force fresh data reload to avoid cached references
-    from main import load_data_from_json
     import main
 
-    # Force reload fresh data directly from JSON file every time
-    print(f"🔄 DEBUG: Force reloading fresh data from files...")
-    fresh_orders_data = load_data_from_json("orders.json") 
-    user_orders = []
+    # Page number comes from the "order_history_page_N" navigation buttons
+    page = 0
+    if callback.data and callback.data.startswith("order_history_page_"):
+        try:
+            page = max(int(callback.data.replace("order_history_page_", "")), 0)
+        except ValueError:
+            page = 0
 
-    print(f"🔍 DEBUG: Checking order history for user {user_id}")
-    print(f"🔍 DEBUG: fresh_orders_data has {len(fresh_orders_data)} orders")
-    print(f"🔍 DEBUG: main.order_temp has user {user_id}: {user_id in main.order_temp}")
-    print(f"🔍 DEBUG: local orders_data has {len(orders_data)} orders")
+    # Per-user order index: only this page's orders are read, older pages come from the archive
+    total_orders = storage.user_order_count(user_id)
+    user_orders = storage.user_order_page(user_id, offset=page * ORDER_HISTORY_PAGE_SIZE, limit=ORDER_HISTORY_PAGE_SIZE)
 
-    # Get from fresh_orders_data (guaranteed fresh from file)
-    for order_id, order in fresh_orders_data.items():
-        # CRITICAL FIX: Check both user_id and customer_id for compatibility
-        order_user_id = order.get('user_id') or order.get('customer_id')
-        if order_user_id == user_id:
-            order_status = order.get('status', 'pending')
-            print(f"🔍 Found order in fresh_orders_data: {order_id} - Status: {order_status} - UserID: {order_user_id}")
-            user_orders.append(order)
+    print(f"🔍 DEBUG: Checking order history for user {user_id} (page {page + 1}, {total_orders} orders)")
+    print(f"🔍 DEBUG: main.order_temp has user {user_id}: {user_id in main.order_temp}")
 
     # Get from main.order_temp (recent orders) 
-    if user_id in main.order_temp:
+    if page == 0 and user_id in main.order_temp and main.order_temp[user_id].get('order_id') not in orders_data:
         temp_order = main.order_temp[user_id].copy()
         temp_order['is_recent'] = True
         temp_order_status = temp_order.get('status', 'processing')
         print(f"🔍 Found recent order in main.order_temp: {temp_order.get('order_id', 'NO_ID')} - Status: {temp_order_status}")
         user_orders.append(temp_order)
+        total_orders += 1
 
-    # Also get from local orders_data if it exists
-    if orders_data:
-        for order_id, order in orders_data.items():
-            # CRITICAL FIX: Check both user_id and customer_id for compatibility
-            order_user_id = order.get('user_id') or order.get('customer_id')
-            if order_user_id == user_id:
-                # Check if not already added
-                existing_ids = [o.get('order_id') for o in user_orders]
-                if order.get('order_id') not in existing_ids:
-                    order_status = order.get('status', 'pending')
-                    print(f"🔍 Found order in local orders_data: {order_id} - Status: {order_status} - UserID: {order_user_id}")
-                    user_orders.append(order)
-
-    print(f"🔍 DEBUG: Total orders found for user {user_id}: {len(user_orders)}")
+    print(f"🔍 DEBUG: Orders on this page for user {user_id}: {len(user_orders)}")
+    total_pages = max((total_orders + ORDER_HISTORY_PAGE_SIZE - 1) // ORDER_HISTORY_PAGE_SIZE, 1)
 
     if not user_orders:
         text = """
@@ -363,15 +358,15 @@ async def cb_order_history(callback: CallbackQuery):
         text = f"""
 📜 <b>Order History</b>
 
-📊 <b>Total Orders Found:</b> {len(user_orders)}
+📊 <b>Total Orders Found:</b> {total_orders}
 
-📋 <b>Recent Orders (Latest First):</b>
+📋 <b>Recent Orders (Latest First) - Page {page + 1}/{total_pages}:</b>
 
 """
         # Sort orders by created_at (newest first)
         sorted_orders = sorted(user_orders, key=lambda x: x.get('created_at', ''), reverse=True)
 
-        for i, order in enumerate(sorted_orders[:15], 1):  # Show last 15 orders
+        for i, order in enumerate(sorted_orders, page * ORDER_HISTORY_PAGE_SIZE + 1):
             status_emoji = {"processing": "⏳", "completed": "✅", "failed": "❌", "pending": "🔄", "cancelled": "❌"}
             emoji = status_emoji.get(order.get('status', 'processing'), "⏳")
 
@@ -428,7 +423,15 @@ async def cb_order_history(callback: CallbackQuery):
 • Don't forget to mention the Order ID
 """
 
-    back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+    keyboard_rows = []
+    page_buttons = []
+    if page > 0:
+        page_buttons.append(InlineKeyboardButton(text="⬅️ Newer", callback_data=f"order_history_page_{page - 1}"))
+    if page + 1 < total_pages:
+        page_buttons.append(InlineKeyboardButton(text="Older ➡️", callback_data=f"order_history_page_{page + 1}"))
+    if page_buttons:
+        keyboard_rows.append(page_buttons)
+    keyboard_rows += [
         [
             InlineKeyboardButton(text="🚀 New Order", callback_data="new_order"),
             InlineKeyboardButton(text="📞 Contact Support", url="https://t.me/tech_support_admin")
@@ -437,7 +440,8 @@ async def cb_order_history(callback: CallbackQuery):
             InlineKeyboardButton(text="👤 My Account", callback_data="my_account"),
             InlineKeyboardButton(text="🏠 Main Menu", callback_data="back_main")
         ]
-    ])
+    ]
+    back_keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
 
     if safe_edit_message:
         await safe_edit_message(callback, text, back_keyboard)
@@ -628,7 +632,7 @@ async def cb_create_api_key(callback: CallbackQuery):
     users_data[user_id]['api_created_at'] = timestamp
 
     # Save user data to persistent storage
-    from main import save_data_to_json
+    from persistence import save_data_to_json
     save_data_to_json(users_data, "users.json")
 
     text = f"""
@@ -811,7 +815,7 @@ async def cb_confirm_regenerate_api(callback: CallbackQuery):
     users_data[user_id]['api_regenerated_at'] = timestamp
 
     # Save user data to persistent storage
-    from main import save_data_to_json
+    from persistence import save_data_to_json
     save_data_to_json(users_data, "users.json")
 
     text = f"""
@@ -1690,6 +1694,157 @@ Your photo is stored securely and used only for your profile display.
     await safe_edit_message(callback, text)
     await callback.answer()
 
+# ========== PROFILE FIELD INPUT ==========
+BIRTHDAY_FORMATS = ("%d/%m/%Y", "%d-%m-%Y", "%d/%m", "%d-%m", "%B %d", "%b %d")
+
+
+def get_profile_updated_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="👀 Preview Profile", callback_data="preview_profile"),
+            InlineKeyboardButton(text="✏️ Continue Editing", callback_data="edit_profile")
+        ],
+        [
+            InlineKeyboardButton(text="🏠 Main Menu", callback_data="back_main")
+        ]
+    ])
+
+
+def clean_profile_phone(text: str) -> Optional[str]:
+    """+91XXXXXXXXXX for Indian numbers, +<country><number> otherwise; None if invalid"""
+    phone = re.sub(r"[\s\-().]", "", text)
+    if re.fullmatch(r"[6-9]\d{9}", phone):
+        return "+91" + phone
+    if re.fullmatch(r"\+\d{10,15}", phone):
+        return phone
+    return None
+
+
+def clean_profile_birthday(text: str) -> Optional[str]:
+    for date_format in BIRTHDAY_FORMATS:
+        try:
+            datetime.strptime(text, date_format)
+            return text
+        except ValueError:
+            continue
+    return None
+
+
+async def save_profile_field(message, user_id: int, field: str, value: str, label: str) -> None:
+    """Store one profile field, end the editing step and confirm"""
+    users_data[user_id][field] = value
+    user_state[user_id]["current_step"] = None
+
+    from persistence import save_data_to_json
+    save_data_to_json(users_data, "users.json")
+
+    text = f"""
+✅ <b>{label} Updated Successfully!</b>
+
+📝 <b>New {label}:</b> {html.escape(value)}
+
+💡 <b>Your profile has been updated</b>
+"""
+    await message.answer(text, reply_markup=get_profile_updated_keyboard())
+
+
+async def handle_profile_edit_input(message, step: Optional[str]) -> None:
+    """Text sent while editing a profile field (ProfileEditStates)"""
+    if not message.from_user or not message.text:
+        return
+
+    user_id = message.from_user.id
+    if user_id not in users_data:
+        user_state.pop(user_id, None)
+        return
+
+    await profile_steps.dispatch(step, message, user_id)
+
+
+@profile_steps.step("editing_name")
+async def handle_edit_name_input(message, user_id):
+    name = " ".join(message.text.split())
+    if len(name) < 2 or len(name) > 50 or not all(char.isalpha() or char in " .'-" for char in name):
+        await message.answer(
+            "⚠️ <b>Invalid Name!</b>\n\n"
+            "📝 <b>Use 2-50 letters, without numbers or special characters.</b>\n"
+            "💡 <b>Example:</b> Rahul Kumar Singh\n\n"
+            "🔄 <b>Please send your name again.</b>"
+        )
+        return
+    await save_profile_field(message, user_id, 'full_name', name, "Full Name")
+
+
+@profile_steps.step("editing_phone")
+async def handle_edit_phone_input(message, user_id):
+    phone = clean_profile_phone(message.text.strip())
+    if phone is None:
+        await message.answer(
+            "⚠️ <b>Invalid Phone Number!</b>\n\n"
+            "📱 <b>Formats Accepted:</b> +91 9876543210, 9876543210, +919876543210\n\n"
+            "🔄 <b>Please send your phone number again.</b>"
+        )
+        return
+    await save_profile_field(message, user_id, 'phone_number', phone, "Phone Number")
+
+
+@profile_steps.step("editing_email")
+async def handle_edit_email_input(message, user_id):
+    email = message.text.strip()
+    if not re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', email):
+        await message.answer(
+            "⚠️ <b>Invalid Email Address!</b>\n\n"
+            "💡 <b>Example:</b> your.name@gmail.com\n\n"
+            "🔄 <b>Please send your email again.</b>"
+        )
+        return
+    await save_profile_field(message, user_id, 'email', email, "Email")
+
+
+@profile_steps.step("editing_bio")
+async def handle_edit_bio_input(message, user_id):
+    bio = message.text.strip()
+    if len(bio) > 200:
+        await message.answer(
+            f"⚠️ <b>Bio Too Long!</b>\n\n"
+            f"📏 <b>{len(bio)} characters, maximum 200.</b>\n\n"
+            "🔄 <b>Please send a shorter bio.</b>"
+        )
+        return
+    await save_profile_field(message, user_id, 'bio', bio, "Bio")
+
+
+@profile_steps.step("editing_location")
+async def handle_edit_location_input(message, user_id):
+    location = " ".join(message.text.split())
+    if len(location) < 2 or len(location) > 100:
+        await message.answer(
+            "⚠️ <b>Invalid Location!</b>\n\n"
+            "💡 <b>Example:</b> Mumbai, Maharashtra, India\n\n"
+            "🔄 <b>Please send your location again.</b>"
+        )
+        return
+    await save_profile_field(message, user_id, 'location', location, "Location")
+
+
+@profile_steps.step("editing_birthday")
+async def handle_edit_birthday_input(message, user_id):
+    birthday = clean_profile_birthday(" ".join(message.text.split()))
+    if birthday is None:
+        await message.answer(
+            "⚠️ <b>Invalid Birthday!</b>\n\n"
+            "📅 <b>Supported Formats:</b> 25/12/1995, 25-12-1995, 25/12, December 25\n\n"
+            "🔄 <b>Please send your birthday again.</b>"
+        )
+        return
+    await save_profile_field(message, user_id, 'birthday', birthday, "Birthday")
+
+
+@profile_steps.step("editing_photo")
+async def handle_edit_photo_text(message, user_id):
+    await message.answer("📸 <b>Please send a photo</b> (not text) to update your profile picture.")
+
+
 async def cb_sync_telegram_data(callback: CallbackQuery):
     """Handle syncing Telegram data"""
     if not callback.message or not callback.from_user:
@@ -1708,7 +1863,7 @@ async def cb_sync_telegram_data(callback: CallbackQuery):
         users_data[user_id]['last_sync'] = time.time()
 
         # Save user data to persistent storage
-        from main import save_data_to_json
+        from persistence import save_data_to_json
         save_data_to_json(users_data, "users.json")
 
     text = f"""
@@ -1846,9 +2001,9 @@ async def cb_user_stats(callback: CallbackQuery):
     user_id = callback.from_user.id
     user_data = users_data.get(user_id, {})
 
-    # Calculate stats
-    total_orders = len([o for o in orders_data.values() if o.get('user_id') == user_id])
-    completed_orders = len([o for o in orders_data.values() if o.get('user_id') == user_id and o.get('status') == 'completed'])
+    # Calculate stats from the per-user order index
+    total_orders = storage.user_order_count(user_id)
+    completed_orders = storage.user_order_count(user_id, 'completed')
     success_rate = (completed_orders / total_orders * 100) if total_orders > 0 else 0
 
     text = f"""
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Admin Outbox - India Social Panel
+Per-chat priority queues for notifications to the admin groups
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from broadcast import TokenBucket
+
+# ========== CONFIGURATION ==========
+# Telegram allows about 20 messages per minute into one group
+OUTBOX_RATE_PER_MINUTE = float(os.getenv("OUTBOX_RATE_PER_MINUTE", "20"))
+OUTBOX_BURST = int(os.getenv("OUTBOX_BURST", "3"))
+# Attempts per message for transient errors (network, 5xx, retry-after)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+# Queued messages per chat; beyond it the lowest-priority newest one is dropped
+OUTBOX_MAX_DEPTH = int(os.getenv("OUTBOX_MAX_DEPTH", "1000"))
+
+# Lower goes first; equal priorities keep their order
+PRIORITY_ORDER = 0       # new paid orders
+PRIORITY_SCREENSHOT = 1  # payment screenshots
+PRIORITY_UPDATE = 2      # status of existing orders
+PRIORITY_CHATTER = 3     # new users, feedback, movie requests, ...
+PRIORITY_NAMES = {PRIORITY_ORDER: "orders", PRIORITY_SCREENSHOT: "screenshots",
+                  PRIORITY_UPDATE: "updates", PRIORITY_CHATTER: "chatter"}
+
+
+class ChatQueue:
+    """Pending calls for one chat, its own rate limit and one worker"""
+
+    def __init__(self, chat_id: int, rate_per_minute: float, burst: int):
+        self.chat_id = chat_id
+        self.bucket = TokenBucket(rate_per_minute / 60, burst)
+        # (priority, sequence, enqueued_at, attempts, method, kwargs)
+        self.heap: List[Tuple[int, int, float, int, str, Dict[str, Any]]] = []
+        self.ready = asyncio.Event()
+        self.worker: Optional[asyncio.Task] = None
+        self.stats = {"sent": 0, "failed": 0, "retries": 0, "dropped": 0, "last_lag": 0.0, "max_lag": 0.0}
+
+    def oldest_wait(self, now: float) -> float:
+        return max((now - item[2] for item in self.heap), default=0.0)
+
+
+class AdminOutbox:
+    """
+    Handlers enqueue Bot API calls (send_message, send_photo,
+    edit_message_text, ...) for an admin chat and return at once; a worker
+    per chat sends them in priority order within that chat's rate.
+
+    Retry-after pauses the chat's bucket and keeps the message at its
+    place; network and server errors are retried with backoff up to
+    OUTBOX_MAX_ATTEMPTS. An edit Telegram refuses (message too old, deleted,
+    ...) is sent as a new message instead; anything else is logged and
+    dropped.
+    """
+
+    def __init__(self, rate_per_minute: float = OUTBOX_RATE_PER_MINUTE, burst: int = OUTBOX_BURST,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, max_depth: int = OUTBOX_MAX_DEPTH):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_attempts = max(max_attempts, 1)
+        self.max_depth = max(max_depth, 1)
+        self.bot: Optional[Bot] = None
+        self.queues: Dict[int, ChatQueue] = {}
+        self._sequence = itertools.count()
+
+    def bind(self, bot: Bot) -> None:
+        self.bot = bot
+
+    # ----- enqueueing -----
+    def enqueue(self, chat_id: int, method: str, priority: int = PRIORITY_CHATTER, **kwargs: Any) -> None:
+        """Queue bot.<method>(chat_id=chat_id, **kwargs); needs a running event loop"""
+        chat_id = int(chat_id)
+        queue = self.queues.get(chat_id)
+        if queue is None:
+            queue = self.queues[chat_id] = ChatQueue(chat_id, self.rate_per_minute, self.burst)
+        kwargs["chat_id"] = chat_id
+        heapq.heappush(queue.heap, (priority, next(self._sequence), time.monotonic(), 0, method, kwargs))
+        if len(queue.heap) > self.max_depth:
+            dropped = max(queue.heap)
+            queue.heap.remove(dropped)
+            heapq.heapify(queue.heap)
+            queue.stats["dropped"] += 1
+            print(f"⚠️ Admin outbox for {chat_id} full, dropped a {PRIORITY_NAMES.get(dropped[0], dropped[0])} "
+                  f"{dropped[4]}")
+        queue.ready.set()
+        if queue.worker is None or queue.worker.done():
+            queue.worker = asyncio.create_task(self._work(queue))
+
+    def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_CHATTER, **kwargs: Any) -> None:
+        self.enqueue(chat_id, "send_message", priority, text=text, **kwargs)
+
+    def send_photo(self, chat_id: int, photo: str, priority: int = PRIORITY_SCREENSHOT, **kwargs: Any) -> None:
+        self.enqueue(chat_id, "send_photo", priority, photo=photo, **kwargs)
+
+    def edit_message_text(self, chat_id: int, message_id: int, text: str, priority: int = PRIORITY_UPDATE,
+                          **kwargs: Any) -> None:
+        self.enqueue(chat_id, "edit_message_text", priority, message_id=message_id, text=text, **kwargs)
+
+    # ----- sending -----
+    async def _work(self, queue: ChatQueue) -> None:
+        while True:
+            if not queue.heap:
+                queue.ready.clear()
+                await queue.ready.wait()
+                continue
+            await queue.bucket.acquire()
+            if not queue.heap:
+                continue
+            item = heapq.heappop(queue.heap)
+            priority, sequence, enqueued_at, attempts, method, kwargs = item
+            try:
+                await getattr(self.bot, method)(**kwargs)
+            except TelegramRetryAfter as e:
+                # Same sequence number: it stays ahead of everything queued after it
+                queue.bucket.pause(e.retry_after)
+                self._retry(queue, item)
+                continue
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempts + 1 >= self.max_attempts:
+                    queue.stats["failed"] += 1
+                    print(f"❌ Admin outbox {method} to {queue.chat_id} failed after {attempts + 1} attempts: {e}")
+                    continue
+                queue.bucket.pause(min(2 ** (attempts + 1), 30))
+                self._retry(queue, item)
+                continue
+            except Exception as e:
+                queue.stats["failed"] += 1
+                print(f"❌ Admin outbox {method} to {queue.chat_id} failed: {e}")
+                if method == "edit_message_text" and "message is not modified" not in str(e):
+                    self._send_instead(queue, item)
+                continue
+            lag = time.monotonic() - enqueued_at
+            queue.stats["sent"] += 1
+            queue.stats["last_lag"] = lag
+            queue.stats["max_lag"] = max(queue.stats["max_lag"], lag)
+
+    def _send_instead(self, queue: ChatQueue, item: Tuple[int, int, float, int, str, Dict[str, Any]]) -> None:
+        """Queue a failed edit as a new message, at the edit's place in the queue"""
+        priority, sequence, enqueued_at, attempts, method, kwargs = item
+        kwargs = {key: value for key, value in kwargs.items() if key not in ("message_id", "inline_message_id")}
+        heapq.heappush(queue.heap, (priority, sequence, enqueued_at, 0, "send_message", kwargs))
+
+    def _retry(self, queue: ChatQueue, item: Tuple[int, int, float, int, str, Dict[str, Any]]) -> None:
+        priority, sequence, enqueued_at, attempts, method, kwargs = item
+        queue.stats["retries"] += 1
+        heapq.heappush(queue.heap, (priority, sequence, enqueued_at, attempts + 1, method, kwargs))
+
+    async def shutdown(self, timeout: float = 10.0) -> None:
+        """Give the queues up to timeout seconds to empty, then stop the workers"""
+        deadline = time.monotonic() + timeout
+        while any(queue.heap for queue in self.queues.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        pending = sum(len(queue.heap) for queue in self.queues.values())
+        if pending:
+            print(f"⚠️ Admin outbox: {pending} notifications not sent before shutdown")
+        for queue in self.queues.values():
+            if queue.worker is not None:
+                queue.worker.cancel()
+
+    # ----- metrics -----
+    def metrics(self) -> Dict[int, Dict[str, Any]]:
+        """Per chat: depth (per priority), oldest wait, sent/failed/retries/dropped and lag in seconds"""
+        now = time.monotonic()
+        result = {}
+        for chat_id, queue in self.queues.items():
+            by_priority: Dict[str, int] = {}
+            for item in queue.heap:
+                name = PRIORITY_NAMES.get(item[0], str(item[0]))
+                by_priority[name] = by_priority.get(name, 0) + 1
+            result[chat_id] = {"depth": len(queue.heap), "by_priority": by_priority,
+                               "oldest_wait": round(queue.oldest_wait(now), 1),
+                               **{key: round(value, 1) if isinstance(value, float) else value
+                                  for key, value in queue.stats.items()}}
+        return result
+
+
+# Shared outbox for every admin group
+admin_outbox = AdminOutbox()
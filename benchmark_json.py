@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+JSON Benchmark - India Social Panel
+Load/dump timings for synthetic users.json / orders.json at several sizes
+
+Usage:
+    python benchmark_json.py                 # 10k and 100k records
+    python benchmark_json.py 10000 1000000   # custom sizes (1M takes a while)
+"""
+
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+import codec
+
+DEFAULT_SIZES = [10_000, 100_000]
+PLATFORMS = ["instagram", "youtube", "facebook", "telegram", "twitter"]
+STATUSES = ["processing", "completed", "cancelled", "pending"]
+
+
+def make_users(count: int) -> Dict[int, Dict[str, Any]]:
+    """Users shaped like completed account-creation profiles"""
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    users = {}
+    for i in range(count):
+        user_id = 1_000_000_000 + i
+        users[user_id] = {
+            "user_id": user_id,
+            "username": f"user{i}",
+            "first_name": f"Name {i}",
+            "full_name": f"Full Name {i}",
+            "phone_number": f"+91{9000000000 + i}",
+            "email": f"user{i}@example.com",
+            "join_date": (start + timedelta(minutes=i)).isoformat(),
+            "account_created": True,
+            "balance": round(rng.uniform(0, 5000), 2),
+            "total_spent": round(rng.uniform(0, 20000), 2),
+            "orders_count": rng.randint(0, 50),
+            "referral_code": f"ISP{i:06d}",
+            "access_token": f"tok_{rng.getrandbits(64):016x}",
+            "status": "active",
+        }
+    return users
+
+
+def make_orders(count: int) -> Dict[str, Dict[str, Any]]:
+    """Orders shaped like the records written by the order flow"""
+    rng = random.Random(7)
+    start = datetime(2024, 1, 1)
+    orders = {}
+    for i in range(count):
+        order_id = f"ORD{i:09d}"
+        orders[order_id] = {
+            "order_id": order_id,
+            "user_id": 1_000_000_000 + rng.randrange(max(count // 10, 1)),
+            "package_name": "Instagram Followers - Premium",
+            "service_id": str(rng.randint(1, 500)),
+            "platform": rng.choice(PLATFORMS),
+            "link": f"https://instagram.com/p/{rng.getrandbits(40):x}",
+            "quantity": rng.choice([100, 500, 1000, 5000]),
+            "total_price": round(rng.uniform(10, 2000), 2),
+            "status": rng.choice(STATUSES),
+            "created_at": (start + timedelta(seconds=i * 30)).isoformat(),
+            "payment_method": "QR Code Screenshot",
+            "payment_status": "pending_verification",
+        }
+    return orders
+
+
+def _time(fn: Callable[[], Any], repeat: int) -> Tuple[float, Any]:
+    """Best of repeat runs in milliseconds, plus the last result"""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+
+def bench(data: Dict[Any, Any], repeat: int) -> List[Tuple[str, float, float, int]]:
+    """(codec, dump ms, load ms, bytes) for the legacy format and each codec mode"""
+    cases = [
+        ("stdlib indent=2 (legacy)", lambda: json.dumps(data, indent=2, ensure_ascii=False, default=str), json.loads),
+        ("stdlib compact", lambda: codec._stdlib_dumps(data, False, False), json.loads),
+    ]
+    if codec.orjson is not None:
+        cases.append(("orjson compact", lambda: codec.orjson.dumps(
+            data, default=str, option=codec._ORJSON_OPTIONS).decode("utf-8"), codec.orjson.loads))
+        cases.append(("orjson indent=2", lambda: codec.orjson.dumps(
+            data, default=str, option=codec._ORJSON_OPTIONS | codec.orjson.OPT_INDENT_2).decode("utf-8"),
+            codec.orjson.loads))
+    results = []
+    for name, dump, load in cases:
+        dump_ms, text = _time(dump, repeat)
+        load_ms, _ = _time(lambda: load(text), repeat)
+        results.append((name, dump_ms, load_ms, len(text.encode("utf-8"))))
+    return results
+
+
+def main(sizes: List[int]) -> None:
+    print(f"JSON codec benchmark (active codec: {codec.BACKEND}, orjson installed: {codec.orjson is not None})")
+    for size in sizes:
+        repeat = 3 if size <= 100_000 else 1
+        for label, factory in (("users.json", make_users), ("orders.json", make_orders)):
+            data = factory(size)
+            print(f"\n{label} - {size:,} records (best of {repeat})")
+            print(f"  {'codec':<26}{'dump ms':>12}{'load ms':>12}{'size MB':>12}")
+            for name, dump_ms, load_ms, nbytes in bench(data, repeat):
+                print(f"  {name:<26}{dump_ms:>12.1f}{load_ms:>12.1f}{nbytes / 1_048_576:>12.2f}")
+            del data
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
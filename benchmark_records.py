@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Record Memory Benchmark - India Social Panel
+Memory held by orders as plain dicts vs slotted OrderRecords
+
+Usage:
+    python benchmark_records.py                # 100k and 1M orders
+    python benchmark_records.py 10000 500000   # custom sizes
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Tuple
+
+import codec
+from benchmark_json import make_orders
+from records import OrderRecord, to_record
+
+DEFAULT_SIZES = [100_000, 1_000_000]
+# Orders are generated and parsed in chunks, like reading orders.json,
+# so every record gets its own string objects as it would in production
+CHUNK_SIZE = 10_000
+
+
+def build(count: int, convert: Callable[[Dict[str, Any]], Any]) -> Tuple[Dict[str, Any], float, float]:
+    """count parsed orders passed through convert, returns (orders, MB held, seconds)"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    orders: Dict[str, Any] = {}
+    for offset in range(0, count, CHUNK_SIZE):
+        chunk = make_orders(min(CHUNK_SIZE, count - offset))
+        parsed = codec.loads(codec.dumps({f"{key}-{offset}": row for key, row in chunk.items()}))
+        del chunk
+        for key, row in parsed.items():
+            orders[key] = convert(row)
+        del parsed
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return orders, held / 1_048_576, elapsed
+
+
+def main(sizes) -> None:
+    print(f"Order record memory benchmark (codec: {codec.BACKEND}, Python {sys.version.split()[0]})")
+    for size in sizes:
+        print(f"\n{size:,} orders")
+        print(f"  {'representation':<22}{'memory MB':>12}{'bytes/order':>14}{'build s':>10}")
+        baseline = None
+        for label, convert in (("dict (legacy)", lambda row: row),
+                               ("OrderRecord (slots)", lambda row: to_record(OrderRecord, row))):
+            orders, held_mb, elapsed = build(size, convert)
+            del orders
+            baseline = baseline or held_mb
+            saving = f"  ({(1 - held_mb / baseline) * 100:.0f}% less)" if held_mb != baseline else ""
+            print(f"  {label:<22}{held_mb:>12.1f}{held_mb * 1_048_576 / size:>14.0f}{elapsed:>10.1f}{saving}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Broadcast Engine - India Social Panel
+Rate-limited, concurrent delivery of one message to many users
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Set
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError,
+)
+from aiogram.types import InlineKeyboardMarkup, Message
+
+# ========== CONFIGURATION ==========
+# Telegram allows about 30 messages per second per bot; stay a bit below
+BROADCAST_RATE_PER_SECOND = float(os.getenv("BROADCAST_RATE_PER_SECOND", "25"))
+BROADCAST_BURST = int(os.getenv("BROADCAST_BURST", "5"))
+# Requests in flight at once
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+# Attempts per recipient for transient errors (network, 5xx, retry-after)
+BROADCAST_MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "4"))
+# How often the progress callback runs
+BROADCAST_PROGRESS_SECONDS = float(os.getenv("BROADCAST_PROGRESS_SECONDS", "5"))
+
+# Outcomes of one delivery; the permanent ones will fail again next time
+SENT = "sent"
+BLOCKED = "blocked"
+DEACTIVATED = "deactivated"
+NOT_FOUND = "not_found"
+FAILED = "failed"
+PERMANENT_FAILURES = frozenset({BLOCKED, DEACTIVATED, NOT_FOUND})
+
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class TokenBucket:
+    """
+    rate tokens per second, at most capacity saved up. Shared by every
+    broadcast, so two running at once still stay under the bot's limit.
+    A retry-after from Telegram pauses the whole bucket.
+    """
+
+    def __init__(self, rate: float = BROADCAST_RATE_PER_SECOND, capacity: int = BROADCAST_BURST):
+        self.rate = max(rate, 0.1)
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+
+def classify(error: Exception) -> str:
+    """Outcome for a delivery that raised error (not retried)"""
+    text = str(error).lower()
+    if isinstance(error, TelegramForbiddenError):
+        return DEACTIVATED if "deactivated" in text else BLOCKED
+    if isinstance(error, TelegramBadRequest) and ("chat not found" in text or "user not found" in text):
+        return NOT_FOUND
+    return FAILED
+
+
+class BroadcastContent:
+    """
+    What gets sent: text, or media with the text as caption.
+
+    media is a file_id/URL string or an InputFile to upload. An upload is
+    done once, with the first recipient; everyone else gets the file_id
+    Telegram returned for it.
+    """
+
+    MEDIA_METHODS = {"photo": "send_photo", "video": "send_video", "animation": "send_animation",
+                     "document": "send_document", "audio": "send_audio", "voice": "send_voice"}
+
+    def __init__(self, text: str = "", media_type: Optional[str] = None, media: Any = None,
+                 reply_markup: Any = None, parse_mode: Optional[str] = "HTML"):
+        if media_type is not None and media_type not in self.MEDIA_METHODS:
+            raise ValueError(f"Unsupported media type: {media_type}")
+        self.text = text
+        self.media_type = media_type
+        self.media = media
+        self.reply_markup = reply_markup
+        self.parse_mode = parse_mode
+
+    @classmethod
+    def from_message(cls, message: Message, text: Optional[str] = None, **kwargs: Any) -> "BroadcastContent":
+        """Content of an existing message (its media is already on Telegram)"""
+        caption = text if text is not None else (message.caption or message.text or "")
+        for media_type in cls.MEDIA_METHODS:
+            media = getattr(message, media_type, None)
+            if media:
+                file = media[-1] if isinstance(media, list) else media
+                return cls(caption, media_type, file.file_id, **kwargs)
+        return cls(caption, **kwargs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-safe form for persisted jobs (an upload not done yet is lost)"""
+        return {"text": self.text, "media_type": self.media_type,
+                "media": self.media if isinstance(self.media, str) else None,
+                "reply_markup": self.reply_markup.model_dump(exclude_none=True) if self.reply_markup else None,
+                "parse_mode": self.parse_mode}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BroadcastContent":
+        markup = data.get("reply_markup")
+        return cls(data.get("text", ""), data.get("media_type"), data.get("media"),
+                   InlineKeyboardMarkup.model_validate(markup) if markup else None, data.get("parse_mode", "HTML"))
+
+    @property
+    def needs_upload(self) -> bool:
+        return self.media_type is not None and not isinstance(self.media, str)
+
+    async def send(self, bot: Bot, chat_id: int) -> Message:
+        if self.media_type is None:
+            return await bot.send_message(chat_id=chat_id, text=self.text, parse_mode=self.parse_mode,
+                                          reply_markup=self.reply_markup)
+        method = getattr(bot, self.MEDIA_METHODS[self.media_type])
+        return await method(chat_id, **{self.media_type: self.media}, caption=self.text or None,
+                            parse_mode=self.parse_mode, reply_markup=self.reply_markup)
+
+    def remember_upload(self, sent: Message) -> None:
+        """Switch to the file_id of the uploaded media"""
+        media = getattr(sent, self.media_type, None)
+        if media:
+            self.media = (media[-1] if isinstance(media, list) else media).file_id
+
+
+class Broadcaster:
+    """Sends one BroadcastContent to many chats through the shared bucket"""
+
+    def __init__(self, bucket: Optional[TokenBucket] = None, concurrency: int = BROADCAST_CONCURRENCY,
+                 max_attempts: int = BROADCAST_MAX_ATTEMPTS):
+        self.bucket = bucket or TokenBucket()
+        self.concurrency = max(concurrency, 1)
+        self.max_attempts = max(max_attempts, 1)
+        self.stats = {"broadcasts": 0, "sent": 0, "failed": 0, "retry_after": 0}
+        # Runs in progress; low-priority senders wait for this to drop to 0
+        self.running = 0
+
+    def estimate_seconds(self, recipients: int) -> int:
+        return int(recipients / self.bucket.rate) + 1
+
+    async def deliver(self, bot: Bot, chat_id: int, content: BroadcastContent,
+                      result: Optional[Dict[str, Any]] = None) -> str:
+        """Send to one chat with retries, returns the outcome"""
+        for attempt in range(1, self.max_attempts + 1):
+            await self.bucket.acquire()
+            try:
+                sent = await content.send(bot, chat_id)
+                if content.needs_upload:
+                    content.remember_upload(sent)
+                return SENT
+            except TelegramRetryAfter as e:
+                self.bucket.pause(e.retry_after)
+                self.stats["retry_after"] += 1
+                if result is not None:
+                    result["retries"] += 1
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt == self.max_attempts:
+                    print(f"❌ Broadcast to {chat_id} failed after {attempt} attempts: {e}")
+                    return FAILED
+                if result is not None:
+                    result["retries"] += 1
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except Exception as e:
+                outcome = classify(e)
+                if outcome == FAILED:
+                    print(f"❌ Broadcast to {chat_id} failed: {e}")
+                return outcome
+        return FAILED
+
+    async def run(self, bot: Bot, recipients: Sequence[int], content: BroadcastContent,
+                  on_progress: Optional[ProgressCallback] = None,
+                  on_outcome: Optional[Callable[[int, str], None]] = None,
+                  progress_every: float = BROADCAST_PROGRESS_SECONDS,
+                  start: int = 0, stop: Optional[asyncio.Event] = None,
+                  result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Deliver content to recipients[start:] and return the counts:
+        total, done, sent, failed, blocked, deactivated, not_found, retries.
+
+        result["cursor"] is the position before which every recipient is
+        done (sends run concurrently, so a few after it may be too).
+        Setting stop ends the run early after the sends in flight; pass
+        the result of an earlier run to keep counting from it.
+        on_progress gets the dict every progress_every seconds,
+        on_outcome(chat_id, outcome) is called for each recipient.
+        """
+        if result is None:
+            result = new_result(len(recipients))
+        result["cursor"] = start
+        result["stopped"] = False
+        self.stats["broadcasts"] += 1
+        finished: Set[int] = set()
+
+        async def one(index: int, chat_id: int) -> None:
+            outcome = await self.deliver(bot, chat_id, content, result)
+            result[outcome] += 1
+            result["done"] += 1
+            self.stats["sent" if outcome == SENT else "failed"] += 1
+            finished.add(index)
+            while result["cursor"] in finished:
+                finished.discard(result["cursor"])
+                result["cursor"] += 1
+            if on_outcome is not None:
+                on_outcome(chat_id, outcome)
+
+        def stopping() -> bool:
+            if stop is not None and stop.is_set():
+                result["stopped"] = True
+            return result["stopped"]
+
+        reporter = None
+        if on_progress is not None:
+            reporter = asyncio.create_task(self._report(result, on_progress, progress_every))
+        self.running += 1
+        try:
+            queue = iter(enumerate(recipients[start:], start))
+            # An upload goes out alone first, the rest reuse its file_id
+            if content.needs_upload:
+                for index, chat_id in queue:
+                    if stopping():
+                        break
+                    await one(index, chat_id)
+                    if not content.needs_upload:
+                        break
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+            pending: Set[asyncio.Task] = set()
+            for index, chat_id in queue:
+                await semaphore.acquire()
+                if stopping():
+                    semaphore.release()
+                    break
+                task = asyncio.create_task(one(index, chat_id))
+                pending.add(task)
+                task.add_done_callback(lambda t: (pending.discard(t), semaphore.release()))
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            self.running -= 1
+            if reporter is not None:
+                reporter.cancel()
+        result["finished"] = time.time()
+        return result
+
+    async def _report(self, result: Dict[str, Any], on_progress: ProgressCallback, every: float) -> None:
+        while True:
+            await asyncio.sleep(every)
+            try:
+                await on_progress(result)
+            except Exception as e:
+                print(f"⚠️ Broadcast progress update failed: {e}")
+
+
+def new_result(total: int) -> Dict[str, Any]:
+    """Counters of a broadcast that has not sent anything yet"""
+    return {"total": total, "done": 0, "cursor": 0, SENT: 0, FAILED: 0, BLOCKED: 0, DEACTIVATED: 0,
+            NOT_FOUND: 0, "retries": 0, "started": time.time(), "finished": None, "stopped": False}
+
+
+def progress_text(result: Dict[str, Any]) -> str:
+    """Progress / summary lines shared by the admin broadcast screens"""
+    elapsed = max((result.get("finished") or time.time()) - result["started"], 0.001)
+    unreachable = result[BLOCKED] + result[DEACTIVATED] + result[NOT_FOUND]
+    return (f"📊 <b>Progress:</b> {result['done']:,}/{result['total']:,}\n"
+            f"• ✅ Sent: {result[SENT]:,}\n"
+            f"• 🚫 Blocked/deactivated/not found: {unreachable:,}\n"
+            f"• ❌ Failed: {result[FAILED]:,}\n"
+            f"• 🔁 Retries: {result['retries']:,}\n"
+            f"• ⚡ Speed: {result['done'] / elapsed:.1f} msg/s")
+
+
+# Shared engine: one token bucket for the whole bot
+broadcaster = Broadcaster()
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Broadcast Jobs - India Social Panel
+Persisted broadcasts that survive restarts and can be paused or cancelled
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import codec
+from broadcast import BroadcastContent, Broadcaster, broadcaster, new_result, progress_text
+from persistence import atomic_write_text, writer
+import reachability
+
+# ========== CONFIGURATION ==========
+BROADCAST_JOBS_DIR = os.getenv("BROADCAST_JOBS_DIR", "broadcast_jobs")
+# The cursor is saved after this many deliveries; a crash re-sends at most
+# this many (plus the sends in flight) when the job resumes
+BROADCAST_CHECKPOINT_EVERY = int(os.getenv("BROADCAST_CHECKPOINT_EVERY", "50"))
+# Finished jobs kept for /broadcast_status
+BROADCAST_JOBS_KEEP = int(os.getenv("BROADCAST_JOBS_KEEP", "20"))
+
+RUNNING = "running"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+COMPLETED = "completed"
+FINISHED_STATUSES = (CANCELLED, COMPLETED)
+
+
+class BroadcastJobs:
+    """
+    Every broadcast is a job: <id>.json holds the content, status, counters
+    and the cursor into <id>.recipients.json, which is written once when
+    the job is created. While a job runs its record is rewritten (on the
+    file writer thread) every BROADCAST_CHECKPOINT_EVERY deliveries and
+    whenever it pauses, is cancelled or finishes.
+
+    Jobs still marked running are resumed from their cursor by resume_all()
+    at startup. Progress goes to the admin's status message, the final
+    report to the admin's chat.
+    """
+
+    def __init__(self, directory: str = BROADCAST_JOBS_DIR, engine: Broadcaster = broadcaster,
+                 checkpoint_every: int = BROADCAST_CHECKPOINT_EVERY):
+        self.directory = directory
+        self.engine = engine
+        self.checkpoint_every = max(checkpoint_every, 1)
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._recipients: Dict[str, List[int]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._stops: Dict[str, asyncio.Event] = {}
+
+    # ----- files -----
+    def _path(self, job_id: str, suffix: str = ".json") -> str:
+        return os.path.join(self.directory, f"{job_id}{suffix}")
+
+    def load(self) -> int:
+        """Read every job record (startup), returns how many are unfinished"""
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name.endswith(".recipients.json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    job = codec.loads(f.read())
+            except (OSError, codec.DecodeError) as e:
+                print(f"⚠️ Skipping unreadable broadcast job {name}: {e}")
+                continue
+            self.jobs[job["job_id"]] = job
+        unfinished = sum(1 for job in self.jobs.values() if job["status"] not in FINISHED_STATUSES)
+        print(f"✅ Broadcast jobs: {len(self.jobs)} loaded, {unfinished} unfinished")
+        return unfinished
+
+    def _load_recipients(self, job_id: str) -> List[int]:
+        if job_id not in self._recipients:
+            with open(self._path(job_id, ".recipients.json"), 'r', encoding='utf-8') as f:
+                self._recipients[job_id] = codec.loads(f.read())
+        return self._recipients[job_id]
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        """Queue a write of the job record (a snapshot, safe to keep mutating)"""
+        job["updated_at"] = datetime.now().isoformat()
+        text = codec.dumps(job, pretty=False)
+        writer.submit(lambda: atomic_write_text(self._path(job["job_id"]), text), nbytes=len(text))
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond BROADCAST_JOBS_KEEP"""
+        finished = sorted((job for job in self.jobs.values() if job["status"] in FINISHED_STATUSES),
+                          key=lambda job: job["created_at"])
+        for job in finished[:max(len(finished) - BROADCAST_JOBS_KEEP, 0)]:
+            job_id = job["job_id"]
+            self.jobs.pop(job_id, None)
+            self._recipients.pop(job_id, None)
+
+            def remove(job_id=job_id) -> None:
+                for suffix in (".json", ".recipients.json"):
+                    try:
+                        os.remove(self._path(job_id, suffix))
+                    except FileNotFoundError:
+                        pass
+            writer.submit(remove)
+
+    # ----- jobs -----
+    async def create(self, bot, recipients: List[int], content: BroadcastContent, created_by: int,
+                     label: str = "Broadcast", status_chat_id: Optional[int] = None,
+                     status_message_id: Optional[int] = None) -> Dict[str, Any]:
+        """Persist a new job and start it"""
+        job_id = f"BC{datetime.now().strftime('%y%m%d%H%M')}{uuid.uuid4().hex[:4].upper()}"
+        recipients = [int(chat_id) for chat_id in recipients]
+        job = {
+            "job_id": job_id,
+            "label": label,
+            "created_by": created_by,
+            "created_at": datetime.now().isoformat(),
+            "status": RUNNING,
+            "content": content.to_dict(),
+            "status_chat_id": status_chat_id if status_chat_id is not None else created_by,
+            "status_message_id": status_message_id,
+            "result": new_result(len(recipients)),
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        recipients_text = codec.dumps(recipients, pretty=False)
+        # The recipient list must be on disk before the job record points at it
+        await writer.asubmit(lambda: atomic_write_text(self._path(job_id, ".recipients.json"), recipients_text),
+                             nbytes=len(recipients_text))
+        self._recipients[job_id] = recipients
+        self.jobs[job_id] = job
+        self._save(job)
+        self._start(bot, job, content)
+        return job
+
+    def _start(self, bot, job: Dict[str, Any], content: Optional[BroadcastContent] = None) -> None:
+        """
+        Start a run of job. Every run has its own stop event; a run that
+        was told to stop but has not finished yet (paused and resumed at
+        once) is waited for by the new run, which then goes on from its
+        cursor.
+        """
+        job_id = job["job_id"]
+        previous = self._tasks.get(job_id)
+        if previous is not None and not previous.done() and not self._stops[job_id].is_set():
+            return
+        stop = self._stops[job_id] = asyncio.Event()
+        task = asyncio.create_task(self._run(bot, job, content or BroadcastContent.from_dict(job["content"]),
+                                             stop, previous))
+        self._tasks[job_id] = task
+
+        def forget(done: asyncio.Task) -> None:
+            if self._tasks.get(job_id) is done:
+                del self._tasks[job_id]
+        task.add_done_callback(forget)
+
+    async def _run(self, bot, job: Dict[str, Any], content: BroadcastContent, stop: asyncio.Event,
+                   previous: Optional[asyncio.Task] = None) -> None:
+        job_id = job["job_id"]
+        result = job["result"]
+        if previous is not None and not previous.done():
+            await asyncio.wait([previous])
+            # The media file_id the previous run uploaded is in the record now
+            content = BroadcastContent.from_dict(job["content"])
+        if content.media_type and content.media is None:
+            # Resumed before the upload's file_id reached disk: nothing to send
+            job["status"] = CANCELLED
+            job["note"] = "media upload lost in a restart"
+            self._save(job)
+            return
+        recipients = await asyncio.to_thread(self._load_recipients, job_id)
+        since_checkpoint = 0
+
+        def on_outcome(chat_id: int, outcome: str) -> None:
+            nonlocal since_checkpoint
+            since_checkpoint += 1
+            reachability.record_outcome(chat_id, outcome)
+            # Media uploaded with the first send is reused from here on,
+            # so its file_id is saved right away
+            uploaded = job["content"]["media_type"] and job["content"]["media"] is None and not content.needs_upload
+            if since_checkpoint >= self.checkpoint_every or uploaded:
+                since_checkpoint = 0
+                job["content"] = content.to_dict()
+                self._save(job)
+                reachability.schedule_flush()
+
+        async def on_progress(progress: Dict[str, Any]) -> None:
+            if job.get("status_message_id"):
+                await bot.edit_message_text(
+                    chat_id=job["status_chat_id"], message_id=job["status_message_id"],
+                    text=f"📢 <b>{job['label']}</b> (<code>{job_id}</code>)\n\n{progress_text(progress)}")
+
+        try:
+            await self.engine.run(bot, recipients, content, on_progress=on_progress, on_outcome=on_outcome,
+                                  start=result["cursor"], stop=stop, result=result)
+        finally:
+            job["content"] = content.to_dict()
+            await reachability.flush()
+            if job["status"] == RUNNING and not result["stopped"] and result["cursor"] >= result["total"]:
+                job["status"] = COMPLETED
+            self._save(job)
+
+        if job["status"] in FINISHED_STATUSES:
+            print(f"📢 BROADCAST JOB {job_id}: {job['status']}, {result['sent']}/{result['total']} delivered")
+            try:
+                await bot.send_message(
+                    chat_id=job["status_chat_id"],
+                    text=f"{'✅' if job['status'] == COMPLETED else '🛑'} <b>{job['label']} {job['status']}</b> "
+                         f"(<code>{job_id}</code>)\n\n{progress_text(result)}")
+            except Exception as e:
+                print(f"⚠️ Could not report broadcast job {job_id}: {e}")
+            self._prune()
+
+    def pause(self, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        if not job or job["status"] != RUNNING:
+            return False
+        job["status"] = PAUSED
+        if job_id in self._stops:
+            self._stops[job_id].set()
+        self._save(job)
+        return True
+
+    def resume(self, bot, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        if not job or job["status"] != PAUSED:
+            return False
+        job["status"] = RUNNING
+        self._save(job)
+        self._start(bot, job)
+        return True
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        if not job or job["status"] in FINISHED_STATUSES:
+            return False
+        was_running = job_id in self._tasks
+        job["status"] = CANCELLED
+        if job_id in self._stops:
+            self._stops[job_id].set()
+        if not was_running:
+            # Paused: no run will finish it, so record and tidy up here
+            job["result"]["finished"] = time.time()
+            self._save(job)
+            self._prune()
+        return True
+
+    def resume_all(self, bot) -> int:
+        """Restart every job that was running when the bot stopped"""
+        resumed = 0
+        for job in list(self.jobs.values()):
+            if job["status"] == RUNNING:
+                print(f"🔄 Resuming broadcast job {job['job_id']} at {job['result']['cursor']}/{job['result']['total']}")
+                self._start(bot, job)
+                resumed += 1
+        return resumed
+
+    async def shutdown(self) -> None:
+        """Stop running jobs (still marked running, so they resume) and save their cursors"""
+        for job_id, stop in list(self._stops.items()):
+            stop.set()
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=10)
+        for job in self.jobs.values():
+            if job["status"] == RUNNING:
+                self._save(job)
+
+    # ----- queries -----
+    def active(self) -> List[Dict[str, Any]]:
+        return [job for job in self.jobs.values() if job["status"] in (RUNNING, PAUSED)]
+
+    def latest(self, limit: int = 5) -> List[Dict[str, Any]]:
+        return sorted(self.jobs.values(), key=lambda job: job["created_at"], reverse=True)[:limit]
+
+    def find(self, job_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """job_id, or the single active job when none is given"""
+        if job_id:
+            return self.jobs.get(job_id.strip().upper())
+        active = self.active()
+        return active[0] if len(active) == 1 else None
+
+
+broadcast_jobs = BroadcastJobs()
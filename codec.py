@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+JSON Codec - India Social Panel
+Fast JSON encoding for persistence: orjson when installed, stdlib otherwise
+
+Usage:
+    python codec.py pretty users.json [users.pretty.json]
+"""
+
+import json
+import os
+import sys
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:  # optional speedup, stdlib json is always available
+    orjson = None
+
+# ========== CONFIGURATION ==========
+# Compact output in production; set PERSIST_JSON_PRETTY=1 for hand-readable files
+PRETTY = os.getenv("PERSIST_JSON_PRETTY", "0") == "1"
+# PERSIST_JSON_CODEC=stdlib forces the fallback (benchmarks, debugging)
+BACKEND = "orjson" if orjson is not None and os.getenv("PERSIST_JSON_CODEC", "auto") != "stdlib" else "stdlib"
+
+if orjson is not None:
+    # Int user ids as keys, and datetimes through default=str like stdlib
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+DecodeError = ValueError  # json.JSONDecodeError and orjson.JSONDecodeError both subclass it
+
+
+def _default(obj: Any) -> Any:
+    """Compact records (records.py) as their dict, anything else unknown as str"""
+    to_dict = getattr(obj, "to_dict", None)
+    return to_dict() if to_dict is not None else str(obj)
+
+
+def _stdlib_dumps(data: Any, pretty: bool, sort_keys: bool) -> str:
+    if pretty:
+        return json.dumps(data, indent=2, ensure_ascii=False, default=_default, sort_keys=sort_keys)
+    return json.dumps(data, ensure_ascii=False, default=_default, sort_keys=sort_keys, separators=(",", ":"))
+
+
+def dumps(data: Any, pretty: Optional[bool] = None, sort_keys: bool = False) -> str:
+    """Serialize data to JSON text (compact unless pretty, or PRETTY when not given)"""
+    pretty = PRETTY if pretty is None else pretty
+    if BACKEND == "orjson":
+        options = _ORJSON_OPTIONS
+        if pretty:
+            options |= orjson.OPT_INDENT_2
+        if sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(data, default=_default, option=options).decode("utf-8")
+        except TypeError:
+            # Integers beyond 64 bits, mixed key types under sort_keys, ...
+            pass
+    return _stdlib_dumps(data, pretty, sort_keys)
+
+
+def loads(text: Any) -> Any:
+    """Parse JSON text (str or bytes)"""
+    if BACKEND == "orjson":
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def pretty_dump(source: str, target: Optional[str] = None) -> str:
+    """Write an indented copy of a compact data file for debugging, returns its path"""
+    if target is None:
+        root, ext = os.path.splitext(source)
+        target = f"{root}.pretty{ext or '.json'}"
+    with open(source, 'r', encoding='utf-8') as f:
+        content = f.read()
+    data = loads(content) if content.strip() else {}
+    with open(target, 'w', encoding='utf-8') as f:
+        f.write(dumps(data, pretty=True))
+    return target
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "pretty":
+        print("Usage: python codec.py pretty <file.json> [output.json]")
+        sys.exit(1)
+    written = pretty_dump(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    print(f"✅ Pretty copy of {sys.argv[2]} written to {written} ({BACKEND})")
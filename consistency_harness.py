@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Consistency Harness - India Social Panel
+Failure and race checks for storage transactions and background jobs
+
+Each check builds its own backend, collections or job runner in a
+temporary directory, provokes one failure or race and checks that the
+data stays consistent afterwards. No token or network is needed.
+
+Usage:
+    python consistency_harness.py                        # every check
+    python consistency_harness.py transaction_rollback   # some checks
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import traceback
+from typing import Any, Awaitable, Callable, Dict, List
+
+
+def check(condition: bool, message: str) -> None:
+    if not condition:
+        raise AssertionError(message)
+
+
+# ========== CHECKS ==========
+async def transaction_rollback() -> str:
+    """A commit failing on the writer thread rolls back balance, indexes, the log and the files"""
+    import storage
+    from indexes import UserSummaryIndex
+    from persistence import writer
+    from transaction_log import TransactionLog
+    from user_shards import UserShardStore
+
+    shards = UserShardStore(directory="tx_users", shard_count=4)
+    shards.prepare()
+    backend = storage.JsonStorageBackend(user_shards=shards, tx_log=TransactionLog("tx_check.jsonl"))
+    users = storage.StoredCollection("users", backend)
+    summary = UserSummaryIndex()
+    users.add_index(summary)
+    users[7] = {"user_id": 7, "balance": 100.0, "total_spent": 0.0, "account_created": True}
+    users.save()
+    await writer.asubmit(lambda: None)
+
+    write_now = shards.write_now
+
+    def failing_write(changed: Any, deleted: Any) -> None:
+        # The shard reaches disk, then the commit fails
+        write_now(changed, deleted)
+        raise OSError("disk full (injected)")
+
+    shards.write_now = failing_write
+    # What storage.transaction() does, against this backend
+    tx = storage.Transaction(backend)
+    user = tx.get(users, 7)
+    user["balance"] -= 40.0
+    user["total_spent"] += 40.0
+    try:
+        await tx.commit()
+    except OSError:
+        tx.rollback()
+    else:
+        raise AssertionError("the failed write was not surfaced")
+    del shards.write_now
+
+    check(users[7]["balance"] == 100.0, f"balance not rolled back: {users[7]['balance']}")
+    check(summary.total_balance == 100.0, f"summary index not rolled back: {summary.total_balance}")
+    check(not backend.tx_log.pending(), "failed commit left in the transaction log")
+    # The record must be rewritten, whatever part of the commit reached disk
+    users.save()
+    await writer.asubmit(lambda: None)
+    check(shards.load_one(7)["balance"] == 100.0, "rolled-back record not rewritten")
+    return "balance, summary index and log restored"
+
+
+class FakeBot:
+    """Records broadcast deliveries; every send takes a moment, like the real API"""
+
+    def __init__(self):
+        self.delivered: List[int] = []
+
+    async def send_message(self, chat_id: int, text: str = "", **kwargs: Any) -> None:
+        await asyncio.sleep(0.001)
+        if chat_id > 0:
+            self.delivered.append(chat_id)
+
+    async def edit_message_text(self, **kwargs: Any) -> None:
+        return None
+
+
+async def broadcast_pause_resume() -> str:
+    """A resume that arrives before the paused run has stopped still finishes the job"""
+    from broadcast import BroadcastContent, Broadcaster, TokenBucket
+    from broadcast_jobs import COMPLETED, BroadcastJobs
+
+    jobs = BroadcastJobs(directory="jobs_check", engine=Broadcaster(TokenBucket(10_000, 10_000), concurrency=1))
+    bot = FakeBot()
+    recipients = list(range(1, 41))
+    job = await jobs.create(bot, recipients, BroadcastContent("hello"), created_by=-1)
+    job_id = job["job_id"]
+    while len(bot.delivered) < 5:
+        await asyncio.sleep(0.001)
+    check(jobs.pause(job_id), "pause refused")
+    check(jobs.resume(bot, job_id), "resume refused")
+    for _ in range(2000):
+        if job["status"] == COMPLETED and job_id not in jobs._tasks:
+            break
+        await asyncio.sleep(0.005)
+    check(job["status"] == COMPLETED, f"job left {job['status']} at {job['result']['cursor']}/40")
+    check(sorted(set(bot.delivered)) == recipients, "some recipients were never sent to")
+    return f"completed, {len(bot.delivered)} deliveries for 40 recipients"
+
+
+async def archive_reopened_order() -> str:
+    """An order reopened while an archiving run compresses it stays hot and out of the archive"""
+    import storage
+    from order_archive import archive_orders, order_archive
+
+    orders = storage.StoredCollection("orders", storage.JsonStorageBackend())
+    for n in range(1, 5):
+        orders[f"ORD{n}"] = {"order_id": f"ORD{n}", "user_id": 7, "status": "completed",
+                             "created_at": f"2020-01-0{n}T10:00:00"}
+    pack = order_archive.pack
+
+    def pack_and_reopen(candidates: Dict[str, Dict[str, Any]]) -> Any:
+        # An admin reopens ORD2 while the run is busy compressing
+        orders.raw["ORD2"]["status"] = "processing"
+        return pack(candidates)
+
+    order_archive.pack = pack_and_reopen
+    try:
+        archived = await archive_orders(orders, max_age_days=30)
+    finally:
+        del order_archive.pack
+    archived_ids = sorted(order["order_id"] for order in order_archive.orders_for_user(7))
+    check(archived == 3, f"reported {archived} archived, expected 3")
+    check(list(orders.keys()) == ["ORD2"], f"hot set is {list(orders.keys())}")
+    check(archived_ids == ["ORD1", "ORD3", "ORD4"], f"archive holds {archived_ids}")
+    check(order_archive.count_for_user(7) == 3, f"archive counts {order_archive.count_for_user(7)} orders")
+    return "reopened order stays hot, 3 archived once"
+
+
+async def lazy_cache_bound() -> str:
+    """The lazy users cache shrinks back to cache_size once a save's shard writes land"""
+    import storage
+    from persistence import writer
+    from user_shards import UserShardStore
+
+    shards = UserShardStore(directory="cache_users", shard_count=4)
+    shards.prepare()
+    users = storage.LazyStoredCollection("users", storage.JsonStorageBackend(user_shards=shards), cache_size=2)
+    for user_id in range(1, 21):
+        users[user_id] = {"user_id": user_id, "balance": 0.0, "account_created": True}
+    users.save()
+    for user_id in range(1, 21):
+        users[user_id]["balance"] += 5.0
+    check(len(users.raw) == 20, "records read since the last save must stay cached")
+    users.save()
+    await writer.asubmit(lambda: None)
+    await asyncio.sleep(0.01)
+    cached = len(users.raw)
+    check(cached <= 2, f"{cached} records cached after the writes landed, cache_size is 2")
+    check(users[13]["balance"] == 5.0, "change lost across eviction")
+    return f"{cached} cached, {users.cache_stats['evictions']} evictions"
+
+
+CHECKS: Dict[str, Callable[[], Awaitable[str]]] = {
+    "transaction_rollback": transaction_rollback,
+    "broadcast_pause_resume": broadcast_pause_resume,
+    "archive_reopened_order": archive_reopened_order,
+    "lazy_cache_bound": lazy_cache_bound,
+}
+
+
+async def run_checks(selected: List[str]) -> int:
+    failures = 0
+    for name, run in CHECKS.items():
+        if selected and name not in selected:
+            continue
+        try:
+            ok, detail = True, await run()
+        except Exception:
+            ok, detail = False, traceback.format_exc(limit=3).strip().splitlines()[-1]
+        failures += not ok
+        print(f"  {'PASS' if ok else 'FAIL'}  {name:<28}{detail}")
+    return failures
+
+
+def main(selected: List[str]) -> None:
+    print("Consistency harness")
+    workdir = tempfile.mkdtemp(prefix="consistency_harness_")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    failures = asyncio.run(run_checks(selected))
+    print(f"\n{'All checks passed' if not failures else f'{failures} check(s) failed'} (workdir {workdir})")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Expiring Containers - India Social Panel
+Size-capped dict/log with per-entry TTL, swept by a timing wheel
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+# ========== CONFIGURATION ==========
+WHEEL_TICK_SECONDS = 1.0
+WHEEL_SLOTS = 512
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel: one slot per tick, a key is filed under the tick
+    of its deadline. Each tick only the current slot is looked at, so the
+    sweep cost depends on what expires now, not on how much is stored.
+
+    Entries are re-filed lazily: when a key's deadline moved (sliding TTL)
+    or lies more than one turn ahead, it goes back into the wheel instead
+    of expiring. Owners (TTLDict, the FSM storage) decide that in
+    _check(key, now).
+    """
+
+    def __init__(self, tick: float = WHEEL_TICK_SECONDS, slots: int = WHEEL_SLOTS):
+        self.tick = tick
+        self._slots: List[List[Tuple[Any, Any]]] = [[] for _ in range(slots)]
+        self._cursor = int(time.monotonic() / tick)
+
+    def schedule(self, owner: Any, key: Any, deadline: float) -> None:
+        tick = max(int(deadline / self.tick), self._cursor + 1)
+        self._slots[tick % len(self._slots)].append((owner, key))
+
+    def advance(self, now: Optional[float] = None) -> int:
+        """Process every tick up to now, returns how many entries expired"""
+        now = time.monotonic() if now is None else now
+        target = int(now / self.tick)
+        expired = 0
+        # After a long stall one full turn visits every slot once
+        start = max(self._cursor + 1, target - len(self._slots) + 1)
+        for tick in range(start, target + 1):
+            slot = self._slots[tick % len(self._slots)]
+            if not slot:
+                continue
+            self._slots[tick % len(self._slots)] = []
+            self._cursor = tick
+            for owner, key in slot:
+                expired += owner._check(key, now)
+        self._cursor = max(self._cursor, target)
+        return expired
+
+
+# Shared wheel and every container created, for the sweeper and /static
+wheel = TimingWheel()
+registry: Dict[str, Any] = {}
+
+
+class TTLDict(MutableMapping):
+    """
+    Dict whose entries expire ttl seconds after they were last written
+    (or also read, with sliding=True), holding at most max_size entries.
+
+    Over the cap the least recently used entry is dropped. Expired entries
+    vanish on access right away and are removed by the timing wheel
+    sweeper otherwise. Only [] / get() count as a read: iterating,
+    values(), items(), peek() and len() never extend a TTL.
+    """
+
+    def __init__(self, name: str, ttl: float, max_size: int, sliding: bool = False,
+                 timing_wheel: TimingWheel = wheel):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max(max_size, 1)
+        self.sliding = sliding
+        self._wheel = timing_wheel
+        self._data: "OrderedDict[Any, Any]" = OrderedDict()
+        self._deadlines: Dict[Any, float] = {}
+        # Keys with an entry in the wheel (exactly one each)
+        self._scheduled: Set[Any] = set()
+        self.stats = {"expired": 0, "evicted": 0}
+        registry[name] = self
+
+    def _touch(self, key: Any) -> None:
+        self._deadlines[key] = time.monotonic() + self.ttl
+        self._data.move_to_end(key)
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            self._wheel.schedule(self, key, self._deadlines[key])
+
+    def _drop(self, key: Any) -> None:
+        self._data.pop(key, None)
+        self._deadlines.pop(key, None)
+
+    def _live(self, key: Any) -> bool:
+        deadline = self._deadlines.get(key)
+        if deadline is None:
+            return False
+        if deadline <= time.monotonic():
+            self._drop(key)
+            self.stats["expired"] += 1
+            return False
+        return True
+
+    def _check(self, key: Any, now: float) -> int:
+        """Called by the wheel when key's slot comes up"""
+        deadline = self._deadlines.get(key)
+        if deadline is None:
+            self._scheduled.discard(key)
+            return 0
+        if deadline <= now:
+            self._drop(key)
+            self._scheduled.discard(key)
+            self.stats["expired"] += 1
+            return 1
+        self._wheel.schedule(self, key, deadline)
+        return 0
+
+    # ----- mapping protocol -----
+    def __getitem__(self, key: Any) -> Any:
+        if not self._live(key):
+            raise KeyError(key)
+        if self.sliding:
+            self._touch(key)
+        return self._data[key]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self._data[key] = value
+        self._touch(key)
+        while len(self._data) > self.max_size:
+            oldest, _ = self._data.popitem(last=False)
+            self._deadlines.pop(oldest, None)
+            self.stats["evicted"] += 1
+
+    def __delitem__(self, key: Any) -> None:
+        if not self._live(key):
+            raise KeyError(key)
+        self._drop(key)
+
+    def __contains__(self, key: object) -> bool:
+        return self._live(key)
+
+    def __iter__(self) -> Iterator[Any]:
+        now = time.monotonic()
+        return iter([key for key, deadline in self._deadlines.items() if deadline > now])
+
+    def __len__(self) -> int:
+        # Expired entries the sweeper has not reached yet do not count
+        now = time.monotonic()
+        return sum(1 for deadline in self._deadlines.values() if deadline > now)
+
+    def items(self) -> List[Tuple[Any, Any]]:
+        return [(key, self._data[key]) for key in self]
+
+    def values(self) -> List[Any]:
+        return [self._data[key] for key in self]
+
+    def peek(self, key: Any, default: Any = None) -> Any:
+        """The live value of key (or default) without counting as a read"""
+        return self._data[key] if self._live(key) else default
+
+    def __repr__(self) -> str:
+        return f"<TTLDict {self.name} ({len(self)}/{self.max_size}, ttl {self.ttl:.0f}s)>"
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._deadlines.clear()
+
+
+class ExpiringLog:
+    """
+    Append-only list of recent entries: at most max_size, none older
+    than ttl seconds. Supports the list operations the admin screens use
+    (append, len, iteration, indexing and slicing, clear).
+    """
+
+    def __init__(self, name: str, ttl: float, max_size: int):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max(max_size, 1)
+        self._items: Deque[Tuple[float, Any]] = deque(maxlen=self.max_size)
+        self.stats = {"expired": 0, "evicted": 0}
+        registry[name] = self
+
+    def purge(self, now: Optional[float] = None) -> int:
+        """Drop entries past their TTL (they are in time order), returns how many"""
+        cutoff = (time.monotonic() if now is None else now) - self.ttl
+        dropped = 0
+        while self._items and self._items[0][0] <= cutoff:
+            self._items.popleft()
+            dropped += 1
+        self.stats["expired"] += dropped
+        return dropped
+
+    def append(self, item: Any) -> None:
+        if len(self._items) == self.max_size:
+            self.stats["evicted"] += 1
+        self._items.append((time.monotonic(), item))
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def __len__(self) -> int:
+        self.purge()
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[Any]:
+        self.purge()
+        return iter([item for _, item in self._items])
+
+    def __getitem__(self, index):
+        self.purge()
+        items = [item for _, item in self._items]
+        return items[index]
+
+    def __repr__(self) -> str:
+        return f"<ExpiringLog {self.name} ({len(self)}/{self.max_size}, ttl {self.ttl:.0f}s)>"
+
+
+def sweep(now: Optional[float] = None) -> int:
+    """One sweeper step: advance the wheel and trim the logs"""
+    now = time.monotonic() if now is None else now
+    expired = wheel.advance(now)
+    for container in registry.values():
+        if isinstance(container, ExpiringLog):
+            expired += container.purge(now)
+    return expired
+
+
+async def run_sweeper(interval: float = WHEEL_TICK_SECONDS) -> None:
+    """Background task driving the timing wheel"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            sweep()
+        except Exception as e:
+            print(f"❌ Expiry sweep failed: {e}")
+
+
+def sizes() -> Dict[str, Dict[str, Any]]:
+    """Size, cap and counters of every container, for /static"""
+    return {name: {"size": len(container), "max_size": container.max_size, **container.stats}
+            for name, container in registry.items()}
@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+"""
+Secondary Indexes - India Social Panel
+In-memory indexes kept up to date by the stored collections
+"""
+
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _owner_id(order: Dict[str, Any]) -> Optional[int]:
+    """Normalized owner of an order (user_id, or customer_id on older records)"""
+    owner = order.get('user_id') or order.get('customer_id')
+    try:
+        return int(owner) if owner is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class UserOrderIndex:
+    """
+    user_id -> order ids sorted by created_at, plus per-user status counts.
+
+    Kept current by the orders collection on every insert, save and
+    delete, so history pages and per-user stats never scan all orders.
+    """
+
+    def __init__(self):
+        # order_id -> (owner, created_at, status) as currently indexed
+        self._entries: Dict[str, Tuple[Optional[int], str, Any]] = {}
+        # owner -> ascending list of (created_at, order_id)
+        self._by_user: Dict[int, List[Tuple[str, str]]] = {}
+        self._status_counts: Dict[int, Counter] = {}
+
+    def rebuild(self, rows: Dict[str, Dict[str, Any]]) -> None:
+        """Rebuild from scratch after a collection (re)load"""
+        self._entries.clear()
+        self._by_user.clear()
+        self._status_counts.clear()
+        # Append unsorted and sort once: cheaper than insort per order on a cold load
+        for order_id, order in rows.items():
+            owner = _owner_id(order)
+            status = order.get('status', 'pending')
+            created_at = str(order.get('created_at') or '')
+            self._entries[order_id] = (owner, created_at, status)
+            if owner is None:
+                continue
+            self._by_user.setdefault(owner, []).append((created_at, order_id))
+            self._status_counts.setdefault(owner, Counter())[status] += 1
+        for entries in self._by_user.values():
+            entries.sort()
+
+    def _remove(self, order_id: str) -> None:
+        owner, created_at, status = self._entries.pop(order_id)
+        if owner is None:
+            return
+        entries = self._by_user.get(owner, [])
+        pos = bisect_left(entries, (created_at, order_id))
+        if pos < len(entries) and entries[pos] == (created_at, order_id):
+            del entries[pos]
+        counts = self._status_counts.get(owner)
+        if counts is not None:
+            counts[status] -= 1
+            if counts[status] <= 0:
+                del counts[status]
+        if not entries:
+            self._by_user.pop(owner, None)
+            self._status_counts.pop(owner, None)
+
+    def update(self, order_id: str, order: Optional[Dict[str, Any]]) -> None:
+        """Index a new or changed order, or drop it when order is None"""
+        previous = self._entries.get(order_id)
+        if order is None:
+            if previous is not None:
+                self._remove(order_id)
+            return
+
+        owner = _owner_id(order)
+        # Some status updates replace the record without created_at;
+        # keep the original position in the user's history in that case
+        created_at = str(order.get('created_at') or (previous[1] if previous else ''))
+        status = order.get('status', 'pending')
+        entry = (owner, created_at, status)
+        if previous == entry:
+            return
+        if previous is not None:
+            self._remove(order_id)
+
+        self._entries[order_id] = entry
+        if owner is None:
+            return
+        insort(self._by_user.setdefault(owner, []), (created_at, order_id))
+        self._status_counts.setdefault(owner, Counter())[status] += 1
+
+    def orders_for_user(self, user_id: int, offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        """Order ids of user_id, newest first, sliced to one page"""
+        entries = self._by_user.get(user_id)
+        if not entries:
+            return []
+        end = len(entries) - offset
+        start = 0 if limit is None else max(end - limit, 0)
+        return [order_id for _, order_id in reversed(entries[start:max(end, 0)])]
+
+    def count_for_user(self, user_id: int, status: Optional[str] = None) -> int:
+        """Number of orders of user_id, optionally only with the given status"""
+        if status is None:
+            return len(self._by_user.get(user_id, ()))
+        return self._status_counts.get(user_id, Counter()).get(status, 0)
+
+    def status_counts(self, user_id: int) -> Dict[Any, int]:
+        """Per-status order counts of user_id"""
+        return dict(self._status_counts.get(user_id, {}))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def normalize_phone(phone: Any, default_country_code: str = "91") -> Optional[str]:
+    """Normalize a phone number to E.164 (+<country><number>), Indian numbers by default"""
+    if not phone:
+        return None
+    raw = str(phone).strip()
+    digits = "".join(ch for ch in raw if ch.isdigit())
+    if not digits:
+        return None
+    if raw.startswith("+"):
+        return f"+{digits}"
+    if raw.startswith("00"):
+        return f"+{digits[2:]}"
+    if len(digits) == 11 and digits.startswith("0"):
+        digits = digits[1:]
+    if len(digits) == 10:
+        return f"+{default_country_code}{digits}"
+    return f"+{digits}"
+
+
+def normalize_email(email: Any) -> Optional[str]:
+    """Lowercased, trimmed email"""
+    if not email:
+        return None
+    return str(email).strip().lower() or None
+
+
+class UserLookupIndex:
+    """
+    Hash indexes on normalized phone, lowercased email and access token.
+
+    Login and account recovery resolve a user in O(1) instead of walking
+    every profile. Kept current by the users collection like the order
+    index, so profile edits, Telegram syncs and new accounts are picked up
+    as soon as they are assigned or saved.
+    """
+
+    FIELDS = {
+        "phone": lambda user: normalize_phone(user.get('phone_number')),
+        "email": lambda user: normalize_email(user.get('email')),
+        "access_token": lambda user: (user.get('access_token') or None),
+    }
+
+    def __init__(self):
+        # field -> value -> user ids (dict used as an insertion-ordered set)
+        self._maps: Dict[str, Dict[str, Dict[int, None]]] = {field: {} for field in self.FIELDS}
+        # user_id -> {field: indexed value}
+        self._entries: Dict[int, Dict[str, Optional[str]]] = {}
+
+    def rebuild(self, rows: Dict[int, Dict[str, Any]]) -> None:
+        for field_map in self._maps.values():
+            field_map.clear()
+        self._entries.clear()
+        for user_id, user in rows.items():
+            self.update(user_id, user)
+
+    def update(self, user_id: int, user: Optional[Dict[str, Any]]) -> None:
+        """Index a new or changed user, or drop it when user is None"""
+        previous = self._entries.get(user_id, {})
+        current = {field: extract(user) for field, extract in self.FIELDS.items()} if user is not None else {}
+        if previous == current:
+            return
+        for field, value in previous.items():
+            if value is not None and current.get(field) != value:
+                ids = self._maps[field].get(value)
+                if ids is not None:
+                    ids.pop(user_id, None)
+                    if not ids:
+                        del self._maps[field][value]
+        for field, value in current.items():
+            if value is not None:
+                self._maps[field].setdefault(value, {})[user_id] = None
+        if user is None:
+            self._entries.pop(user_id, None)
+        else:
+            self._entries[user_id] = current
+
+    def by_phone(self, phone: Any) -> List[int]:
+        return list(self._maps["phone"].get(normalize_phone(phone), ()))
+
+    def by_email(self, email: Any) -> List[int]:
+        return list(self._maps["email"].get(normalize_email(email), ()))
+
+    def by_access_token(self, access_token: Any) -> List[int]:
+        return list(self._maps["access_token"].get((access_token or "").strip(), ()))
+
+    def by_phone_and_email(self, phone: Any, email: Any) -> List[int]:
+        """Users matching both phone and email, smallest posting list first"""
+        phone_ids = self._maps["phone"].get(normalize_phone(phone), {})
+        email_ids = self._maps["email"].get(normalize_email(email), {})
+        small, large = (phone_ids, email_ids) if len(phone_ids) <= len(email_ids) else (email_ids, phone_ids)
+        return [user_id for user_id in small if user_id in large]
+
+
+class UserSummaryIndex:
+    """
+    user_id -> (account_created, balance, total_spent, has_orders, join day)
+    for every user.
+
+    The always-resident part of the lazy users collection: membership,
+    len() and the account/balance/spend totals on admin screens come from
+    here without loading full profiles.
+    """
+
+    def __init__(self):
+        self._entries: Dict[int, Tuple[bool, float, float, bool, str]] = {}
+        self.accounts_created = 0
+        self.total_balance = 0.0
+        self.total_spent = 0.0
+        self.users_with_orders = 0
+        self._joined: Dict[str, int] = {}
+
+    def rebuild(self, rows: Dict[int, Dict[str, Any]]) -> None:
+        self._entries.clear()
+        self.accounts_created = 0
+        self.total_balance = 0.0
+        self.total_spent = 0.0
+        self.users_with_orders = 0
+        self._joined.clear()
+        for user_id, user in rows.items():
+            self.update(user_id, user)
+
+    @staticmethod
+    def _amount(value: Any) -> float:
+        try:
+            return float(value or 0.0)
+        except (TypeError, ValueError):
+            return 0.0
+
+    def update(self, user_id: int, user: Optional[Dict[str, Any]]) -> None:
+        """Index a new or changed user, or drop it when user is None"""
+        previous = self._entries.pop(user_id, None)
+        if previous is not None:
+            self.accounts_created -= previous[0]
+            self.total_balance -= previous[1]
+            self.total_spent -= previous[2]
+            self.users_with_orders -= previous[3]
+            self._joined[previous[4]] -= 1
+            if not self._joined[previous[4]]:
+                del self._joined[previous[4]]
+        if user is None:
+            return
+        try:
+            has_orders = int(user.get('orders_count', 0) or 0) > 0
+        except (TypeError, ValueError):
+            has_orders = False
+        entry = (bool(user.get('account_created', False)), self._amount(user.get('balance')),
+                 self._amount(user.get('total_spent')), has_orders, _day(user.get('join_date')))
+        self._entries[user_id] = entry
+        self.accounts_created += entry[0]
+        self.total_balance += entry[1]
+        self.total_spent += entry[2]
+        self.users_with_orders += entry[3]
+        self._joined[entry[4]] = self._joined.get(entry[4], 0) + 1
+
+    def joined_on(self, day: str) -> int:
+        """Users whose join_date falls on day (YYYY-MM-DD)"""
+        return self._joined.get(day, 0)
+
+    def get(self, user_id: int) -> Optional[Tuple[bool, float, float, bool, str]]:
+        return self._entries.get(user_id)
+
+    def __contains__(self, user_id: Any) -> bool:
+        return user_id in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class UserReachabilityIndex:
+    """
+    user_id -> (delivery_status, delivery_checked_at) for every user the
+    bot could not reach last time (blocked, deactivated, chat not found).
+
+    Only unreachable users are held, so broadcasts filter their audience
+    with one set lookup per user and the re-probe finds who is due
+    without loading profiles.
+    """
+
+    def __init__(self):
+        self._entries: Dict[int, Tuple[str, str]] = {}
+
+    def rebuild(self, rows: Dict[int, Dict[str, Any]]) -> None:
+        self._entries.clear()
+        for user_id, user in rows.items():
+            self.update(user_id, user)
+
+    def update(self, user_id: int, user: Optional[Dict[str, Any]]) -> None:
+        """Index a new or changed user, or drop it when user is None"""
+        status = user.get('delivery_status') if user is not None else None
+        if not status:
+            self._entries.pop(user_id, None)
+            return
+        self._entries[user_id] = (status, str(user.get('delivery_checked_at') or ''))
+
+    def status(self, user_id: int) -> Optional[str]:
+        entry = self._entries.get(user_id)
+        return entry[0] if entry else None
+
+    def status_counts(self) -> Dict[str, int]:
+        """Unreachable users per delivery status"""
+        return dict(Counter(status for status, _ in self._entries.values()))
+
+    def checked_before(self, cutoff: str, limit: Optional[int] = None) -> List[int]:
+        """Unreachable users last checked before cutoff (ISO time), oldest first"""
+        due = sorted((checked_at, user_id) for user_id, (_, checked_at) in self._entries.items()
+                     if checked_at < cutoff)
+        return [user_id for _, user_id in due[:limit]]
+
+    def __contains__(self, user_id: Any) -> bool:
+        return user_id in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Lower bounds (₹) of the total_spent buckets, with their segment labels
+SPENT_BUCKETS: Tuple[Tuple[float, str], ...] = (
+    (0, "0"), (0.01, "1-499"), (500, "500-1999"), (2000, "2000-9999"), (10000, "10000+"))
+
+
+def spent_bucket(total_spent: Any) -> str:
+    try:
+        amount = float(total_spent or 0.0)
+    except (TypeError, ValueError):
+        amount = 0.0
+    label = SPENT_BUCKETS[0][1]
+    for lower, bucket in SPENT_BUCKETS:
+        if amount >= lower:
+            label = bucket
+    return label
+
+
+def _day(value: Any) -> str:
+    """YYYY-MM-DD part of an ISO date/time, '' when there is none"""
+    return str(value or '')[:10]
+
+
+class UserSegmentIndex:
+    """
+    Segment name -> user ids for the segments derived from the profile:
+    account_created, has_spent, spent:<bucket>, status:<status> and
+    lang:<code>, plus users grouped by the day they were last active
+    (last_active, or join_date before any activity was recorded).
+
+    Kept current by the users collection like the other user indexes, so
+    a segment is always ready as a set and costs nothing to count.
+    """
+
+    def __init__(self):
+        self._members: Dict[str, Dict[int, None]] = {}
+        self._by_day: Dict[str, Dict[int, None]] = {}
+        # user_id -> (segment names, last active day)
+        self._entries: Dict[int, Tuple[Tuple[str, ...], str]] = {}
+
+    @staticmethod
+    def segments_of(user: Dict[str, Any]) -> Tuple[str, ...]:
+        bucket = spent_bucket(user.get('total_spent'))
+        names = [f"spent:{bucket}"]
+        if user.get('account_created'):
+            names.append("account_created")
+        if bucket != SPENT_BUCKETS[0][1]:
+            names.append("has_spent")
+        if user.get('status'):
+            names.append(f"status:{str(user['status']).lower()}")
+        if user.get('language_code'):
+            names.append(f"lang:{str(user['language_code']).lower()}")
+        return tuple(names)
+
+    def rebuild(self, rows: Dict[int, Dict[str, Any]]) -> None:
+        self._members.clear()
+        self._by_day.clear()
+        self._entries.clear()
+        for user_id, user in rows.items():
+            self.update(user_id, user)
+
+    def update(self, user_id: int, user: Optional[Dict[str, Any]]) -> None:
+        """Index a new or changed user, or drop it when user is None"""
+        previous = self._entries.get(user_id)
+        current = None
+        if user is not None:
+            current = (self.segments_of(user), _day(user.get('last_active') or user.get('join_date')))
+        if previous == current:
+            return
+        if previous is not None:
+            for name in previous[0]:
+                self._discard(self._members, name, user_id)
+            self._discard(self._by_day, previous[1], user_id)
+        if current is None:
+            self._entries.pop(user_id, None)
+            return
+        for name in current[0]:
+            self._members.setdefault(name, {})[user_id] = None
+        self._by_day.setdefault(current[1], {})[user_id] = None
+        self._entries[user_id] = current
+
+    @staticmethod
+    def _discard(groups: Dict[str, Dict[int, None]], name: str, user_id: int) -> None:
+        ids = groups.get(name)
+        if ids is not None:
+            ids.pop(user_id, None)
+            if not ids:
+                del groups[name]
+
+    def members(self, name: str) -> Dict[int, None]:
+        """User ids of one profile segment (a live view, do not modify)"""
+        return self._members.get(name, {})
+
+    def active_since(self, day: str) -> List[int]:
+        """Users last active on or after day (YYYY-MM-DD)"""
+        return [user_id for active_day, ids in self._by_day.items() if active_day and active_day >= day
+                for user_id in ids]
+
+    def last_active(self, user_id: int) -> Optional[str]:
+        entry = self._entries.get(user_id)
+        return entry[1] if entry else None
+
+    def counts(self) -> Dict[str, int]:
+        """Size of every profile segment"""
+        return {name: len(ids) for name, ids in self._members.items()}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class UserPlatformIndex:
+    """
+    platform -> users with at least one order on it, from the orders
+    collection (per user and platform order counts, so a deleted or
+    changed order only removes the user once no order is left).
+    """
+
+    def __init__(self):
+        # order_id -> (owner, platform) as currently indexed
+        self._entries: Dict[str, Tuple[int, str]] = {}
+        self._counts: Counter = Counter()
+        self._members: Dict[str, Dict[int, None]] = {}
+
+    def rebuild(self, rows: Dict[str, Dict[str, Any]]) -> None:
+        self._entries.clear()
+        self._counts.clear()
+        self._members.clear()
+        for order_id, order in rows.items():
+            self.update(order_id, order)
+
+    def update(self, order_id: str, order: Optional[Dict[str, Any]]) -> None:
+        """Index a new or changed order, or drop it when order is None"""
+        previous = self._entries.get(order_id)
+        current = None
+        if order is not None:
+            owner = _owner_id(order)
+            platform = str(order.get('platform') or '').strip().lower()
+            if owner is not None and platform:
+                current = (owner, platform)
+        if previous == current:
+            return
+        if previous is not None:
+            del self._entries[order_id]
+            self._counts[previous] -= 1
+            if self._counts[previous] <= 0:
+                del self._counts[previous]
+                UserSegmentIndex._discard(self._members, previous[1], previous[0])
+        if current is not None:
+            self._entries[order_id] = current
+            self._counts[current] += 1
+            self._members.setdefault(current[1], {})[current[0]] = None
+
+    def members(self, platform: str) -> Dict[int, None]:
+        """Users with hot orders on platform (a live view, do not modify)"""
+        return self._members.get(platform, {})
+
+    def platforms(self) -> List[str]:
+        return list(self._members)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -5,13 +5,15 @@ Advanced Telegram Bot for Social Media Marketing Services
 """
 
 import asyncio
+import hashlib
 import json
 import os
 import random
 import string
 import time
 import html
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import datetime
 from typing import Dict, Any, Optional
 import asyncio
 
@@ -22,9 +24,8 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.types import (
     Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, BotCommand
 )
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 # Import modules
@@ -33,8 +34,27 @@ import payment_system
 import services
 import account_creation
 import text_input_handler
+import storage
+from ratings_log import ratings_log, feedback_log, load_ratings_and_feedback
+from offers_repository import offers_repository
+from order_archive import order_archive, run_archiver
+from persistent_fsm import SqliteFSMStorage
+import expiring
+from expiring import TTLDict
+from persistence import (
+    persister, io_metrics, save_data_to_json, load_data_from_json_async
+)
+from storage import StoredCollection
 
 from states import OrderStates, CreateOfferStates, AdminSendOfferStates, OfferOrderStates, AdminCreateUserStates, AdminDirectMessageStates, FeedbackStates, MovieSearchStates
+from states import AccountCreationStates, ProfileEditStates, AdminMessagingStates
+from steps import UserStateMap, ADMIN_MESSAGING_PREFIX, restore_step
+from step_registry import registries as step_registries
+from broadcast import broadcaster, BroadcastContent, classify, progress_text
+from broadcast_jobs import broadcast_jobs
+import reachability
+import segments
+from admin_outbox import admin_outbox, PRIORITY_ORDER, PRIORITY_UPDATE, PRIORITY_CHATTER
 from fsm_handlers import handle_link_input, handle_quantity_input, handle_coupon_input
 
 # ========== CONFIGURATION ==========
@@ -65,10 +85,16 @@ WEBHOOK_MODE = bool(BASE_WEBHOOK_URL)  # True if webhook URL available, False fo
 WEB_SERVER_HOST = "0.0.0.0"
 WEB_SERVER_PORT = int(os.getenv("PORT", 5000))
 
-# Bot initialization with FSM storage
+# Hash of the last Telegram setup (commands + webhook) that succeeded;
+# startup skips the setup calls while it still matches
+TELEGRAM_SETUP_FILE = "telegram_setup.json"
+
+# Bot initialization with FSM storage (SQLite-backed, so conversations survive restarts)
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+fsm_storage = SqliteFSMStorage()
+dp = Dispatcher(storage=fsm_storage)
+# Admin group notifications go through per-chat rate-limited queues
+admin_outbox.bind(bot)
 START_TIME = time.time()
 
 # ========== ERROR HANDLING MIDDLEWARE ==========
@@ -96,6 +122,18 @@ async def error_handler(event):
     
     return True  # Continue processing
 
+# ========== ACTIVITY MIDDLEWARE ==========
+@dp.update.outer_middleware()
+async def activity_middleware(handler, event, data):
+    """Keep last_active (and the Telegram language) current for the active:<N>d / lang: segments"""
+    user = data.get("event_from_user")
+    if user is not None:
+        try:
+            segments.note_activity(user.id, user.language_code)
+        except Exception as e:
+            print(f"⚠️ Could not record activity of {user.id}: {e}")
+    return await handler(event, data)
+
 # Webhook handler setup
 webhook_requests_handler = SimpleRequestHandler(
     dispatcher=dp,
@@ -132,8 +170,8 @@ bot_stats = {
     "daily_activity": {},
 }
 
-# Real-time activity tracking
-active_sessions = {}
+# Real-time activity tracking (user_id -> last command time, gone after 5 idle minutes)
+active_sessions = TTLDict("active_sessions", ttl=300, max_size=100_000, sliding=True)
 command_frequency = {}
 error_tracking = {}
 performance_metrics = {
@@ -144,82 +182,37 @@ performance_metrics = {
 }
 
 # ========== DATA STORAGE ==========
-# In-memory storage (will be replaced with database later)
-users_data: Dict[int, Dict[str, Any]] = {}
-orders_data: Dict[str, Dict[str, Any]] = {}
-tickets_data: Dict[str, Dict[str, Any]] = {}
-user_state: Dict[int, Dict[str, Any]] = {}  # For tracking user input states
-order_temp: Dict[int, Dict[str, Any]] = {}  # For temporary order data
+# Persistent collections live in storage.py (json or sqlite backend)
+users_data: StoredCollection = storage.users_data
+orders_data: StoredCollection = storage.orders_data
+tickets_data: StoredCollection = storage.tickets_data
+# For tracking user input states / temporary order data; idle entries expire.
+# Steps set in user_state also become the user's FSM state (steps.py)
+user_state: Dict[int, Dict[str, Any]] = UserStateMap("user_state", ttl=6 * 3600, max_size=50_000, sliding=True)
+user_state.bind(fsm_storage, bot.id)
+order_temp: Dict[int, Dict[str, Any]] = TTLDict("order_temp", ttl=24 * 3600, max_size=20_000, sliding=True)
 admin_users = {ADMIN_USER_ID}  # Use consistent admin user ID
 
-# Handler registration flag - not needed
-# _handlers_registered = False
+def sync_order_temp(order_id: str, order: Optional[Dict[str, Any]]) -> None:
+    """Keep a user's recent temp order in step with the stored order"""
+    if not order:
+        return
+    owner = order.get('user_id') or order.get('customer_id')
+    temp_order = order_temp.peek(owner)
+    if temp_order is not None and temp_order is not order and temp_order.get('order_id') == order_id:
+        temp_order.update(order)
 
-# ========== PERSISTENT STORAGE FUNCTIONS ==========
-def save_data_to_json(data: Dict, filename: str) -> None:
-    """Save data dictionary to JSON file"""
-    try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False, default=str)
-        print(f"✅ Data saved to {filename}")
-    except Exception as e:
-        print(f"❌ Error saving data to {filename}: {e}")
+orders_data.subscribe(sync_order_temp)
 
-def load_data_from_json(filename: str) -> Dict:
-    """Load data from JSON file, return empty dict if file doesn't exist"""
-    try:
-        if os.path.exists(filename):
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            print(f"✅ Data loaded from {filename}")
-            return data
-        else:
-            print(f"📄 File {filename} not found, starting with empty data")
-            return {}
-    except Exception as e:
-        print(f"❌ Error loading data from {filename}: {e}")
-        return {}
+# Order statistics for /static, recomputed only when orders_data.version moves
+order_stats_cache: Dict[str, Any] = {"version": None, "date": None, "stats": {}}
 
-def load_list_from_json(filename: str) -> list:
-    """Load list data from JSON file, return empty list if file doesn't exist"""
-    try:
-        if os.path.exists(filename):
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            print(f"✅ List data loaded from {filename}")
-            # Ensure it's a list even if file contains something else
-            return data if isinstance(data, list) else []
-        else:
-            print(f"📄 List file {filename} not found, starting with empty list")
-            return []
-    except Exception as e:
-        print(f"❌ Error loading list data from {filename}: {e}")
-        return []
+# Handler registration flag - not needed
+# _handlers_registered = False
 
-def load_users_data_from_json() -> Dict:
-    """Load users data from JSON file with string-to-int key conversion"""
-    try:
-        if os.path.exists("users.json"):
-            with open("users.json", 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            # Convert string keys to integers for memory consistency
-            users_data_with_int_keys = {}
-            for str_key, value in data.items():
-                try:
-                    int_key = int(str_key)
-                    users_data_with_int_keys[int_key] = value
-                except ValueError:
-                    # If conversion fails, skip this entry
-                    print(f"⚠️ Skipping invalid user ID key: {str_key}")
-                    continue
-            print(f"✅ Users data loaded from users.json with {len(users_data_with_int_keys)} users")
-            return users_data_with_int_keys
-        else:
-            print(f"📄 File users.json not found, starting with empty users data")
-            return {}
-    except Exception as e:
-        print(f"❌ Error loading users data from users.json: {e}")
-        return {}
+# ========== PERSISTENT STORAGE FUNCTIONS ==========
+# save_data_to_json / load_*_from_json live in persistence.py (imported
+# above) so every module goes through the same background file writer
 
 # ========== MONITORING FUNCTIONS ==========
 def track_command_usage(command_name: str, user_id: int):
@@ -244,9 +237,8 @@ def track_command_usage(command_name: str, user_id: int):
     # Track active sessions
     active_sessions[user_id] = datetime.now()
     
-    # Update peak users
-    current_active = len([t for t in active_sessions.values() 
-                         if (datetime.now() - t).seconds < 300])  # Active in last 5 minutes
+    # Update peak users (sessions expire after 5 idle minutes)
+    current_active = len(active_sessions)
     if current_active > bot_stats["peak_users_today"]:
         bot_stats["peak_users_today"] = current_active
     
@@ -376,12 +368,9 @@ def toggle_maintenance_mode():
 
 def clear_cache_data():
     """Clear temporary cache data"""
-    global active_sessions, command_frequency
-    
-    # Clear old sessions (older than 1 hour)
-    cutoff_time = datetime.now() - timedelta(hours=1)
-    active_sessions = {uid: time for uid, time in active_sessions.items() 
-                      if time > cutoff_time}
+    # Expired sessions and other temporary entries are dropped by the sweeper;
+    # run one sweep now so the count is current
+    expiring.sweep()
     
     # Reset daily counters if new day
     today = datetime.now().date()
@@ -411,6 +400,9 @@ def init_user(user_id: int, username: Optional[str] = None, first_name: Optional
         # Save minimal record immediately with key conversion
         save_users_data()
         print(f"✅ Minimal user record created for {user_id} - full profile will be completed during account creation")
+    elif reachability.is_unreachable(user_id):
+        # A user talking to the bot can be messaged again
+        reachability.mark_reachable(user_id)
 
     # Initialize user state for input tracking
     if user_id not in user_state:
@@ -420,10 +412,8 @@ def init_user(user_id: int, username: Optional[str] = None, first_name: Optional
         }
 
 def save_users_data():
-    """Save users_data to JSON with string key conversion"""
-    # Convert integer keys to strings for JSON compatibility
-    users_data_with_str_keys = {str(k): v for k, v in users_data.items()}
-    save_data_to_json(users_data_with_str_keys, "users.json")
+    """Save users_data to JSON (json converts integer keys to strings on dump)"""
+    save_data_to_json(users_data, "users.json")
 
 def generate_referral_code() -> str:
     """Generate unique referral code"""
@@ -577,18 +567,22 @@ async def send_admin_notification(order_record: Dict[str, Any], photo_file_id: O
 
         management_keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
 
-        await bot.send_message(admin_group_id, message_text, parse_mode="HTML", reply_markup=management_keyboard)
+        # Queued: the user's handler does not wait for the group
+        admin_outbox.send_message(admin_group_id, message_text, PRIORITY_ORDER, parse_mode="HTML",
+                                  reply_markup=management_keyboard)
 
-        # If a photo_file_id is provided, send the photo as well
+        # If a photo_file_id is provided, send the photo as well, at the
+        # message's priority so it stays right behind it
         if photo_file_id:
-            await bot.send_photo(
-                chat_id=admin_group_id,
-                photo=photo_file_id,
+            admin_outbox.send_photo(
+                admin_group_id,
+                photo_file_id,
+                PRIORITY_ORDER,
                 caption=f"📸 Payment Screenshot for Order ID: <code>{order_record.get('order_id')}</code>",
                 parse_mode="HTML"
             )
 
-        print(f"✅ Enhanced group notification sent for Order ID: {order_id or 'Screenshot Upload'}")
+        print(f"✅ Enhanced group notification queued for Order ID: {order_id or 'Screenshot Upload'}")
 
     except Exception as e:
         print(f"❌ Failed to send enhanced group notification: {e}")
@@ -598,6 +592,9 @@ async def send_admin_notification(order_record: Dict[str, Any], photo_file_id: O
 async def send_first_interaction_notification(user_id: int, first_name: str = "", username: str = ""):
     """Send notification to user on first interaction after restart"""
 
+    if reachability.is_unreachable(user_id):
+        return False
+
     try:
         # Get display name with username preference
         user_display_name = f"@{username}" if username else first_name or 'Friend'
@@ -621,6 +618,8 @@ Hello <b>{user_display_name}</b>! 👋
         return True
     except Exception as e:
         print(f"❌ Failed to send first interaction notification to {user_id}: {e}")
+        if reachability.record_outcome(user_id, classify(e)):
+            await reachability.flush()
         return False
 
 async def send_new_user_notification_to_admin(user):
@@ -644,8 +643,8 @@ async def send_new_user_notification_to_admin(user):
 🎉 <b>A new user has started the bot!</b>
 """
 
-        await bot.send_message(admin_group_id, notification_text, parse_mode="HTML")
-        print(f"✅ New user notification sent to admin group for user {user_id}")
+        admin_outbox.send_message(admin_group_id, notification_text, PRIORITY_CHATTER, parse_mode="HTML")
+        print(f"✅ New user notification queued for admin group for user {user_id}")
         return True
     except Exception as e:
         print(f"❌ Failed to send new user notification to admin group: {e}")
@@ -683,8 +682,8 @@ async def send_token_notification_to_admin(user_id: int, full_name: str, usernam
 💡 <b>User can now access all premium features</b>
 """
 
-        await bot.send_message(admin_group_id, notification_text, parse_mode="HTML")
-        print(f"✅ Token notification sent to admin group for user {user_id}")
+        admin_outbox.send_message(admin_group_id, notification_text, PRIORITY_CHATTER, parse_mode="HTML")
+        print(f"✅ Token notification queued for admin group for user {user_id}")
         return True
     except Exception as e:
         print(f"❌ Failed to send token notification to admin group: {e}")
@@ -693,6 +692,7 @@ async def send_token_notification_to_admin(user_id: int, full_name: str, usernam
 def mark_user_for_notification(user_id: int):
     """Mark user for bot alive notification"""
     users_to_notify.add(user_id)
+    reachability.mark_reachable(user_id)
 
 def format_currency(amount: float) -> str:
     """Format currency in Indian Rupees"""
@@ -1091,50 +1091,90 @@ async def cmd_static(message: Message):
     current_time = datetime.now()
     
     # Basic user statistics
-    total_users = len(users_data)
-    active_users = len([u for u in users_data.values() if u.get('orders_count', 0) > 0])
-    new_users_today = 0
-    total_balance = sum(user.get('balance', 0.0) for user in users_data.values())
-    total_spent = sum(user.get('total_spent', 0.0) for user in users_data.values())
-    
-    # Calculate new users today
-    try:
-        for user_data in users_data.values():
-            join_date = user_data.get('join_date', '')
-            if join_date:
-                join_dt = datetime.fromisoformat(join_date.replace('Z', '+00:00'))
-                if join_dt.date() == current_time.date():
-                    new_users_today += 1
-    except:
-        pass
+    user_totals = storage.user_totals()
+    total_users = user_totals["users"]
+    total_balance = user_totals["total_balance"]
+    # Spend, ordering users and today's joins come from the resident summary index
+    active_users = user_totals["users_with_orders"]
+    new_users_today = user_totals["joined_today"]
+    total_spent = user_totals["total_spent"]
+    user_cache = storage.user_cache_stats()
+    reach = storage.user_reachability()
+    unreachable_detail = ", ".join(f"{status.replace('_', ' ')} {count:,}"
+                                   for status, count in sorted(reach["by_status"].items())) or "none"
+
+    # Ratings & feedback come from their running aggregates, never the files
+    await ratings_log.ensure_loaded_async()
+    await feedback_log.ensure_loaded_async()
+    rating_overall = ratings_log.overall
+    rating_distribution = " | ".join(f"{stars}⭐ {rating_overall['distribution'].get(stars, 0):,}" for stars in range(5, 0, -1))
+    top_rated_platforms = sorted(ratings_log.by_platform.items(), key=lambda item: item[1]["count"], reverse=True)[:3]
+    platform_ratings = "\n".join(
+        f"• {platform.title()}: {ratings_log.average(bucket):.2f}⭐ ({bucket['count']:,} ratings)"
+        for platform, bucket in top_rated_platforms
+    ) or "• No ratings yet"
+    cache_lookups = user_cache["hits"] + user_cache["misses"]
+
+    # Order statistics (cached until the orders collection changes)
+    orders_data.refresh_indexes()
+    if (order_stats_cache["version"] != orders_data.version
+            or order_stats_cache["date"] != current_time.date()):
+        total_orders = len(orders_data)
+        completed_orders = orders_data.count('status', 'completed')
+
+        # Calculate orders today
+        orders_today = 0
+        revenue_today = 0.0
+        try:
+            for order in orders_data.values():
+                created_at = order.get('created_at', '')
+                if created_at:
+                    try:
+                        order_dt = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+                        if order_dt.date() == current_time.date():
+                            orders_today += 1
+                            if order.get('status') == 'completed':
+                                revenue_today += order.get('total_price', 0.0)
+                    except:
+                        pass
+        except:
+            pass
 
-    # Order statistics
-    total_orders = len(orders_data)
-    completed_orders = len([o for o in orders_data.values() if o.get('status') == 'completed'])
-    pending_orders = total_orders - completed_orders
-    
-    # Calculate orders today
-    orders_today = 0
-    revenue_today = 0.0
-    try:
-        for order in orders_data.values():
-            created_at = order.get('created_at', '')
-            if created_at:
-                try:
-                    order_dt = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                    if order_dt.date() == current_time.date():
-                        orders_today += 1
-                        if order.get('status') == 'completed':
-                            revenue_today += order.get('total_price', 0.0)
-                except:
-                    pass
-    except:
-        pass
+        order_stats_cache.update(version=orders_data.version, date=current_time.date(), stats={
+            "total_orders": total_orders,
+            "completed_orders": completed_orders,
+            "orders_today": orders_today,
+            "revenue_today": revenue_today,
+        })
+
+    order_stats = order_stats_cache["stats"]
+    # Archived orders are only counted from the archive index
+    archived_orders = order_archive.total
+    total_orders = order_stats["total_orders"] + archived_orders
+    completed_orders = order_stats["completed_orders"] + order_archive.status_totals.get('completed', 0)
+    cancelled_archived = order_archive.status_totals.get('cancelled', 0)
+    pending_orders = total_orders - completed_orders - cancelled_archived
+    orders_today = order_stats["orders_today"]
+    revenue_today = order_stats["revenue_today"]
 
     # Advanced monitoring data
     uptime = get_uptime()
     error_summary = get_error_summary()
     top_commands = get_top_commands()
+    io_stats = io_metrics()
+    fsm_stats = fsm_storage.metrics()
+    memory_maps = ", ".join(f"{name} {info['size']:,}/{info['max_size']:,}"
+                            for name, info in expiring.sizes().items())
+    outbox_stats = admin_outbox.metrics()
+    admin_outbox_summary = "; ".join(
+        f"{chat_id}: {q['depth']} queued (oldest {q['oldest_wait']}s), {q['sent']:,} sent, lag {q['last_lag']}s "
+        f"(max {q['max_lag']}s), {q['retries']} retries, {q['failed']} failed"
+        for chat_id, q in outbox_stats.items()) or "idle"
+    # Slowest text steps by average handler time
+    step_timings = sorted(((name, counters) for registry in step_registries.values()
+                           for name, counters in registry.metrics().items()),
+                          key=lambda item: item[1]["avg_ms"], reverse=True)[:3]
+    step_summary = ", ".join(f"{name} {c['avg_ms']}ms×{c['calls']}" for name, c in step_timings) or "no steps run yet"
     
     # System status indicators
     health_status = "🟢 Excellent" if bot_stats["errors_today"] < 5 else "🟡 Moderate" if bot_stats["errors_today"] < 20 else "🔴 Critical"
@@ -1182,6 +1222,8 @@ async def cmd_static(message: Message):
 🆕 <b>New Today:</b> {new_users_today:,}
 💰 <b>Total Balance:</b> ₹{total_balance:,.2f}
 💸 <b>Total Revenue:</b> ₹{total_spent:,.2f}
+📬 <b>Reachable:</b> {reach["reachable"]:,} | 🚫 <b>Unreachable:</b> {reach["unreachable"]:,} ({unreachable_detail})
+🗂️ <b>Profile Cache:</b> {user_cache["cached"]:,} cached, {user_cache["hits"]:,} hits / {user_cache["misses"]:,} misses ({(user_cache["hits"]/max(cache_lookups, 1)*100):.1f}% hit rate)
 
 ╔═══════════════════════════════════════════════════════════════
 ║ 📦 <b>ORDER & BUSINESS METRICS</b>
@@ -1192,8 +1234,19 @@ async def cmd_static(message: Message):
 ⏳ <b>Pending:</b> {pending_orders:,}
 🔥 <b>Orders Today:</b> {orders_today:,}
 📈 <b>Today's Revenue:</b> ₹{revenue_today:,.2f}
+🗄️ <b>Archived:</b> {archived_orders:,} ({len(orders_data):,} in the hot set)
 💎 <b>Average Order:</b> ₹{(total_spent/max(completed_orders, 1)):.2f}
 
+╔═══════════════════════════════════════════════════════════════
+║ ⭐ <b>RATINGS & FEEDBACK</b>
+╚═══════════════════════════════════════════════════════════════
+
+🌟 <b>Average Rating:</b> {ratings_log.average(rating_overall):.2f}⭐ ({rating_overall["count"]:,} ratings)
+📊 <b>Distribution:</b> {rating_distribution}
+📱 <b>By Platform:</b>
+{platform_ratings}
+💬 <b>Feedback Received:</b> {feedback_log.count:,}
+
 ╔═══════════════════════════════════════════════════════════════
 ║ 📊 <b>COMMAND USAGE ANALYTICS</b>
 ╚═══════════════════════════════════════════════════════════════
@@ -1208,6 +1261,12 @@ async def cmd_static(message: Message):
 🔍 <b>Webhook Status:</b> ✅ Connected
 🗄️ <b>Database Status:</b> ✅ Operational
 📁 <b>File System:</b> ✅ Accessible
+💽 <b>Write Queue:</b> {io_stats["queued_jobs"]:,} jobs / {io_stats["queued_bytes"] / 1024:.1f} KB ({io_stats["pending_files"]} files pending)
+⏱️ <b>Write Latency:</b> avg {io_stats["avg_latency_ms"]:.1f} ms / max {io_stats["max_latency_ms"]:.1f} ms ({io_stats["writes"]:,} writes, {io_stats["errors"]} errors)
+💬 <b>FSM Storage:</b> {fsm_stats["cached"]:,} conversations ({fsm_stats["pending"]} unsaved, {fsm_stats["expired"]:,} expired)
+🧠 <b>Memory Maps:</b> {memory_maps}
+📮 <b>Admin Outbox:</b> {admin_outbox_summary}
+⏱️ <b>Text Steps:</b> {step_summary}
 🔐 <b>Security Status:</b> ✅ Secure
 ⚙️ <b>Handler Status:</b> ✅ All Active
 
@@ -1414,6 +1473,16 @@ async def cb_admin_system_check(callback: CallbackQuery):
         # Check data files
         data_files = ["users.json", "orders.json"]
         file_checks = []
+        user_shards = getattr(storage.backend, "user_shards", None)
+        if user_shards is not None:
+            # Users are sharded, report the shard directory instead of users.json
+            data_files.remove("users.json")
+            if os.path.isdir(user_shards.directory):
+                shard_files = [os.path.join(user_shards.directory, name) for name in os.listdir(user_shards.directory)]
+                size = sum(os.path.getsize(path) for path in shard_files) / 1024  # KB
+                file_checks.append(f"• {user_shards.directory}/: ✅ {len(shard_files)} files, {size:.1f}KB")
+            else:
+                file_checks.append(f"• {user_shards.directory}/: ⚠️ Missing")
         for file in data_files:
             if os.path.exists(file):
                 size = os.path.getsize(file) / 1024  # KB
@@ -1674,17 +1743,23 @@ async def cmd_userlist(message: Message):
         await message.answer("📝 No users found in database.")
         return
 
-    total_users = len(users_data)
-    account_created_users = sum(1 for user_data in users_data.values() if user_data.get('account_created', False))
+    user_totals = storage.user_totals()
+    total_users = user_totals["users"]
+    account_created_users = user_totals["accounts_created"]
+    reach = storage.user_reachability()
     
-    # Create user list with proper formatting
+    # Create user list with proper formatting (profiles read off the event loop)
+    user_rows = await storage.user_fields('username', 'first_name', 'full_name', 'account_created',
+                                          'delivery_status', 'join_date')
     user_list_text = []
-    for idx, (user_id_str, user_data) in enumerate(users_data.items(), 1):
+    for idx, (user_id_str, user_data) in enumerate(user_rows, 1):
         # Get user details with debug info
         telegram_username = user_data.get('username', '').strip()
         first_name = user_data.get('first_name', '').strip()
         full_name = user_data.get('full_name', '').strip()
         account_status = "✅ Created" if user_data.get('account_created', False) else "⏳ Pending"
+        if user_data.get('delivery_status'):
+            account_status += f" | 🚫 {user_data['delivery_status'].replace('_', ' ')}"
         join_date = user_data.get('join_date', 'Unknown')
         
         
@@ -1726,6 +1801,7 @@ async def cmd_userlist(message: Message):
         header = f"""
 👥 <b>All Bot Users List</b>
 📊 <b>Statistics:</b> {total_users} Total Users | {account_created_users} Accounts Created
+📬 <b>Reachable:</b> {reach["reachable"]} | 🚫 <b>Unreachable:</b> {reach["unreachable"]}
 
 📋 <b>Users {start_idx + 1}-{end_idx} of {total_users}:</b>
 
@@ -1736,7 +1812,7 @@ async def cmd_userlist(message: Message):
         if total_chunks > 1:
             chunk_text += f"\n\n📄 <b>Page {chunk_num + 1} of {total_chunks}</b>"
         
-        chunk_text += "\n\n💡 <b>Legend:</b> ✅ Account Created | ⏳ Account Pending"
+        chunk_text += "\n\n💡 <b>Legend:</b> ✅ Account Created | ⏳ Account Pending | 🚫 Blocked/deactivated/not found"
         
         await message.answer(chunk_text)
 
@@ -1755,7 +1831,8 @@ async def cmd_broadcast(message: Message):
         await message.answer("❌ Please provide a message to broadcast!")
         return
     command_parts = message.text.split(' ', 1)
-    if len(command_parts) < 2:
+    media_source = message.reply_to_message
+    if len(command_parts) < 2 and not media_source:
         await message.answer("""
 📢 <b>Broadcast Command Usage:</b>
 
@@ -1763,63 +1840,192 @@ async def cmd_broadcast(message: Message):
 
 📝 <b>Example:</b> /broadcast Hello all users! New features available.
 
+🖼️ <b>Media:</b> reply to a photo/video with /broadcast (optional caption)
+
+🚫 Users who blocked the bot are skipped; start with <code>--all</code> to include them
+
 ⚠️ <b>This will send to ALL registered users!</b>
 """)
         return
 
-    broadcast_message = command_parts[1]
+    broadcast_message = command_parts[1] if len(command_parts) > 1 else None
+    include_unreachable = False
+    if broadcast_message and broadcast_message.split(maxsplit=1)[0] == "--all":
+        include_unreachable = True
+        broadcast_message = broadcast_message[len("--all"):].strip() or None
+    if media_source:
+        content = BroadcastContent.from_message(media_source, text=broadcast_message)
+    else:
+        content = BroadcastContent(broadcast_message)
 
-    # Get all registered users DIRECTLY from users_data
-    target_users = list(users_data.keys())
-    print(f"📢 BROADCAST: Admin {user.id} sending to {len(target_users)} users")
+    # Every registered user, minus the ones known to be unreachable
+    target_users = list(users_data.keys()) if include_unreachable else storage.reachable_user_ids()
+    skipped = len(users_data) - len(target_users)
+    print(f"📢 BROADCAST: Admin {user.id} sending to {len(target_users)} users ({skipped} unreachable skipped)")
 
     if not target_users:
         await message.answer("❌ No registered users found!")
         return
 
-    # Send confirmation to admin
-    await message.answer(f"""
-📢 <b>Broadcasting Message...</b>
+    await _start_broadcast_job(message, content, target_users, skipped)
 
+async def _start_broadcast_job(message: Message, content: BroadcastContent, target_users: list, skipped: int,
+                               label: str = "Broadcast", audience: str = ""):
+    """Shared tail of /broadcast and /broadcast_segment: status message, job, job commands"""
+    # Send confirmation to admin; it is updated with the progress
+    status = await message.answer(f"""
+📢 <b>Broadcasting Message...</b>
+{audience}
 📊 <b>Target Users:</b> {len(target_users)}
-📝 <b>Message:</b> {broadcast_message}
+🚫 <b>Skipped (unreachable):</b> {skipped}
+📝 <b>Message:</b> {content.text or content.media_type}
+⏰ <b>Estimated Time:</b> ~{broadcaster.estimate_seconds(len(target_users))} seconds
 
 🔄 <b>Sending now...</b>
 """)
 
-    # Send broadcast messages DIRECTLY
-    sent_count = 0
-    failed_count = 0
+    # Runs as a persisted job: progress updates the status message, the
+    # final report arrives when it is done, and a restart resumes it
+    job = await broadcast_jobs.create(bot, target_users, content, created_by=message.from_user.id, label=label,
+                                      status_chat_id=message.chat.id, status_message_id=status.message_id)
+    print(f"📢 BROADCAST: job {job['job_id']} started")
+
+    await message.answer(f"""
+🆔 <b>Job:</b> <code>{job['job_id']}</code>
+
+📊 /broadcast_status - progress
+⏸️ /broadcast_pause {job['job_id']}
+🛑 /broadcast_cancel {job['job_id']}
+""")
+
+@dp.message(Command("broadcast_segment"))
+async def cmd_broadcast_segment(message: Message):
+    """Admin command: broadcast to the users of a segment (first line), message on the next lines"""
+    user = message.from_user
+    if not user or not is_admin(user.id):
+        await message.answer("⚠️ This command is for admins only!")
+        return
+
+    first_line, _, broadcast_message = (message.text or "").partition("\n")
+    command_parts = first_line.split(maxsplit=1)
+    expression = command_parts[1] if len(command_parts) > 1 else ""
+    broadcast_message = broadcast_message.strip() or None
+    media_source = message.reply_to_message
+    if not expression or not (broadcast_message or media_source):
+        await message.answer(f"""
+🎯 <b>Segment Broadcast Usage:</b>
+
+💬 <b>Format:</b>
+/broadcast_segment platform:instagram &amp; active:30d
+Your message on the next line(s)
+
+🖼️ <b>Media:</b> reply to a photo/video (the lines after the segment become the caption)
+
+🔍 Check the audience first with /segments your expression
+{segments.SEGMENT_HELP}""")
+        return
+
+    try:
+        members = segments.resolve(expression)
+    except segments.SegmentError as e:
+        await message.answer(f"❌ <b>Invalid segment:</b> {html.escape(str(e))}\n{segments.SEGMENT_HELP}")
+        return
+
+    target_users = storage.reachable_user_ids(members)
+    print(f"📢 BROADCAST: Admin {user.id} sending to segment '{expression}' ({len(target_users)} users)")
+    if not target_users:
+        await message.answer(f"❌ No reachable users in segment <code>{html.escape(expression)}</code>")
+        return
+
+    if media_source:
+        content = BroadcastContent.from_message(media_source, text=broadcast_message)
+    else:
+        content = BroadcastContent(broadcast_message)
+    await _start_broadcast_job(message, content, target_users, len(members) - len(target_users),
+                               label=f"Segment {expression}",
+                               audience=f"🎯 <b>Segment:</b> <code>{html.escape(expression)}</code>\n")
+
+@dp.message(Command("segments"))
+async def cmd_segments(message: Message):
+    """Admin command: segment sizes, or a preview of one segment expression"""
+    user = message.from_user
+    if not user or not is_admin(user.id):
+        await message.answer("⚠️ This command is for admins only!")
+        return
 
-    for user_id in target_users:
+    parts = (message.text or "").split(maxsplit=1)
+    if len(parts) > 1:
         try:
-            await bot.send_message(
-                chat_id=user_id,
-                text=broadcast_message,
-                parse_mode="HTML"
-            )
-            sent_count += 1
-            print(f"✅ Broadcast sent to user {user_id}")
+            result = segments.preview(parts[1])
+        except segments.SegmentError as e:
+            await message.answer(f"❌ <b>Invalid segment:</b> {html.escape(str(e))}\n{segments.SEGMENT_HELP}")
+            return
+        await message.answer(f"{segments.preview_text(result)}\n\n"
+                             f"📢 /broadcast_segment {html.escape(result['expression'])}")
+        return
 
-            # Rate limiting
-            import asyncio
-            await asyncio.sleep(0.5)  # 0.5 second delay
+    sizes = segments.catalogue()
+    lines = "\n".join(f"• <code>{html.escape(name)}</code>: {count:,}" for name, count in sizes.items())
+    await message.answer(f"🧩 <b>Audience Segments</b>\n\n{lines}\n{segments.SEGMENT_HELP}\n"
+                         f"🔍 Preview: /segments platform:instagram &amp; active:30d")
 
-        except Exception as e:
-            failed_count += 1
-            print(f"❌ Failed to send to user {user_id}: {e}")
+async def _broadcast_job_command(message: Message, action: str):
+    """Shared body of /broadcast_pause, /broadcast_resume and /broadcast_cancel"""
+    user = message.from_user
+    if not user or not is_admin(user.id):
+        await message.answer("⚠️ This command is for admins only!")
+        return
 
-    # Send final report to admin
-    await message.answer(f"""
-✅ <b>Broadcast Complete!</b>
+    parts = (message.text or "").split(maxsplit=1)
+    job = broadcast_jobs.find(parts[1] if len(parts) > 1 else None)
+    if not job:
+        await message.answer(f"❌ Job not found! Use /broadcast_{action} JOB_ID (see /broadcast_status)")
+        return
+
+    if action == "pause":
+        done = broadcast_jobs.pause(job["job_id"])
+    elif action == "resume":
+        done = broadcast_jobs.resume(bot, job["job_id"])
+    else:
+        done = broadcast_jobs.cancel(job["job_id"])
 
-📊 <b>Results:</b>
-• ✅ Successfully sent: {sent_count}
-• ❌ Failed: {failed_count}
-• 👥 Total attempted: {len(target_users)}
+    if done:
+        await message.answer(f"✅ Job <code>{job['job_id']}</code>: {job['status']}\n\n{progress_text(job['result'])}")
+    else:
+        await message.answer(f"⚠️ Job <code>{job['job_id']}</code> is {job['status']}, cannot {action} it")
 
-🎯 <b>Broadcast finished!</b>
-""")
+@dp.message(Command("broadcast_status"))
+async def cmd_broadcast_status(message: Message):
+    """Admin command: progress of the latest broadcast jobs"""
+    user = message.from_user
+    if not user or not is_admin(user.id):
+        await message.answer("⚠️ This command is for admins only!")
+        return
+
+    jobs = broadcast_jobs.latest()
+    if not jobs:
+        await message.answer("📭 No broadcast jobs yet")
+        return
+
+    status_icons = {"running": "🔄", "paused": "⏸️", "cancelled": "🛑", "completed": "✅"}
+    blocks = [f"{status_icons.get(job['status'], '•')} <b>{job['label']}</b> <code>{job['job_id']}</code> "
+              f"({job['status']})\n{progress_text(job['result'])}" for job in jobs]
+    await message.answer("📢 <b>Broadcast Jobs</b>\n\n" + "\n\n".join(blocks))
+
+@dp.message(Command("broadcast_pause"))
+async def cmd_broadcast_pause(message: Message):
+    """Admin command: pause a running broadcast job"""
+    await _broadcast_job_command(message, "pause")
+
+@dp.message(Command("broadcast_resume"))
+async def cmd_broadcast_resume(message: Message):
+    """Admin command: continue a paused broadcast job"""
+    await _broadcast_job_command(message, "resume")
+
+@dp.message(Command("broadcast_cancel"))
+async def cmd_broadcast_cancel(message: Message):
+    """Admin command: stop a broadcast job for good"""
+    await _broadcast_job_command(message, "cancel")
 
 @dp.message(Command("restoreuser"))
 async def cmd_restoreuser(message: Message):
@@ -1966,30 +2172,6 @@ async def cmd_sendtouser(message: Message):
 
 # ========== OFFERS SYSTEM ==========
 
-def load_offers_from_json() -> list:
-    """Load offers from offers.json file, return empty list if file doesn't exist"""
-    try:
-        if os.path.exists("offers.json"):
-            with open("offers.json", 'r', encoding='utf-8') as f:
-                offers = json.load(f)
-            print(f"✅ Offers loaded from offers.json")
-            return offers
-        else:
-            print(f"📄 File offers.json not found, starting with empty offers list")
-            return []
-    except Exception as e:
-        print(f"❌ Error loading offers from offers.json: {e}")
-        return []
-
-def save_offers_to_json(offers: list) -> None:
-    """Save offers list to offers.json file"""
-    try:
-        with open("offers.json", 'w', encoding='utf-8') as f:
-            json.dump(offers, f, indent=2, ensure_ascii=False, default=str)
-        print(f"✅ Offers saved to offers.json")
-    except Exception as e:
-        print(f"❌ Error saving offers to offers.json: {e}")
-
 def generate_offer_id() -> str:
     """Generate unique offer ID"""
     return f"OFFER-{int(time.time())}-{random.randint(1000, 9999)}"
@@ -2056,28 +2238,18 @@ async def cmd_delete_offer(message: Message):
 
     offer_id = command_parts[1].strip()
 
-    # Load current offers from offers.json
-    offers = load_offers_from_json()
-    
-    if not offers:
+    if not len(offers_repository):
         await message.answer("❌ No offers found in the system!")
         return
 
-    # Find and remove the offer with matching OFFER_ID
-    offer_found = False
-    updated_offers = []
-    removed_offer = None
-    
-    for offer in offers:
-        if offer.get("offer_id") == offer_id:
-            offer_found = True
-            removed_offer = offer
-            print(f"🗑️ DELETE_OFFER: Admin {user.id} deleting offer {offer_id}")
-        else:
-            updated_offers.append(offer)
+    # Remove the offer with matching OFFER_ID (written through to offers.json)
+    removed_offer = offers_repository.remove(offer_id)
+    if removed_offer:
+        print(f"🗑️ DELETE_OFFER: Admin {user.id} deleting offer {offer_id}")
+    updated_offers = offers_repository.all()
 
     # Error handling for cases where the Offer ID is not found
-    if not offer_found:
+    if not removed_offer:
         await message.answer(f"""
 ❌ <b>Offer Not Found!</b>
 
@@ -2092,9 +2264,6 @@ async def cmd_delete_offer(message: Message):
 """)
         return
 
-    # Save the updated offers list back to offers.json
-    save_offers_to_json(updated_offers)
-
     # Send confirmation message to admin
     if removed_offer:
         confirmation_text = f"""
@@ -2322,12 +2491,8 @@ async def complete_offer_creation(message: Message, state: FSMContext):
         "created_by": message.from_user.id if message.from_user else 0
     }
 
-    # Load existing offers and add new one
-    offers = load_offers_from_json()
-    offers.append(offer)
-
-    # Save updated offers list
-    save_offers_to_json(offers)
+    # Add the new offer (written through to offers.json)
+    offers_repository.add(offer)
 
     # Clear FSM state
     await state.clear()
@@ -2354,10 +2519,9 @@ async def complete_offer_creation(message: Message, state: FSMContext):
 
 # ========== SEND OFFER SYSTEM ==========
 
-async def send_offer_to_user(user_id: int, offer: dict, bot: Bot) -> bool:
-    """Send offer message with Order Now button to a specific user"""
-    try:
-        offer_text = f"""
+def offer_content(offer: dict) -> BroadcastContent:
+    """Offer message with Order Now button"""
+    offer_text = f"""
 🎉 <b>Special Offer for You!</b>
 
 {offer['offer_message']}
@@ -2366,28 +2530,28 @@ async def send_offer_to_user(user_id: int, offer: dict, bot: Bot) -> bool:
 💰 <b>Rate:</b> {offer['rate']}
 """
 
-        if offer.get('has_fixed_quantity') and offer.get('fixed_quantity'):
-            offer_text += f"🔢 <b>Quantity:</b> {offer['fixed_quantity']}\n"
+    if offer.get('has_fixed_quantity') and offer.get('fixed_quantity'):
+        offer_text += f"🔢 <b>Quantity:</b> {offer['fixed_quantity']}\n"
 
-        offer_text += """
+    offer_text += """
 ⚡ <b>Limited Time Offer!</b>
 🛒 <b>Click below to order now!</b>
 """
 
-        # Create Order Now button with offer_id in callback_data
-        order_button = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(
-                text="🛒 Order Now", 
-                callback_data=f"order_offer_{offer['offer_id']}"
-            )]
-        ])
+    # Create Order Now button with offer_id in callback_data
+    order_button = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(
+            text="🛒 Order Now", 
+            callback_data=f"order_offer_{offer['offer_id']}"
+        )]
+    ])
 
-        await bot.send_message(
-            chat_id=user_id,
-            text=offer_text,
-            reply_markup=order_button,
-            parse_mode="HTML"
-        )
+    return BroadcastContent(offer_text, reply_markup=order_button)
+
+async def send_offer_to_user(user_id: int, offer: dict, bot: Bot) -> bool:
+    """Send offer message with Order Now button to a specific user"""
+    try:
+        await offer_content(offer).send(bot, user_id)
         return True
     except Exception as e:
         print(f"❌ Failed to send offer to user {user_id}: {e}")
@@ -2404,8 +2568,8 @@ async def cmd_send_offer(message: Message, state: FSMContext):
     # Start the offer sending FSM flow
     await state.set_state(AdminSendOfferStates.getting_offer_id)
 
-    # Load and display available offers
-    offers = load_offers_from_json()
+    # Display available offers
+    offers = offers_repository.all()
 
     if not offers:
         await message.answer("❌ No offers found! Please create offers first using /create_offer")
@@ -2444,14 +2608,8 @@ async def handle_offer_id_input(message: Message, state: FSMContext):
 
     offer_id = message.text.strip()
 
-    # Load offers and validate offer_id
-    offers = load_offers_from_json()
-    selected_offer = None
-
-    for offer in offers:
-        if offer.get('offer_id') == offer_id and offer.get('is_active', True):
-            selected_offer = offer
-            break
+    # Validate offer_id against the offers index
+    selected_offer = offers_repository.get(offer_id, active_only=True)
 
     if not selected_offer:
         await message.answer(
@@ -2481,6 +2639,7 @@ async def handle_offer_id_input(message: Message, state: FSMContext):
 💡 <b>Who do you want to send this offer to?</b>
 
 🌍 <b>All Users:</b> Send to all registered users
+🎯 <b>Segment:</b> Send to a group, e.g. Instagram buyers active in 30 days
 👤 <b>Specific User:</b> Send to a particular user
 
 📤 <b>Choose your target audience:</b>
@@ -2491,6 +2650,9 @@ async def handle_offer_id_input(message: Message, state: FSMContext):
         [
             InlineKeyboardButton(text="🌍 All Users", callback_data="send_to_all_users"),
             InlineKeyboardButton(text="👤 Specific User", callback_data="send_to_specific_user")
+        ],
+        [
+            InlineKeyboardButton(text="🎯 Segment", callback_data="send_to_segment")
         ]
     ])
 
@@ -2512,15 +2674,21 @@ async def handle_target_choice(callback: CallbackQuery, state: FSMContext):
         await state.clear()
         return
 
-    if callback.data == "send_to_all_users":
-        # Send to all users
-        await callback.answer("📤 Sending to all users...")
+    if callback.data in ("send_to_all_users", "send_to_segment_confirm"):
+        # Send to all users, or to the segment previewed in getting_segment
+        expression = data.get('segment') if callback.data == "send_to_segment_confirm" else None
+        await callback.answer("📤 Sending to the segment..." if expression else "📤 Sending to all users...")
 
-        # Use global users_data (already loaded with proper key conversion)
-        if not users_data:
-            if (callback.message and 
-                hasattr(callback.message, 'edit_text') and
-                callback.message.__class__.__name__ != 'InaccessibleMessage'):
+        # Users known to be unreachable are left out either way
+        try:
+            recipients = storage.reachable_user_ids(segments.resolve(expression) if expression else None)
+        except segments.SegmentError:
+            recipients = []
+        can_edit = (callback.message and
+                    hasattr(callback.message, 'edit_text') and
+                    callback.message.__class__.__name__ != 'InaccessibleMessage')
+        if not recipients:
+            if can_edit:
                 await callback.message.edit_text(
                     "❌ <b>No users found!</b>\n\n"
                     "🔍 <b>No registered users available to send offers</b>"
@@ -2528,29 +2696,42 @@ async def handle_target_choice(callback: CallbackQuery, state: FSMContext):
             await state.clear()
             return
 
-        # Send offer to all users
-        success_count = 0
-        total_users = len(users_data)
+        # Send offer to the recipients as a persisted broadcast job
+        total_users = len(recipients)
+        job = await broadcast_jobs.create(
+            bot, recipients, offer_content(selected_offer),
+            created_by=callback.from_user.id, label=f"Offer {selected_offer['package_name']}",
+            status_chat_id=callback.message.chat.id if can_edit else None,
+            status_message_id=callback.message.message_id if can_edit else None)
+
+        # Progress replaces this message; the report follows when the job is done
+        if can_edit:
+            audience = f"🧩 <b>Segment:</b> <code>{html.escape(expression)}</code>\n" if expression else ""
+            await callback.message.edit_text(
+                f"📤 <b>Sending Offer...</b>\n\n"
+                f"{audience}"
+                f"👥 <b>Total Users:</b> {total_users}\n"
+                f"🎯 <b>Offer:</b> {selected_offer['package_name']}\n"
+                f"🆔 <b>Job:</b> <code>{job['job_id']}</code>\n\n"
+                f"📊 /broadcast_status for progress"
+            )
+        await state.clear()
+        print(f"📤 SEND_OFFER: Admin started job {job['job_id']} for offer {selected_offer['offer_id']} to {total_users} users")
 
-        for user_id in users_data:
-            if await send_offer_to_user(int(user_id), selected_offer, bot):
-                success_count += 1
+    elif callback.data == "send_to_segment":
+        # Ask for a segment expression; it is previewed before anything is sent
+        await state.set_state(AdminSendOfferStates.getting_segment)
 
-        # Report results and clear state
-        if (callback.message and 
+        if (callback.message and
             hasattr(callback.message, 'edit_text') and
             callback.message.__class__.__name__ != 'InaccessibleMessage'):
             await callback.message.edit_text(
-                f"✅ <b>Offer Sent Successfully!</b>\n\n"
-                f"📊 <b>Delivery Report:</b>\n"
-                f"👥 <b>Total Users:</b> {total_users}\n"
-                f"✅ <b>Successfully Sent:</b> {success_count}\n"
-                f"❌ <b>Failed:</b> {total_users - success_count}\n\n"
-                f"🎯 <b>Offer:</b> {selected_offer['package_name']}\n"
-                f"🎉 <b>Campaign completed!</b>"
+                f"🎯 <b>Send to Segment - Step 3/3</b>\n\n"
+                f"🎯 <b>Selected Offer:</b> {selected_offer['package_name']}\n"
+                f"{segments.SEGMENT_HELP}\n"
+                f"📤 <b>Send the segment expression:</b>"
             )
-        await state.clear()
-        print(f"📤 SEND_OFFER: Admin sent offer {selected_offer['offer_id']} to all {total_users} users")
+        await callback.answer()
 
     elif callback.data == "send_to_specific_user":
         # Ask for specific user ID
@@ -2573,6 +2754,38 @@ async def handle_target_choice(callback: CallbackQuery, state: FSMContext):
     else:
         await callback.answer("❌ Invalid option!")
 
+@dp.message(AdminSendOfferStates.getting_segment)
+async def handle_offer_segment(message: Message, state: FSMContext):
+    """Handle a segment expression in getting_segment state: preview it with a send button"""
+    if not message.text:
+        await message.answer("⚠️ Please send a segment expression.")
+        return
+
+    data = await state.get_data()
+    selected_offer = data.get('selected_offer')
+    if not selected_offer:
+        await message.answer("❌ Offer data lost! Please start again with /send_offer")
+        await state.clear()
+        return
+
+    try:
+        result = segments.preview(message.text)
+    except segments.SegmentError as e:
+        await message.answer(f"❌ <b>Invalid segment:</b> {html.escape(str(e))}\n\n📤 <b>Send a corrected expression:</b>")
+        return
+
+    # Back to target choice, with the previewed segment kept for the confirm button
+    await state.update_data(segment=result["expression"])
+    await state.set_state(AdminSendOfferStates.choosing_target)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"✅ Send to {result['reachable']:,} users", callback_data="send_to_segment_confirm")],
+        [InlineKeyboardButton(text="🎯 Change Segment", callback_data="send_to_segment")]
+    ])
+    await message.answer(
+        f"🎯 <b>Offer:</b> {selected_offer['package_name']}\n\n{segments.preview_text(result)}",
+        reply_markup=keyboard
+    )
+
 @dp.message(AdminSendOfferStates.getting_specific_user_id)
 async def handle_specific_user_id(message: Message, state: FSMContext):
     """Handle specific user ID input in getting_specific_user_id state"""
@@ -2668,14 +2881,8 @@ async def handle_order_offer(callback: CallbackQuery, state: FSMContext):
     offer_id = (callback.data or "").replace("order_offer_", "")
     print(f"🔥 ORDER OFFER BUTTON: Extracted offer ID: {offer_id}")
 
-    # Load offers and find the selected offer
-    offers = load_offers_from_json()
-    selected_offer = None
-
-    for offer in offers:
-        if offer.get('offer_id') == offer_id and offer.get('is_active', True):
-            selected_offer = offer
-            break
+    # Find the selected offer (in-memory index, no disk I/O)
+    selected_offer = offers_repository.get(offer_id, active_only=True)
 
     if not selected_offer:
         print(f"❌ ORDER OFFER BUTTON: Offer {offer_id} not found or inactive")
@@ -3746,7 +3953,7 @@ async def cmd_analytics(message: Message):
 
     user_id = user.id
     user_data = users_data.get(user_id, {})
-    user_orders = [order for order in orders_data.values() if order.get('user_id') == user_id]
+    user_order_count = storage.user_order_count(user_id)
 
     text = f"""
 📊 <b>Account Analytics & Statistics</b>
@@ -3754,12 +3961,12 @@ async def cmd_analytics(message: Message):
 💰 <b>Financial Summary:</b>
 • Total Spent: ₹{user_data.get('total_spent', 0.0):,.2f}
 • Current Balance: ₹{user_data.get('balance', 0.0):,.2f}
-• Total Orders: {len(user_orders)}
+• Total Orders: {user_order_count}
 
 📈 <b>Growth Metrics:</b>
 • Account Age: {format_time(user_data.get('join_date', ''))}
 • Order Success Rate: 95%+
-• Average Order Value: ₹{(user_data.get('total_spent', 0.0) / max(len(user_orders), 1)):,.2f}
+• Average Order Value: ₹{(user_data.get('total_spent', 0.0) / max(user_order_count, 1)):,.2f}
 
 📊 <b>Advanced analytics dashboard coming soon!</b>
 """
@@ -4369,9 +4576,8 @@ async def cb_limited_time_offers(callback: CallbackQuery):
     if not callback.message:
         return
 
-    # Load active offers from offers.json (same as what admin sends)
-    offers = load_offers_from_json()
-    active_offers = [offer for offer in offers if offer.get('is_active', True)]
+    # Active offers from the offers repository (same as what admin sends)
+    active_offers = offers_repository.active()
 
     if not active_offers:
         text = """
@@ -5422,11 +5628,6 @@ async def cb_pay_from_balance(callback: CallbackQuery, state: FSMContext):
     # Process order from balance
     order_id = generate_order_id()
 
-    # Deduct balance
-    users_data[user_id]['balance'] -= total_price
-    users_data[user_id]['total_spent'] += total_price
-    users_data[user_id]['orders_count'] += 1
-
     # Create order record
     order_record = {
         'order_id': order_id,
@@ -5440,15 +5641,17 @@ async def cb_pay_from_balance(callback: CallbackQuery, state: FSMContext):
         'status': 'processing',
         'created_at': datetime.now().isoformat(),
         'payment_method': 'Account Balance',
-        'payment_status': 'completed'
+        'payment_status': 'completed',
+        'charged_amount': total_price
     }
 
-    # Store order in permanent storage
-    orders_data[order_id] = order_record
-
-    # Save updated data to persistent storage
-    save_data_to_json(users_data, "users.json")
-    save_data_to_json(orders_data, "orders.json")
+    # Deduct balance and store the order in one transaction: both are saved or neither
+    async with storage.transaction() as tx:
+        user = tx.get(users_data, user_id)
+        user['balance'] -= total_price
+        user['total_spent'] += total_price
+        user['orders_count'] += 1
+        tx.put(orders_data, order_id, order_record)
 
     print(f"✅ Order {order_id} completed and stored")
 
@@ -6062,20 +6265,19 @@ async def cb_confirm_order(callback: CallbackQuery):
         'status': 'processing',
         'created_at': datetime.now().isoformat(),
         'start_count': 0,
-        'remains': order_data['quantity']
+        'remains': order_data['quantity'],
+        'payment_method': 'Account Balance',
+        'payment_status': 'completed',
+        'charged_amount': price
     }
 
-    # Save order
-    orders_data[order_id] = order_record
-
-    # Update user data
-    users_data[user_id]['balance'] -= price
-    users_data[user_id]['total_spent'] += price
-    users_data[user_id]['orders_count'] += 1
-
-    # Save updated data to persistent storage
-    save_data_to_json(users_data, "users.json")
-    save_data_to_json(orders_data, "orders.json")
+    # Save order and charge the user in one transaction
+    async with storage.transaction() as tx:
+        tx.put(orders_data, order_id, order_record)
+        user = tx.get(users_data, user_id)
+        user['balance'] -= price
+        user['total_spent'] += price
+        user['orders_count'] += 1
 
     # Clear temp order
     del order_temp[user_id]
@@ -6997,10 +7199,7 @@ async def cb_admin_user_profile(callback: CallbackQuery):
     api_key = user.get('api_key', 'Not Generated')
 
     # Get recent order history count
-    recent_orders = 0
-    for order in orders_data.values():
-        if order.get('user_id') == target_user_id:
-            recent_orders += 1
+    recent_orders = storage.user_order_count(target_user_id)
 
     profile_text = f"""
 👤 <b>Complete User Profile</b>
@@ -7277,22 +7476,7 @@ async def cb_admin_complete_order(callback: CallbackQuery):
     orders_data[order_id] = completion_record
     save_data_to_json(orders_data, "orders.json")
 
-    # CRITICAL: Force reload fresh data from file to sync memory
-    print(f"🔄 DEBUG: Force reloading orders_data from file for consistency...")
-    fresh_orders_data = load_data_from_json("orders.json")
-    orders_data.clear()
-    orders_data.update(fresh_orders_data)
-    print(f"✅ DEBUG: orders_data reloaded - Now has {len(orders_data)} orders")
-
-    # Also update order_temp if it exists
-    if customer_id in order_temp and order_temp[customer_id].get('order_id') == order_id:
-        print(f"🔧 DEBUG: Also updating order_temp for consistency...")
-        order_temp[customer_id]['status'] = 'completed'
-        order_temp[customer_id]['completed_at'] = datetime.now().isoformat()
-        order_temp[customer_id]['completed_by_admin'] = user_id
-        print(f"✅ DEBUG: order_temp updated - Status: {order_temp[customer_id]['status']}")
-    else:
-        print(f"🔍 DEBUG: order_temp not found for customer {customer_id} or different order_id")
+    # order_temp follows automatically through the orders_data subscription (sync_order_temp)
 
     print(f"✅ DEBUG: Stateless completion - parsed all details from message text!")
     print(f"📊 DEBUG: Final status in orders_data[{order_id}]: {orders_data.get(order_id, {}).get('status', 'NOT_FOUND')}")
@@ -7372,7 +7556,12 @@ async def cb_admin_complete_order(callback: CallbackQuery):
 🎉 <b>Order processing completed successfully!</b>
 """
 
-        await safe_edit_message(callback, admin_update)
+        # The group message is updated through the admin outbox (group rate limit)
+        if callback.message.__class__.__name__ != 'InaccessibleMessage':
+            admin_outbox.edit_message_text(callback.message.chat.id, callback.message.message_id, admin_update,
+                                           PRIORITY_UPDATE, parse_mode="HTML")
+        else:
+            admin_outbox.send_message(callback.message.chat.id, admin_update, PRIORITY_UPDATE, parse_mode="HTML")
         await callback.answer("✅ Order completed and customer notified!")
 
     except Exception as e:
@@ -7409,8 +7598,7 @@ async def cb_rate_order(callback: CallbackQuery):
         return
 
     # Check if already rated
-    ratings_data = load_list_from_json("ratings.json")
-    if any(rating.get('order_id') == order_id and rating.get('user_id') == user_id for rating in ratings_data):
+    if ratings_log.has_rated(order_id, user_id):
         await callback.answer("⭐ You have already rated this order!", show_alert=True)
         return
 
@@ -7480,11 +7668,9 @@ async def cb_submit_rating(callback: CallbackQuery):
         await callback.answer("❌ Invalid rating value!", show_alert=True)
         return
 
-    # Load and save rating
-    ratings_data = load_list_from_json("ratings.json")
-    
-    # Check for duplicate rating
-    if any(r.get('order_id') == order_id and r.get('user_id') == user_id for r in ratings_data):
+    # Check for duplicate rating (no await until it is recorded, so two
+    # quick taps cannot both get through)
+    if ratings_log.has_rated(order_id, user_id):
         await callback.answer("⭐ You have already rated this order!", show_alert=True)
         return
 
@@ -7499,8 +7685,8 @@ async def cb_submit_rating(callback: CallbackQuery):
         'service_name': orders_data.get(order_id, {}).get('package_name', 'unknown')
     }
     
-    ratings_data.append(rating_record)
-    save_data_to_json(ratings_data, "ratings.json")
+    await ratings_log.ensure_loaded_async()
+    ratings_log.append(rating_record)
 
     # Get rating display
     star_display = "⭐" * rating
@@ -7650,9 +7836,6 @@ async def handle_feedback_text(message: Message, state: FSMContext):
         await state.clear()
         return
 
-    # Load feedback data
-    feedback_data = load_list_from_json("feedback.json")
-    
     # Create feedback record
     feedback_record = {
         'feedback_id': f"FB-{int(time.time())}-{user_id}",
@@ -7665,8 +7848,8 @@ async def handle_feedback_text(message: Message, state: FSMContext):
         'user_name': users_data.get(user_id, {}).get('full_name', 'Unknown User')
     }
     
-    feedback_data.append(feedback_record)
-    save_data_to_json(feedback_data, "feedback.json")
+    await feedback_log.ensure_loaded_async()
+    feedback_log.append(feedback_record)
 
     # Clear FSM state
     await state.clear()
@@ -7730,7 +7913,7 @@ async def handle_feedback_text(message: Message, state: FSMContext):
         # Send to admin group/channel if configured
         admin_group_id = os.getenv("ADMIN_GROUP_ID")
         if admin_group_id:
-            await bot.send_message(chat_id=int(admin_group_id), text=admin_notification, parse_mode="HTML")
+            admin_outbox.send_message(int(admin_group_id), admin_notification, PRIORITY_CHATTER, parse_mode="HTML")
     except Exception as e:
         print(f"Error sending feedback notification to admin: {e}")
 
@@ -7798,7 +7981,10 @@ async def cb_admin_cancel_order(callback: CallbackQuery):
 
     print(f"✅ DEBUG: Cancel Order Step 1 - Parsed details: {customer_name}, {package_name}, ₹{total_price}")
 
-    # Store parsed details in orders_data for step 2 to access
+    # Store parsed details in orders_data for step 2 to access. They only
+    # fill gaps: a stored order keeps its owner, price and payment details,
+    # which decide the refund
+    existing_order = orders_data.raw.get(order_id) or {}
     orders_data[order_id] = {
         'order_id': order_id,
         'user_id': customer_id,
@@ -7806,6 +7992,7 @@ async def cb_admin_cancel_order(callback: CallbackQuery):
         'package_name': package_name,
         'total_price': total_price,
         'customer_name': customer_name,  # Add customer name too
+        **existing_order,
         'parsed_from_message': True  # Flag to indicate this was parsed
     }
 
@@ -7952,14 +8139,37 @@ async def cb_admin_cancel_reason(callback: CallbackQuery):
 
     reason_message = reason_messages.get(reason_type, "Order cancelled by admin")
 
-    # Update order status
-    orders_data[order_id]['status'] = 'cancelled'
-    orders_data[order_id]['cancelled_at'] = datetime.now().isoformat()
-    orders_data[order_id]['cancelled_by_admin'] = user_id
-    orders_data[order_id]['cancellation_reason'] = reason_message
-
-    # Save updated order data to persistent storage
-    save_data_to_json(orders_data, "orders.json")
+    # Cancel the order and refund balance payments in one transaction
+    refunded_amount = 0.0
+    async with storage.transaction() as tx:
+        order = tx.get(orders_data, order_id)
+        order['status'] = 'cancelled'
+        order['cancelled_at'] = datetime.now().isoformat()
+        order['cancelled_by_admin'] = user_id
+        order['cancellation_reason'] = reason_message
+
+        # The stored owner and the amount charged at payment time decide the
+        # refund, never what was parsed from the admin message
+        owner_id = order.get('user_id')
+        charged = order.get('charged_amount', order.get('total_price', 0.0)) or 0.0
+        if (order.get('payment_method') == 'Account Balance' and order.get('payment_status') == 'completed'
+                and charged > 0 and owner_id in users_data):
+            refunded_amount = charged
+            customer = tx.get(users_data, owner_id)
+            customer['balance'] = customer.get('balance', 0.0) + refunded_amount
+            customer['total_spent'] = max(customer.get('total_spent', 0.0) - refunded_amount, 0.0)
+            customer['orders_count'] = max(customer.get('orders_count', 0) - 1, 0)
+            order['payment_status'] = 'refunded'
+            order['refunded_at'] = datetime.now().isoformat()
+            order['refunded_amount'] = refunded_amount
+        if owner_id is not None:
+            customer_id = owner_id
+
+    refund_line = (f"✅ <b>Refunded:</b> ₹{refunded_amount:,.2f} has been added back to your account balance"
+                   if refunded_amount else
+                   "🔄 <b>Refund Process:</b> If payment was made, refund will be processed within 24-48 hours")
+    refund_action = (f"₹{refunded_amount:,.2f} refunded to customer balance" if refunded_amount
+                     else "Order marked for refund processing")
 
     # Send cancellation message to customer
     customer_message = f"""
@@ -7988,7 +8198,7 @@ async def cb_admin_cancel_reason(callback: CallbackQuery):
 💡 <b>NEXT STEPS</b>
 ━━━━━━━━━━━━━━━━━━━━━━━━━━
 
-🔄 <b>Refund Process:</b> If payment was made, refund will be processed within 24-48 hours
+{refund_line}
 📞 <b>Need Help?</b> Contact support with Order ID: <code>{order_id}</code>
 🚀 <b>New Order:</b> You can place a new order anytime
 
@@ -8033,7 +8243,7 @@ async def cb_admin_cancel_reason(callback: CallbackQuery):
 • Order status updated to "Cancelled"
 • Customer notification sent
 • Cancellation reason logged
-• Order marked for refund processing
+• {refund_action}
 
 📊 <b>Cancellation Time:</b> {datetime.now().strftime("%d %b %Y, %I:%M %p")}
 
@@ -8508,11 +8718,7 @@ async def handle_movie_list_from_admin(message: Message):
             
             # Send confirmation to movie admin group
             admin_group_id = -1003174157953
-            await bot.send_message(
-                chat_id=admin_group_id,
-                text=admin_confirmation,
-                parse_mode="HTML"
-            )
+            admin_outbox.send_message(admin_group_id, admin_confirmation, PRIORITY_CHATTER, parse_mode="HTML")
             
             # Also reply to admin's message with confirmation
             await message.reply(
@@ -8545,9 +8751,75 @@ async def handle_movie_list_from_admin(message: Message):
         )
 
 # ========== INPUT HANDLERS ==========
+# Step handlers: the user's FSM state alone picks the handler, user_state
+# only carries the step's data (see steps.py)
+@dp.message(StateFilter(AccountCreationStates.waiting_custom_name, AccountCreationStates.waiting_contact_permission,
+                        AccountCreationStates.waiting_manual_phone, AccountCreationStates.waiting_email,
+                        AccountCreationStates.waiting_login_phone, AccountCreationStates.waiting_access_token),
+            F.text & ~F.text.startswith("/"))
+async def handle_account_creation_step(message: Message, state: FSMContext):
+    """Text input during account creation / login"""
+    if not message.from_user:
+        return
+
+    await restore_step(user_state, message.from_user.id, state)
+    await account_creation.handle_text_input(message)
+
+@dp.message(AdminMessagingStates.broadcast_message, F.text & ~F.text.startswith("/"))
+async def handle_admin_broadcast_step(message: Message, state: FSMContext):
+    """Admin typed the broadcast message"""
+    if not message.from_user or not is_admin(message.from_user.id):
+        return
+
+    if is_message_old(message):
+        mark_user_for_notification(message.from_user.id)
+        return
+
+    user_id = message.from_user.id
+    await restore_step(user_state, user_id, state)
+    print(f"📢 Processing admin broadcast message from {user_id}")
+    await services.handle_admin_broadcast_message(message, user_id)
+
+@dp.message(AdminMessagingStates.direct_message, F.text & ~F.text.startswith("/"))
+async def handle_admin_direct_message_step(message: Message, state: FSMContext):
+    """Admin typed a direct message for one user"""
+    if not message.from_user or not is_admin(message.from_user.id):
+        return
+
+    if is_message_old(message):
+        mark_user_for_notification(message.from_user.id)
+        return
+
+    user_id = message.from_user.id
+    step = await restore_step(user_state, user_id, state)
+    try:
+        target_user_id = int((step or "").replace(ADMIN_MESSAGING_PREFIX, ""))
+    except ValueError:
+        await state.clear()
+        return
+    print(f"💬 Processing admin direct message from {user_id} to user {target_user_id}")
+    await text_input_handler.handle_admin_direct_message(message, user_id, target_user_id)
+
+@dp.message(StateFilter(ProfileEditStates.editing_name, ProfileEditStates.editing_phone,
+                        ProfileEditStates.editing_email, ProfileEditStates.editing_bio,
+                        ProfileEditStates.editing_location, ProfileEditStates.editing_birthday,
+                        ProfileEditStates.editing_photo),
+            F.text & ~F.text.startswith("/"))
+async def handle_profile_edit_step(message: Message, state: FSMContext):
+    """Text input while editing a profile field"""
+    if not message.from_user:
+        return
+
+    if is_message_old(message):
+        mark_user_for_notification(message.from_user.id)
+        return
+
+    step = await restore_step(user_state, message.from_user.id, state)
+    await account_handlers.handle_profile_edit_input(message, step)
+
 @dp.message(F.text & ~F.text.startswith("/"))
 async def handle_text_input_wrapper(message: Message, state: FSMContext):
-    """Wrapper for text input handler - first check account creation, then other handlers"""
+    """Text outside the step states: movie search, then the generic text handler"""
     if not message.from_user:
         return
 
@@ -8579,11 +8851,7 @@ async def handle_text_input_wrapper(message: Message, state: FSMContext):
             try:
                 admin_message = movie_name
 
-                await bot.send_message(
-                    chat_id=admin_group_id,
-                    text=admin_message,
-                    parse_mode=None
-                )
+                admin_outbox.send_message(admin_group_id, admin_message, PRIORITY_CHATTER, parse_mode=None)
 
                 # Store the movie request for later processing
                 request_id = f"{user_id}_{int(datetime.now().timestamp())}"
@@ -8619,40 +8887,9 @@ async def handle_text_input_wrapper(message: Message, state: FSMContext):
 
         return  # Let other dedicated FSM handlers handle this
 
-    # Check if user is in account creation flow (legacy user_state)
-    current_step = user_state.get(user_id, {}).get("current_step")
-
     print(f"🔍 TEXT DEBUG: User {user_id} sent text: '{message.text[:50]}...'")
-    print(f"🔍 TEXT DEBUG: User {user_id} current_step: {current_step}")
-    print(f"🔍 FSM DEBUG: User {user_id} FSM state: {fsm_state}")
-
-    # PRIORITY: Check for admin broadcast and messaging first
-    from services import handle_admin_broadcast_message, is_admin
-    if is_admin(user_id):
-        print(f"🔍 ADMIN CHECK: User {user_id} is admin, current_step: {current_step}")
-        if current_step == "admin_broadcast_message":
-            print(f"📢 Processing admin broadcast message from {user_id}")
-            await handle_admin_broadcast_message(message, user_id)
-            return
-        elif current_step and current_step.startswith("admin_messaging_"):
-            # Handle admin direct messaging to specific user
-            target_user_id = int(current_step.replace("admin_messaging_", ""))
-            print(f"💬 Processing admin direct message from {user_id} to user {target_user_id}")
-            from text_input_handler import handle_admin_direct_message
-            await handle_admin_direct_message(message, user_id, target_user_id)
-            return
 
-    # Account creation steps that should be handled by account_creation.py
-    account_creation_steps = ["waiting_login_phone", "waiting_custom_name", "waiting_manual_phone", "waiting_email", "waiting_access_token", "waiting_contact_permission"]
-
-    if current_step in account_creation_steps:
-        print(f"🔄 Passing to account_creation.py for user {user_id}")
-        # Let account_creation.py handle this
-        from account_creation import handle_text_input
-        await handle_text_input(message)
-        return
-
-    # Otherwise use regular text input handler
+    # No step in progress: regular text input handler
     await text_input_handler.handle_text_input(
         message, users_data, order_temp, tickets_data,
         is_message_old, mark_user_for_notification, is_account_created,
@@ -8660,37 +8897,36 @@ async def handle_text_input_wrapper(message: Message, state: FSMContext):
     )
 
 # ========== PHOTO HANDLERS ==========
-@dp.message(F.photo)
-async def handle_photo_input(message: Message):
+@dp.message(ProfileEditStates.editing_photo, F.photo)
+async def handle_profile_photo_input(message: Message, state: FSMContext):
     """Handle photo input for profile picture updates"""
     if not message.from_user:
         return
 
     user_id = message.from_user.id
-    current_step = user_state.get(user_id, {}).get("current_step")
+    await restore_step(user_state, user_id, state)
 
-    if current_step == "editing_photo":
-        # Handle profile photo update
-        if not message.photo:
-            await message.answer("⚠️ Please send a valid photo!")
-            return
+    # Handle profile photo update
+    if not message.photo:
+        await message.answer("⚠️ Please send a valid photo!")
+        return
 
-        # Get the largest photo size
-        if len(message.photo) > 0:
-            photo = message.photo[-1]
-            file_id = photo.file_id
-        else:
-            await message.answer("⚠️ No valid photo sizes found!")
-            return
+    # Get the largest photo size
+    if len(message.photo) > 0:
+        photo = message.photo[-1]
+        file_id = photo.file_id
+    else:
+        await message.answer("⚠️ No valid photo sizes found!")
+        return
 
-        # Store photo file_id in user data
-        users_data[user_id]['profile_photo'] = file_id
-        user_state[user_id]["current_step"] = None
+    # Store photo file_id in user data
+    users_data[user_id]['profile_photo'] = file_id
+    user_state[user_id]["current_step"] = None
 
-        # Save updated user data to persistent storage
-        save_data_to_json(users_data, "users.json")
+    # Save updated user data to persistent storage
+    save_data_to_json(users_data, "users.json")
 
-        text = """
+    text = """
 ✅ <b>Profile Photo Updated Successfully!</b>
 
 📸 <b>Your profile photo has been updated!</b>
@@ -8698,19 +8934,28 @@ async def handle_photo_input(message: Message):
 💡 <b>New photo is now visible in your account</b>
 """
 
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="✏️ Continue Editing", callback_data="edit_profile"),
-                InlineKeyboardButton(text="👀 Preview Profile", callback_data="preview_profile")
-            ],
-            [
-                InlineKeyboardButton(text="🏠 Main Menu", callback_data="back_main")
-            ]
-        ])
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✏️ Continue Editing", callback_data="edit_profile"),
+            InlineKeyboardButton(text="👀 Preview Profile", callback_data="preview_profile")
+        ],
+        [
+            InlineKeyboardButton(text="🏠 Main Menu", callback_data="back_main")
+        ]
+    ])
+
+    await message.answer(text, reply_markup=keyboard)
+
+@dp.message(F.photo)
+async def handle_photo_input(message: Message):
+    """Handle photo input for payment screenshots"""
+    if not message.from_user:
+        return
 
-        await message.answer(text, reply_markup=keyboard)
+    user_id = message.from_user.id
+    current_step = user_state.get(user_id, {}).get("current_step")
 
-    elif current_step == "waiting_screenshot_upload":
+    if current_step == "waiting_screenshot_upload":
         # This is for payment screenshot upload
         order_data = user_state.get(user_id, {}).get("data", {})
         transaction_id = order_data.get("transaction_id")
@@ -8788,52 +9033,32 @@ async def handle_contact_input(message: Message):
 # FSM handlers moved above to line 3988 - duplicates removed
 
 # ========== STARTUP FUNCTIONS ==========
-async def on_startup():
-    """Initialize bot on startup"""
-    print("🚀 India Social Panel Bot starting...")
-
-    # Load persistent data from JSON files
-    global users_data, orders_data, tickets_data
-    print("📂 Loading persistent data...")
-
-    # Load users data with proper key conversion
-    users_data.update(load_users_data_from_json())
-
-    # Load orders data
-    loaded_orders = load_data_from_json("orders.json")
-    if loaded_orders:
-        orders_data.update(loaded_orders)
+class StartupTimer:
+    """Times and logs startup phases so cold-start regressions show up in the logs"""
 
-    # Load tickets data
-    loaded_tickets = load_data_from_json("tickets.json")
-    if loaded_tickets:
-        tickets_data.update(loaded_tickets)
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
 
-    print(f"📊 Loaded {len(users_data)} users, {len(orders_data)} orders, {len(tickets_data)} tickets")
-
-    # Initialize all handlers now that dp is available
-    print("🔄 Initializing account handlers...")
-    account_handlers.init_account_handlers(
-        dp, users_data, orders_data, require_account,
-        format_currency, format_time, is_account_created, user_state, is_admin, safe_edit_message
-    )
-
-    print("🔄 Initializing account creation handlers...")
-    account_creation.init_account_creation_handlers(
-        dp, users_data, user_state, safe_edit_message, init_user,
-        mark_user_for_notification, is_message_old, bot, START_TIME, send_token_notification_to_admin, save_users_data
-    )
-
-    print("✅ Account creation initialization complete")
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.phases[name] = round(elapsed, 1)
+            print(f"⏱️ Startup phase '{name}': {elapsed:.1f} ms")
 
-    print("🔄 Initializing payment system...")
-    payment_system.register_payment_handlers(dp, users_data, user_state, format_currency)
+    def summary(self) -> str:
+        total = (time.perf_counter() - self.started) * 1000
+        parts = ", ".join(f"{name} {ms:.0f}ms" for name, ms in self.phases.items())
+        return f"⏱️ Startup finished in {total:.1f} ms ({parts})"
 
-    print("🔄 Initializing service system...")
-    services.register_service_handlers(dp, require_account)
 
-    # Set bot commands - Enhanced professional menu with detailed descriptions
-    commands = [
+def get_bot_commands() -> list:
+    """Bot commands - Enhanced professional menu with detailed descriptions"""
+    return [
         BotCommand(command="start", description="🚀 Launch Dashboard & Access All Features"),
         BotCommand(command="menu", description="🏠 Main Menu - Complete Service Portal"),
         BotCommand(command="neworder", description="🛒 Start New Order - Browse Services"),
@@ -8860,36 +9085,149 @@ async def on_startup():
         BotCommand(command="userlist", description="👥 View All Bot Users List (Admin Only)"),
         BotCommand(command="description", description="📋 Package Details During Order Process")
     ]
-    await bot.set_my_commands(commands)
-    print("✅ Bot commands set successfully")
 
-    # Clear old webhook if exists
-    await bot.delete_webhook(drop_pending_updates=True)
-    print("🗑️ Cleared previous webhook")
 
-    if WEBHOOK_MODE:
-        # Set webhook for production
-        webhook_url = f"{WEBHOOK_URL}"
-        print(f"🔗 Setting webhook URL: {webhook_url}")
+def telegram_setup_hash(commands: list) -> str:
+    """Hash of everything the Telegram setup calls send"""
+    config = {
+        "commands": [(c.command, c.description) for c in commands],
+        "webhook_mode": WEBHOOK_MODE,
+        "webhook_url": WEBHOOK_URL,
+        "webhook_secret": hashlib.sha256(WEBHOOK_SECRET.encode()).hexdigest(),
+        "allowed_updates": ["message", "callback_query", "inline_query"],
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
 
-        try:
-            await bot.set_webhook(
-                url=webhook_url,
-                secret_token=WEBHOOK_SECRET,
-                allowed_updates=["message", "callback_query", "inline_query"]
-            )
-            print(f"✅ Webhook set successfully: {webhook_url}")
 
-            # Test webhook
-            webhook_info = await bot.get_webhook_info()
-            print(f"📋 Webhook info: {webhook_info}")
-            if webhook_info.url:
-                print("✅ Webhook verification successful")
-            else:
-                print("❌ Webhook verification failed")
-        except Exception as e:
-            print(f"❌ Webhook setup failed: {e}")
-            print("🔄 Trying to continue anyway...")
+async def setup_webhook() -> bool:
+    """Point Telegram at our webhook (or clear it for polling), returns success"""
+    if not WEBHOOK_MODE:
+        # Clear old webhook if exists
+        await bot.delete_webhook(drop_pending_updates=True)
+        print("🗑️ Cleared previous webhook")
+        return True
+
+    # Set webhook for production (replaces any old one, dropping stale updates)
+    webhook_url = f"{WEBHOOK_URL}"
+    print(f"🔗 Setting webhook URL: {webhook_url}")
+    try:
+        await bot.set_webhook(
+            url=webhook_url,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=["message", "callback_query", "inline_query"],
+            drop_pending_updates=True
+        )
+        print(f"✅ Webhook set successfully: {webhook_url}")
+
+        # Test webhook
+        webhook_info = await bot.get_webhook_info()
+        print(f"📋 Webhook info: {webhook_info}")
+        if webhook_info.url:
+            print("✅ Webhook verification successful")
+            return True
+        print("❌ Webhook verification failed")
+    except Exception as e:
+        print(f"❌ Webhook setup failed: {e}")
+        print("🔄 Trying to continue anyway...")
+    return False
+
+
+async def setup_telegram() -> None:
+    """Set commands and webhook concurrently, skipped when nothing changed since the last run"""
+    commands = get_bot_commands()
+    config_hash = telegram_setup_hash(commands)
+    stored = await load_data_from_json_async(TELEGRAM_SETUP_FILE)
+    if stored.get("hash") == config_hash:
+        # One cheap call confirms the webhook on Telegram's side still matches
+        webhook_info = await bot.get_webhook_info()
+        if not WEBHOOK_MODE:
+            if not webhook_info.url:
+                print("✅ Telegram setup unchanged, skipping commands/webhook calls")
+                return
+            # Set from outside (another deploy, by hand): polling would fail with a Conflict
+            print(f"⚠️ Webhook {webhook_info.url} is set on Telegram's side, clearing it for polling")
+            await setup_webhook()
+            return
+        if webhook_info.url == WEBHOOK_URL:
+            print("✅ Telegram setup unchanged and webhook active, skipping setup calls")
+            return
+        print("⚠️ Webhook missing or changed on Telegram's side, setting it up again")
+
+    async def set_commands() -> bool:
+        await bot.set_my_commands(commands)
+        print("✅ Bot commands set successfully")
+        return True
+
+    results = await asyncio.gather(set_commands(), setup_webhook(), return_exceptions=True)
+    if all(result is True for result in results):
+        save_data_to_json({"hash": config_hash, "updated_at": datetime.now().isoformat()}, TELEGRAM_SETUP_FILE)
+    else:
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"❌ Telegram setup call failed: {result}")
+
+
+# Long-running tasks started on startup (kept referenced so they are not garbage collected)
+background_tasks = set()
+
+
+async def on_startup():
+    """Initialize bot on startup"""
+    print("🚀 India Social Panel Bot starting...")
+    timer = StartupTimer()
+
+    async def load_data():
+        # Load persistent data through the configured storage backend,
+        # every collection in its own worker thread
+        with timer.phase("load data"):
+            print(f"📂 Loading persistent data ({storage.backend.name} backend)...")
+            load_times, _, _, _, _ = await asyncio.gather(storage.load_all_async(),
+                                                          asyncio.to_thread(load_ratings_and_feedback),
+                                                          asyncio.to_thread(offers_repository.reload),
+                                                          asyncio.to_thread(order_archive.load_index),
+                                                          asyncio.to_thread(broadcast_jobs.load))
+            print(f"📊 Loaded {len(users_data)} users, {len(orders_data)} orders, {len(tickets_data)} tickets "
+                  f"({', '.join(f'{name} {ms:.0f}ms' for name, ms in load_times.items())})")
+
+    async def telegram():
+        with timer.phase("telegram setup"):
+            await setup_telegram()
+
+    # Data loading and Telegram API calls do not depend on each other
+    await asyncio.gather(load_data(), telegram())
+
+    with timer.phase("register handlers"):
+        # Initialize all handlers now that dp is available
+        print("🔄 Initializing account handlers...")
+        account_handlers.init_account_handlers(
+            dp, users_data, orders_data, require_account,
+            format_currency, format_time, is_account_created, user_state, is_admin, safe_edit_message
+        )
+
+        print("🔄 Initializing account creation handlers...")
+        account_creation.init_account_creation_handlers(
+            dp, users_data, user_state, safe_edit_message, init_user,
+            mark_user_for_notification, is_message_old, bot, START_TIME, send_token_notification_to_admin, save_users_data
+        )
+
+        print("✅ Account creation initialization complete")
+
+        print("🔄 Initializing payment system...")
+        payment_system.register_payment_handlers(dp, users_data, user_state, format_currency)
+
+        print("🔄 Initializing service system...")
+        services.register_service_handlers(dp, require_account)
+
+    # Old finished orders move to the compressed archive in the background
+    background_tasks.add(asyncio.create_task(run_archiver(orders_data)))
+    # Expire idle entries of the in-memory maps (user_state, order_temp, ...)
+    background_tasks.add(asyncio.create_task(expiring.run_sweeper()))
+    # Broadcasts cut off by the last shutdown continue from their cursor
+    broadcast_jobs.resume_all(bot)
+    # Users marked unreachable are checked again now and then
+    background_tasks.add(asyncio.create_task(reachability.run_reprobe(bot)))
+
+    print(timer.summary())
 
 # ========== WEBHOOK SETUP ==========
 
@@ -8926,7 +9264,7 @@ async def cb_movie_search(callback: CallbackQuery):
     if callback.from_user and callback.message:
         from aiogram.fsm.storage.base import StorageKey
         key = StorageKey(bot_id=bot.id, chat_id=callback.message.chat.id, user_id=callback.from_user.id)
-        state = FSMContext(storage=storage, key=key)
+        state = FSMContext(storage=fsm_storage, key=key)
         await state.set_state(MovieSearchStates.waiting_movie_name)
     
     # Create back button
@@ -8962,11 +9300,7 @@ async def handle_movie_name_input(message: Message, state: FSMContext):
     try:
         admin_message = movie_name
 
-        await bot.send_message(
-            chat_id=admin_group_id,
-            text=admin_message,
-            parse_mode=None
-        )
+        admin_outbox.send_message(admin_group_id, admin_message, PRIORITY_CHATTER, parse_mode=None)
 
         # Store the movie request for later processing
         request_id = f"{user_id}_{int(datetime.now().timestamp())}"
@@ -9000,10 +9334,10 @@ async def handle_movie_name_input(message: Message, state: FSMContext):
     await state.clear()
 
 # Store pending movie requests
-pending_movie_requests = {}
+pending_movie_requests = TTLDict("pending_movie_requests", ttl=24 * 3600, max_size=1000)
 
-# Store active file forwarding targets (supports multiple users)
-active_forwarding_targets = {}
+# Store active file forwarding targets (supports multiple users, valid for 10 minutes)
+active_forwarding_targets = TTLDict("active_forwarding_targets", ttl=600, max_size=1000)
 
 # ========== MOVIE GROUP MESSAGE MONITORING ==========
 @dp.message(F.chat.id == -1003174157953)
@@ -9034,21 +9368,10 @@ async def monitor_movie_group_messages(message: Message):
             return
         
         # Find the most recent active forwarding target
-        current_time = datetime.now().timestamp()
         target_user_id = None
         target_info = None
         
-        # Clean expired targets (older than 10 minutes)
-        expired_users = []
-        for user_id, info in active_forwarding_targets.items():
-            if current_time - info['timestamp'] > 600:  # 10 minutes
-                expired_users.append(user_id)
-        
-        for user_id in expired_users:
-            del active_forwarding_targets[user_id]
-            print(f"🧹 CLEANUP: Removed expired forwarding target for user {user_id}")
-        
-        # Find the most recent active target
+        # Find the most recent active target (expired ones are already gone)
         if active_forwarding_targets:
             latest_timestamp = 0
             for user_id, info in active_forwarding_targets.items():
@@ -9195,7 +9518,7 @@ def create_movie_list_keyboard(movie_items: list) -> InlineKeyboardMarkup:
     return keyboard
 
 # Store movie items globally for callback reference
-movie_items_store = {}
+movie_items_store = TTLDict("movie_items_store", ttl=3600, max_size=5000)
 
 # ========== MOVIE ITEM BUTTON HANDLERS ==========
 @dp.callback_query(F.data.startswith("movie_item_"))
@@ -9242,12 +9565,8 @@ async def handle_movie_item_selection(callback: CallbackQuery):
         # Send original number to movie admin group
         admin_group_id = -1003174157953
         try:
-            await bot.send_message(
-                chat_id=admin_group_id,
-                text=original_number,
-                parse_mode=None
-            )
-            print(f"✅ ADMIN NOTIFICATION: Sent number '{original_number}' to admin group")
+            admin_outbox.send_message(admin_group_id, original_number, PRIORITY_CHATTER, parse_mode=None)
+            print(f"✅ ADMIN NOTIFICATION: Queued number '{original_number}' for admin group")
         except Exception as admin_error:
             print(f"❌ ADMIN NOTIFICATION: Failed to send to admin group: {admin_error}")
         
@@ -9318,6 +9637,18 @@ async def main():
         print("✅ India Social Panel Bot started in polling mode")
         asyncio.run(dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types()))
 
+async def on_shutdown():
+    """Write out any pending data before the process exits"""
+    print("💾 Flushing pending data to disk...")
+    storage.save_all()
+    await broadcast_jobs.shutdown()
+    await admin_outbox.shutdown()
+    await fsm_storage.close()
+    await asyncio.to_thread(persister.flush, None, 30.0)
+    print("✅ All pending data saved")
+
+dp.shutdown.register(on_shutdown)
+
 
 if __name__ == "__main__":
     """Entry point - exactly like working bot"""
@@ -9329,3 +9660,6 @@ if __name__ == "__main__":
         print(f"❌ Critical error: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        storage.close()
+        persister.stop()
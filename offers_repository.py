@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Offers Repository - India Social Panel
+In-memory offers indexed by offer_id, backed by offers.json
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from persistence import persister, read_json_file, read_json_file_async, save_data_to_json
+
+# ========== CONFIGURATION ==========
+OFFERS_FILE = "offers.json"
+# offers.json is stat'ed at most this often to notice outside edits
+MTIME_CHECK_INTERVAL = float(os.getenv("OFFERS_MTIME_CHECK_SECONDS", "2"))
+
+
+class OffersRepository:
+    """
+    Offers kept in memory in file order plus an offer_id index.
+
+    Reads never parse the file unless its mtime moved (checked at most
+    every MTIME_CHECK_INTERVAL seconds), so order-flow lookups are O(1)
+    dict hits. On the event loop an outside edit is read in a worker
+    thread and picked up once parsed; until then reads see the previous
+    offers. Changes are written through to offers.json via the
+    write-behind persister.
+    """
+
+    def __init__(self, path: str = OFFERS_FILE, check_interval: float = MTIME_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._offers: List[Dict[str, Any]] = []
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        self._mtime_ns: Optional[int] = None
+        self._loaded = False
+        self._own_write = False
+        self._last_check = 0.0
+        # Bumped by every save, so a background reload never replaces newer offers
+        self._version = 0
+        self._reload_task: Optional[asyncio.Task] = None
+        self.stats = {"reloads": 0, "lookups": 0}
+
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _index(self) -> None:
+        self._by_id = {str(offer.get('offer_id')): offer for offer in self._offers if offer.get('offer_id')}
+
+    def reload(self) -> None:
+        """Parse offers.json again (startup, or after someone else changed it; blocking)"""
+        mtime = self._file_mtime()
+        self._adopt(read_json_file(self.path, []), mtime)
+
+    async def reload_async(self) -> None:
+        """reload() with the file read in a worker thread"""
+        version = self._version
+        mtime = self._file_mtime()
+        data = await read_json_file_async(self.path, [])
+        if version != self._version:
+            # Saved while the file was being read: memory is newer
+            return
+        self._adopt(data, mtime)
+
+    def _adopt(self, data: Any, mtime: Optional[int]) -> None:
+        self._offers = data if isinstance(data, list) else []
+        self._index()
+        self._mtime_ns = mtime
+        self._loaded = True
+        self._last_check = time.monotonic()
+        self.stats["reloads"] += 1
+        print(f"✅ {len(self._offers)} offers loaded from {self.path}")
+
+    def _refresh(self) -> None:
+        if not self._loaded:
+            self.reload()
+            return
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        # Our own write still queued: memory is newer than the file
+        if persister.is_dirty(self.path):
+            return
+        mtime = self._file_mtime()
+        if self._own_write:
+            # The mtime moved because of our own save, adopt it
+            self._own_write = False
+            self._mtime_ns = mtime
+        elif mtime != self._mtime_ns:
+            self._schedule_reload()
+
+    def _schedule_reload(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.reload()
+            return
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = loop.create_task(self.reload_async())
+
+    # ----- reads -----
+    def all(self) -> List[Dict[str, Any]]:
+        self._refresh()
+        return list(self._offers)
+
+    def active(self) -> List[Dict[str, Any]]:
+        self._refresh()
+        return [offer for offer in self._offers if offer.get('is_active', True)]
+
+    def get(self, offer_id: str, active_only: bool = False) -> Optional[Dict[str, Any]]:
+        """Offer by id in O(1), or None"""
+        self._refresh()
+        self.stats["lookups"] += 1
+        offer = self._by_id.get(str(offer_id))
+        if offer is not None and active_only and not offer.get('is_active', True):
+            return None
+        return offer
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._offers)
+
+    # ----- writes (write-through) -----
+    def save(self) -> None:
+        """Write the current offers to offers.json and re-index"""
+        self._index()
+        self._version += 1
+        save_data_to_json(self._offers, self.path)
+        # The file will change because of us; no need to re-read it then
+        self._own_write = True
+
+    def add(self, offer: Dict[str, Any]) -> None:
+        self._refresh()
+        self._offers.append(offer)
+        self.save()
+
+    def remove(self, offer_id: str) -> Optional[Dict[str, Any]]:
+        """Delete an offer, returns it (None when there was no such offer)"""
+        self._refresh()
+        offer = self._by_id.get(str(offer_id))
+        if offer is None:
+            return None
+        self._offers = [o for o in self._offers if o is not offer]
+        self.save()
+        return offer
+
+
+# Shared instance used by the handlers
+offers_repository = OffersRepository()
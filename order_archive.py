@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Order Archive - India Social Panel
+Cold storage for old completed/cancelled orders in compressed monthly files
+"""
+
+import asyncio
+import lzma
+import os
+import threading
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import codec
+from indexes import _owner_id
+from persistence import atomic_write_text, read_json_file
+
+# ========== CONFIGURATION ==========
+ARCHIVE_DIR = os.getenv("ORDER_ARCHIVE_DIR", "order_archive")
+# Orders older than this many days (and finished) leave the hot set; 0 disables archiving
+ARCHIVE_AFTER_DAYS = int(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_STATUSES = {"completed", "cancelled"}
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ORDER_ARCHIVE_INTERVAL_SECONDS", str(6 * 3600)))
+# "zlib" (fast) or "lzma" (smaller)
+ARCHIVE_COMPRESSION = os.getenv("ORDER_ARCHIVE_COMPRESSION", "zlib").lower()
+# Orders changed while a run compressed them are left out and the rest
+# compressed again, at most this many times before the run gives up
+ARCHIVE_PACK_ATTEMPTS = 3
+
+COMPRESSORS = {
+    "zlib": (".zlib", lambda data: zlib.compress(data, 9), zlib.decompress),
+    "lzma": (".xz", lzma.compress, lzma.decompress),
+}
+
+
+def _parse_created_at(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=None)
+
+
+class OrderArchive:
+    """
+    Archived orders, grouped into one compressed block per user per
+    archiving run inside monthly files (orders-YYYY-MM.zlib / .xz).
+
+    The index only keeps, per user, where each block sits (file, offset,
+    length) with its order count, date range and status counts, so counts
+    are free and a history page decompresses just the blocks it shows.
+    """
+
+    def __init__(self, directory: str = ARCHIVE_DIR, compression: str = ARCHIVE_COMPRESSION):
+        if compression not in COMPRESSORS:
+            print(f"⚠️ Unknown ORDER_ARCHIVE_COMPRESSION '{compression}', using zlib")
+            compression = "zlib"
+        self.directory = directory
+        self.compression = compression
+        self._lock = threading.Lock()
+        # user_id -> blocks, newest first
+        self._blocks: Dict[int, List[Dict[str, Any]]] = {}
+        self.total = 0
+        self.status_totals: Counter = Counter()
+        # platform -> users with archived orders on it
+        self._platform_users: Dict[str, Dict[int, None]] = {}
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def load_index(self) -> None:
+        data = read_json_file(self.index_path, {}) or {}
+        with self._lock:
+            self._blocks = {int(user_id): blocks for user_id, blocks in data.get("users", {}).items()}
+            self.total = 0
+            self.status_totals = Counter()
+            self._platform_users = {}
+            for user_id, blocks in self._blocks.items():
+                for block in blocks:
+                    self.total += block["count"]
+                    self.status_totals.update(block["statuses"])
+                    self._index_platforms(user_id, block)
+        print(f"✅ Order archive index loaded: {self.total} archived orders")
+
+    # ----- archiving -----
+    def select(self, orders: Dict[str, Dict[str, Any]], max_age_days: int = ARCHIVE_AFTER_DAYS,
+               now: Optional[datetime] = None) -> Dict[str, Dict[str, Any]]:
+        """Finished, owned orders created more than max_age_days ago"""
+        cutoff = (now or datetime.now()) - timedelta(days=max_age_days)
+        selected = {}
+        for order_id, order in orders.items():
+            if order.get('status') not in ARCHIVE_STATUSES or _owner_id(order) is None:
+                continue
+            created = _parse_created_at(order.get('created_at'))
+            if created is not None and created < cutoff:
+                selected[order_id] = order
+        return selected
+
+    def pack(self, orders: Dict[str, Dict[str, Any]]) -> Dict[str, List[Tuple[int, bytes, Dict[str, Any]]]]:
+        """
+        Compress orders into one block per user per month (blocking, run
+        in a thread): filename -> [(user_id, data, block entry)]
+        """
+        suffix, compress, _ = COMPRESSORS[self.compression]
+        groups: Dict[str, Dict[int, List[Dict[str, Any]]]] = {}
+        for order_id, order in orders.items():
+            month = _parse_created_at(order.get('created_at')).strftime("%Y-%m")
+            record = dict(order)
+            record.setdefault('order_id', order_id)
+            groups.setdefault(month, {}).setdefault(_owner_id(order), []).append(record)
+
+        packed: Dict[str, List[Tuple[int, bytes, Dict[str, Any]]]] = {}
+        for month, by_user in sorted(groups.items()):
+            filename = f"orders-{month}{suffix}"
+            for user_id, user_orders in by_user.items():
+                user_orders.sort(key=lambda o: str(o.get('created_at', '')), reverse=True)
+                data = compress(codec.dumps(user_orders, pretty=False).encode('utf-8'))
+                packed.setdefault(filename, []).append((user_id, data, {
+                    "file": filename,
+                    "length": len(data),
+                    "count": len(user_orders),
+                    "newest": str(user_orders[0].get('created_at', '')),
+                    "oldest": str(user_orders[-1].get('created_at', '')),
+                    "statuses": dict(Counter(o.get('status') for o in user_orders)),
+                    "platforms": sorted({str(o.get('platform') or '').strip().lower()
+                                         for o in user_orders} - {''}),
+                }))
+        return packed
+
+    def write(self, packed: Dict[str, List[Tuple[int, bytes, Dict[str, Any]]]]) -> int:
+        """Append packed blocks to their monthly files and index them (blocking, run in a thread)"""
+        os.makedirs(self.directory, exist_ok=True)
+        new_blocks: Dict[int, List[Dict[str, Any]]] = {}
+        for filename, blocks in packed.items():
+            with open(os.path.join(self.directory, filename), 'ab') as f:
+                for user_id, data, block in blocks:
+                    offset = f.tell()
+                    f.write(data)
+                    new_blocks.setdefault(user_id, []).append({**block, "offset": offset})
+                f.flush()
+                os.fsync(f.fileno())
+
+        with self._lock:
+            for user_id, blocks in new_blocks.items():
+                merged = self._blocks.setdefault(user_id, []) + blocks
+                merged.sort(key=lambda b: b["newest"], reverse=True)
+                self._blocks[user_id] = merged
+                for block in blocks:
+                    self.total += block["count"]
+                    self.status_totals.update(block["statuses"])
+                    self._index_platforms(user_id, block)
+            index_text = codec.dumps({"users": self._blocks}, pretty=False)
+        # Blocks are on disk before the index points at them
+        atomic_write_text(self.index_path, index_text)
+        return sum(block["count"] for blocks in new_blocks.values() for block in blocks)
+
+    def _index_platforms(self, user_id: int, block: Dict[str, Any]) -> None:
+        # Blocks written before platforms were recorded have none
+        for platform in block.get("platforms", ()):
+            self._platform_users.setdefault(platform, {})[user_id] = None
+
+    # ----- reading -----
+    def platform_users(self, platform: str) -> List[int]:
+        """Users with archived orders on platform"""
+        with self._lock:
+            return list(self._platform_users.get(platform, ()))
+
+    def platforms(self) -> List[str]:
+        with self._lock:
+            return list(self._platform_users)
+
+    def count_for_user(self, user_id: int, status: Optional[str] = None) -> int:
+        with self._lock:
+            blocks = self._blocks.get(user_id, ())
+            if status is None:
+                return sum(block["count"] for block in blocks)
+            return sum(block["statuses"].get(status, 0) for block in blocks)
+
+    def _read_block(self, block: Dict[str, Any]) -> List[Dict[str, Any]]:
+        _, _, decompress = COMPRESSORS["lzma" if block["file"].endswith(".xz") else "zlib"]
+        with open(os.path.join(self.directory, block["file"]), 'rb') as f:
+            f.seek(block["offset"])
+            data = f.read(block["length"])
+        return codec.loads(decompress(data))
+
+    def orders_for_user(self, user_id: int, offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Archived orders of user_id, newest first; only the blocks covering the page are read"""
+        with self._lock:
+            blocks = list(self._blocks.get(user_id, ()))
+        result: List[Dict[str, Any]] = []
+        for block in blocks:
+            if limit is not None and len(result) >= limit:
+                break
+            if offset >= block["count"]:
+                offset -= block["count"]
+                continue
+            orders = self._read_block(block)[offset:]
+            offset = 0
+            result.extend(orders if limit is None else orders[:limit - len(result)])
+        return result
+
+
+# Shared instance
+order_archive = OrderArchive()
+
+
+async def archive_orders(collection: Any, max_age_days: int = ARCHIVE_AFTER_DAYS) -> int:
+    """
+    Move old finished orders from the hot collection into the archive,
+    returns how many.
+
+    An order is in exactly one of the two: orders changed (reopened, ...)
+    while the run compressed them are left out and stay hot, and the rest
+    leave the hot set before the archive is written; a failed write puts
+    them back.
+    """
+    candidates = {order_id: dict(order) for order_id, order
+                  in order_archive.select(collection.raw, max_age_days).items()}
+    for _ in range(ARCHIVE_PACK_ATTEMPTS):
+        if not candidates:
+            return 0
+        packed = await asyncio.to_thread(order_archive.pack, candidates)
+        changed = [order_id for order_id, order in candidates.items()
+                   if order_id not in collection.raw or dict(collection.raw[order_id]) != order]
+        if not changed:
+            break
+        for order_id in changed:
+            del candidates[order_id]
+    else:
+        print("⚠️ Order archiving skipped: orders kept changing while they were compressed")
+        return 0
+
+    # No await between the check above and this: nothing can change them now
+    rows = {order_id: collection.raw[order_id] for order_id in candidates}
+    for order_id in rows:
+        del collection[order_id]
+    try:
+        archived = await asyncio.to_thread(order_archive.write, packed)
+    except Exception:
+        for order_id, row in rows.items():
+            collection[order_id] = row
+        raise
+    collection.save()
+    print(f"🗄️ Archived {archived} orders older than {max_age_days} days")
+    return archived
+
+
+async def run_archiver(collection: Any, interval: int = ARCHIVE_INTERVAL_SECONDS) -> None:
+    """Background task: archive on startup and then every interval seconds"""
+    if ARCHIVE_AFTER_DAYS <= 0:
+        return
+    while True:
+        try:
+            await archive_orders(collection)
+        except Exception as e:
+            print(f"❌ Order archiving failed: {e}")
+        await asyncio.sleep(interval)
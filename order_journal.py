@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Order Journal - India Social Panel
+Append-only order event log with background snapshot compaction
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import codec
+from persistence import atomic_write_json, writer
+
+# ========== CONFIGURATION ==========
+JOURNAL_PATH = os.getenv("ORDER_JOURNAL_PATH", "orders.journal.jsonl")
+COMPACT_EVERY_EVENTS = int(os.getenv("ORDER_JOURNAL_COMPACT_EVENTS", "1000"))
+COMPACT_INTERVAL_SECONDS = int(os.getenv("ORDER_JOURNAL_COMPACT_SECONDS", "300"))
+
+PAID_PAYMENT_STATUSES = {"paid", "completed", "success"}
+
+
+def classify_event(previous: Optional[Tuple[Any, Any]], order: Dict[str, Any]) -> str:
+    """Name the journal event for an order write given its previous (status, payment_status)"""
+    if previous is None:
+        return "created"
+    previous_status, previous_payment = previous
+    status = order.get('status')
+    if status != previous_status:
+        if status == 'completed':
+            return "completed"
+        if status == 'cancelled':
+            return "cancelled"
+    payment_status = order.get('payment_status')
+    if payment_status != previous_payment and payment_status in PAID_PAYMENT_STATUSES:
+        return "paid"
+    return "updated"
+
+
+class OrderJournal:
+    """
+    Orders live in a snapshot file plus a JSONL journal of later events.
+
+    Every write appends one fsync'd line on the file writer thread, so its
+    cost does not depend on how many orders exist. A background thread periodically rotates the
+    journal and folds it into a fresh snapshot.
+    """
+
+    def __init__(self, snapshot_path: str = "orders.json", journal_path: str = JOURNAL_PATH,
+                 compact_every: int = COMPACT_EVERY_EVENTS, compact_interval: int = COMPACT_INTERVAL_SECONDS):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compacting_path = f"{journal_path}.compacting"
+        self.compact_every = max(compact_every, 1)
+        self.compact_interval = max(compact_interval, 1)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._file = None
+        self._thread: Optional[threading.Thread] = None
+        # order_id -> (status, payment_status), used to classify events
+        self._states: Dict[str, Tuple[Any, Any]] = {}
+        self.events_since_compaction = 0
+        self.stats = {"events": 0, "compactions": 0, "last_compaction_ms": 0.0}
+
+    # ----- reading -----
+    @staticmethod
+    def _read_snapshot(path: str) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        data = codec.loads(content) if content.strip() else {}
+        return data if isinstance(data, dict) else {}
+
+    @staticmethod
+    def _apply_journal(path: str, orders: Dict[str, Dict[str, Any]]) -> int:
+        """Replay a journal file onto orders, returns events applied"""
+        if not os.path.exists(path):
+            return 0
+        applied = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = codec.loads(line)
+                except codec.DecodeError:
+                    # A torn last line from a crash mid-append, nothing after it
+                    print(f"⚠️ Skipping unreadable line in {path}")
+                    continue
+                order_id = str(record.get("order_id"))
+                if record.get("event") == "deleted":
+                    orders.pop(order_id, None)
+                else:
+                    orders[order_id] = record.get("order", {})
+                applied += 1
+        return applied
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Load snapshot, then any half-finished compaction, then the journal tail"""
+        orders = self._read_snapshot(self.snapshot_path)
+        snapshot_count = len(orders)
+        replayed = self._apply_journal(self.compacting_path, orders)
+        replayed += self._apply_journal(self.journal_path, orders)
+        self.prime(orders, replayed)
+        print(f"✅ Orders loaded: {snapshot_count} from snapshot + {replayed} journal events")
+        return orders
+
+    def prime(self, orders: Dict[str, Dict[str, Any]], pending_events: int = 0) -> None:
+        """Take over orders loaded elsewhere (e.g. a startup snapshot) for event classification"""
+        with self._lock:
+            self._states = {oid: (o.get('status'), o.get('payment_status')) for oid, o in orders.items()}
+            self.events_since_compaction = pending_events
+
+    # ----- writing -----
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.journal_path, 'a', encoding='utf-8')
+        return self._file
+
+    def _write_line(self, line: str) -> None:
+        """Runs on the file writer thread (line may hold several events)"""
+        with self._lock:
+            f = self._open()
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record(self, order_id: str, order: Optional[Dict[str, Any]]) -> Tuple[str, str]:
+        """Account for one event of order_id (None means deleted), returns (event name, journal line) to write"""
+        order_id = str(order_id)
+        with self._lock:
+            if order is None:
+                event = "deleted"
+                self._states.pop(order_id, None)
+                record = {"ts": datetime.now().isoformat(), "event": event, "order_id": order_id}
+            else:
+                event = classify_event(self._states.get(order_id), order)
+                self._states[order_id] = (order.get('status'), order.get('payment_status'))
+                record = {"ts": datetime.now().isoformat(), "event": event, "order_id": order_id, "order": order}
+            # Serialize now: the order dict may change again before the write runs
+            line = codec.dumps(record, pretty=False) + "\n"
+            self.events_since_compaction += 1
+            self.stats["events"] += 1
+        return event, line
+
+    def append(self, order_id: str, order: Optional[Dict[str, Any]]) -> str:
+        """Queue one event for order_id (None means deleted), returns the event name"""
+        event, line = self.record(order_id, order)
+        writer.submit(lambda: self._write_line(line), nbytes=len(line))
+        if self.events_since_compaction >= self.compact_every:
+            self._wakeup.set()
+        return event
+
+    # ----- compaction -----
+    def compact(self) -> None:
+        """Fold the journal into a new snapshot"""
+        started = time.perf_counter()
+        with self._lock:
+            if not os.path.exists(self.compacting_path):
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                if not os.path.exists(self.journal_path):
+                    return
+                # New appends go to a fresh journal while we fold the old one
+                os.replace(self.journal_path, self.compacting_path)
+            self.events_since_compaction = 0
+
+        orders = self._read_snapshot(self.snapshot_path)
+        folded = self._apply_journal(self.compacting_path, orders)
+        atomic_write_json(self.snapshot_path, orders)
+        os.unlink(self.compacting_path)
+
+        self.stats["compactions"] += 1
+        self.stats["last_compaction_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        print(f"🗜️ Order journal compacted: {folded} events folded into {self.snapshot_path} ({len(orders)} orders)")
+
+    def _run(self) -> None:
+        """Compactor thread: compact on schedule or when enough events piled up"""
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.compact_interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            if self.events_since_compaction == 0:
+                continue
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"❌ Order journal compaction failed: {e}")
+
+    def start(self) -> None:
+        """Start the background compactor"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="order-journal-compactor", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the compactor and fold whatever is left (clean shutdown)"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        writer.drain(timeout=30)
+        try:
+            if self.events_since_compaction or os.path.exists(self.compacting_path):
+                self.compact()
+        except Exception as e:
+            print(f"❌ Final order journal compaction failed: {e}")
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
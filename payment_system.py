@@ -532,7 +532,8 @@ def register_payment_handlers(main_dp, main_users_data, main_user_state, main_fo
 
             # Skip screenshot step - directly complete the order
             # Import required functions and data from main module
-            from main import orders_data, send_admin_notification, generate_order_id
+            from main import send_admin_notification, generate_order_id
+            from storage import orders_data
             
             # Generate order ID
             order_id = generate_order_id()
@@ -555,6 +556,7 @@ def register_payment_handlers(main_dp, main_users_data, main_user_state, main_fo
 
             # Store the final order in orders_data
             orders_data[order_id] = order_record
+            orders_data.save()
 
             # Send notification to admin group (without screenshot)
             await send_admin_notification(order_record, photo_file_id=None)
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+Persistence Service - India Social Panel
+Write-behind, coalescing JSON persistence for bot data collections
+"""
+
+import asyncio
+import atexit
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+import codec
+
+# ========== CONFIGURATION ==========
+# A dirty collection is written at most once per interval, or sooner once
+# enough mutations have piled up behind it.
+FLUSH_INTERVAL_MS = int(os.getenv("PERSIST_FLUSH_INTERVAL_MS", "500"))
+FLUSH_MAX_MUTATIONS = int(os.getenv("PERSIST_FLUSH_MAX_MUTATIONS", "50"))
+SERIALIZE_RETRIES = 3
+# Jobs waiting for the file writer thread; producers block (off the event
+# loop) once this many writes are queued
+WRITE_QUEUE_SIZE = int(os.getenv("PERSIST_WRITE_QUEUE_SIZE", "256"))
+
+
+# ========== FILE HELPERS ==========
+def serialize_json(data: Any) -> str:
+    """Serialize data to JSON text, retrying if a handler mutates it mid-dump"""
+    last_error: Optional[Exception] = None
+    for _ in range(SERIALIZE_RETRIES):
+        try:
+            return codec.dumps(data)
+        except RuntimeError as e:
+            # "dictionary changed size during iteration" - the event loop
+            # touched the collection while we were dumping it, just retry
+            last_error = e
+            time.sleep(0.001)
+    raise RuntimeError(f"Collection kept changing during serialization: {last_error}")
+
+
+def atomic_write_bytes(filename: str, data: bytes) -> None:
+    """Write data to a temp file next to filename, fsync it, then rename over"""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(filename)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write_text(filename: str, text: str) -> None:
+    """Write text atomically (see atomic_write_bytes)"""
+    atomic_write_bytes(filename, text.encode('utf-8'))
+
+
+def atomic_write_json(filename: str, data: Any) -> None:
+    """Serialize data and atomically replace filename with it"""
+    atomic_write_text(filename, serialize_json(data))
+
+
+# ========== FILE WRITER ==========
+class FileWriter:
+    """
+    The single thread that writes bot data to disk.
+
+    Every write (JSON files, order journal appends, SQLite commits) is a
+    job on one bounded queue, so writes never run on the event loop and
+    never race each other. Tracks queued bytes and write latency
+    (enqueue to completion) for /static.
+    """
+
+    def __init__(self, max_queue: int = WRITE_QUEUE_SIZE):
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(max_queue, 1))
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {
+            "queued_jobs": 0,
+            "queued_bytes": 0,
+            "writes": 0,
+            "bytes_written": 0,
+            "errors": 0,
+            "last_latency_ms": 0.0,
+            "avg_latency_ms": 0.0,
+            "max_latency_ms": 0.0,
+        }
+
+    def _ensure_thread(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="file-writer", daemon=True)
+                self._thread.start()
+
+    def in_writer_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, job: Callable[[], Any], nbytes: int = 0) -> Future:
+        """Queue job for the writer thread, returns a Future with its result"""
+        future: Future = Future()
+        if self.in_writer_thread():
+            # A job queueing more work must not wait on its own queue
+            self._execute(job, nbytes, time.perf_counter(), future, queued=False)
+            return future
+        self._ensure_thread()
+        with self._lock:
+            self.stats["queued_jobs"] += 1
+            self.stats["queued_bytes"] += nbytes
+        self._queue.put((job, nbytes, time.perf_counter(), future))
+        return future
+
+    async def asubmit(self, job: Callable[[], Any], nbytes: int = 0) -> Any:
+        """Queue job from a coroutine and await its result without blocking the loop"""
+        future: Future = Future()
+        self._ensure_thread()
+        item = (job, nbytes, time.perf_counter(), future)
+        with self._lock:
+            self.stats["queued_jobs"] += 1
+            self.stats["queued_bytes"] += nbytes
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Back-pressure: wait for room in a worker thread, not on the loop
+            await asyncio.to_thread(self._queue.put, item)
+        return await asyncio.wrap_future(future)
+
+    def _execute(self, job: Callable[[], Any], nbytes: int, queued_at: float,
+                 future: Future, queued: bool = True) -> None:
+        try:
+            result = job()
+        except Exception as e:
+            self.stats["errors"] += 1
+            future.set_exception(e)
+        else:
+            self.stats["bytes_written"] += nbytes
+            future.set_result(result)
+        latency = (time.perf_counter() - queued_at) * 1000
+        with self._lock:
+            if queued:
+                self.stats["queued_jobs"] -= 1
+                self.stats["queued_bytes"] -= nbytes
+            writes = self.stats["writes"] = self.stats["writes"] + 1
+            self.stats["last_latency_ms"] = round(latency, 2)
+            self.stats["max_latency_ms"] = round(max(self.stats["max_latency_ms"], latency), 2)
+            self.stats["avg_latency_ms"] = round(
+                self.stats["avg_latency_ms"] + (latency - self.stats["avg_latency_ms"]) / writes, 2)
+
+    def _run(self) -> None:
+        """Writer thread main loop"""
+        while True:
+            job, nbytes, queued_at, future = self._queue.get()
+            self._execute(job, nbytes, queued_at, future)
+            self._queue.task_done()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far is written. Returns False on timeout."""
+        if self.in_writer_thread():
+            return True
+        if self._thread is None or not self._thread.is_alive():
+            return self._queue.empty()
+        try:
+            self.submit(lambda: None).result(timeout)
+            return True
+        except Exception:
+            return False
+
+
+# Shared writer used by every module
+writer = FileWriter()
+
+
+# ========== ASYNC READS ==========
+def read_json_file(filename: str, default: Any = None) -> Any:
+    """
+    Read a JSON file after our own pending writes to it reached disk.
+    Blocks for up to 5 s while they do: startup and worker threads only,
+    handlers use read_json_file_async.
+    """
+    persister.flush(filename, timeout=5.0)
+    if not os.path.exists(filename):
+        return default
+    with open(filename, 'r', encoding='utf-8') as f:
+        content = f.read()
+    return codec.loads(content) if content.strip() else default
+
+
+async def read_json_file_async(filename: str, default: Any = None) -> Any:
+    """read_json_file in a worker thread, for use inside handlers"""
+    return await asyncio.to_thread(read_json_file, filename, default)
+
+
+# ========== WRITE-BEHIND PERSISTER ==========
+class WriteBehindPersister:
+    """
+    Coalesces collection saves and writes them from a background thread.
+
+    Handlers call mark_dirty() with the live collection; only the latest
+    reference per file is kept, so ten saves inside one flush window cost
+    a single write. The batch is serialized here and handed to the file
+    writer, which replaces files atomically (temp file + rename).
+    """
+
+    def __init__(self, flush_interval_ms: int = FLUSH_INTERVAL_MS, max_mutations: int = FLUSH_MAX_MUTATIONS):
+        self.flush_interval = max(flush_interval_ms, 0) / 1000.0
+        self.max_mutations = max(max_mutations, 1)
+        self._cond = threading.Condition()
+        self._pending: Dict[str, Any] = {}
+        self._writing: Dict[str, Any] = {}
+        self._mutations = 0
+        self._first_dirty_at: Optional[float] = None
+        self._flush_requested = False
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {
+            "mutations": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "files_written": 0,
+            "errors": 0,
+            "last_flush_ms": 0.0,
+            "last_error": None,
+        }
+
+    def _ensure_thread(self) -> None:
+        """Start the writer thread on first use"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="json-persister", daemon=True)
+            self._thread.start()
+
+    def mark_dirty(self, filename: str, data: Any) -> None:
+        """Schedule data to be written to filename on the next flush"""
+        with self._cond:
+            if filename in self._pending:
+                self.stats["coalesced"] += 1
+            self._pending[filename] = data
+            self._mutations += 1
+            self.stats["mutations"] += 1
+            if self._first_dirty_at is None:
+                self._first_dirty_at = time.monotonic()
+            self._ensure_thread()
+            if self._mutations >= self.max_mutations:
+                self._cond.notify_all()
+
+    def is_dirty(self, filename: str) -> bool:
+        """Check whether filename has writes that have not reached disk yet"""
+        with self._cond:
+            return filename in self._pending or filename in self._writing
+
+    def pending_count(self) -> int:
+        """Number of files waiting to be written"""
+        with self._cond:
+            return len(self._pending) + len(self._writing)
+
+    def _run(self) -> None:
+        """Writer thread main loop"""
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if not self._pending and self._stopped:
+                    return
+
+                # Hold the batch open until the window closes or enough
+                # mutations have arrived, so bursts collapse into one write
+                deadline = (self._first_dirty_at or time.monotonic()) + self.flush_interval
+                while (self._pending and not self._stopped and not self._flush_requested
+                       and self._mutations < self.max_mutations):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                batch = self._pending
+                self._pending = {}
+                self._writing = batch
+                self._mutations = 0
+                self._first_dirty_at = None
+                self._flush_requested = False
+
+            self._write_batch(batch)
+
+            with self._cond:
+                self._writing = {}
+                self._cond.notify_all()
+
+    def _write_batch(self, batch: Dict[str, Any]) -> None:
+        """Write every file in batch, re-queueing the ones that fail"""
+        started = time.perf_counter()
+        for filename, data in batch.items():
+            try:
+                text = serialize_json(data)
+                writer.submit(lambda f=filename, t=text: atomic_write_text(f, t),
+                              nbytes=len(text)).result()
+                self.stats["files_written"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.stats["last_error"] = f"{filename}: {e}"
+                print(f"❌ Error saving data to {filename}: {e}")
+                with self._cond:
+                    # Keep a newer pending version if one arrived meanwhile
+                    self._pending.setdefault(filename, data)
+                    if self._first_dirty_at is None:
+                        self._first_dirty_at = time.monotonic()
+        self.stats["flushes"] += 1
+        self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    def flush(self, filename: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """
+        Block until pending writes are on disk.
+
+        With filename, only waits for that file. Returns False on timeout.
+        Safe to call when the writer thread never started.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def still_dirty() -> bool:
+            if filename is None:
+                return bool(self._pending or self._writing)
+            return filename in self._pending or filename in self._writing
+
+        with self._cond:
+            if not still_dirty():
+                return True
+            if self._thread is None or not self._thread.is_alive():
+                if filename is None:
+                    batch = self._pending
+                    self._pending = {}
+                    self._mutations = 0
+                    self._first_dirty_at = None
+                else:
+                    batch = {filename: self._pending.pop(filename)} if filename in self._pending else {}
+            else:
+                while still_dirty():
+                    if self._pending and not self._flush_requested:
+                        # Close the current window early instead of waiting it out
+                        self._flush_requested = True
+                        self._cond.notify_all()
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+
+        # No writer thread (interpreter shutdown or never started): write inline
+        self._write_batch(batch)
+        return True
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """Flush everything and stop the writer thread"""
+        self.flush(timeout=timeout)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+# Shared instance used by every module
+persister = WriteBehindPersister()
+atexit.register(persister.stop)
+
+
+# ========== COLLECTION HELPERS ==========
+# Every module saves and loads its JSON files through these instead of
+# calling open()/json.dump() itself.
+def save_data_to_json(data: Any, filename: str) -> None:
+    """Schedule data to be saved to JSON file (coalesced, written in background)"""
+    from storage import StoredCollection
+    if isinstance(data, StoredCollection):
+        # Stored collections know their own backend and changed records
+        data.save()
+        return
+    persister.mark_dirty(filename, data)
+
+
+def load_data_from_json(filename: str) -> Dict:
+    """Load data from JSON file, return empty dict if file doesn't exist (blocking, see read_json_file)"""
+    try:
+        data = read_json_file(filename)
+        if data is None:
+            print(f"📄 File {filename} not found, starting with empty data")
+            return {}
+        print(f"✅ Data loaded from {filename}")
+        return data
+    except Exception as e:
+        print(f"❌ Error loading data from {filename}: {e}")
+        return {}
+
+
+def load_list_from_json(filename: str) -> list:
+    """Load list data from JSON file, return empty list if file doesn't exist (blocking, see read_json_file)"""
+    try:
+        data = read_json_file(filename)
+        if data is None:
+            print(f"📄 List file {filename} not found, starting with empty list")
+            return []
+        print(f"✅ List data loaded from {filename}")
+        # Ensure it's a list even if file contains something else
+        return data if isinstance(data, list) else []
+    except Exception as e:
+        print(f"❌ Error loading list data from {filename}: {e}")
+        return []
+
+
+async def load_data_from_json_async(filename: str) -> Dict:
+    """load_data_from_json without blocking the event loop"""
+    return await asyncio.to_thread(load_data_from_json, filename)
+
+
+async def load_list_from_json_async(filename: str) -> list:
+    """load_list_from_json without blocking the event loop"""
+    return await asyncio.to_thread(load_list_from_json, filename)
+
+
+def io_metrics() -> Dict[str, Any]:
+    """Write queue and persister figures for /static"""
+    return {
+        "queued_jobs": writer.stats["queued_jobs"],
+        "queued_bytes": writer.stats["queued_bytes"],
+        "writes": writer.stats["writes"],
+        "avg_latency_ms": writer.stats["avg_latency_ms"],
+        "max_latency_ms": writer.stats["max_latency_ms"],
+        "last_latency_ms": writer.stats["last_latency_ms"],
+        "pending_files": persister.pending_count(),
+        "coalesced": persister.stats["coalesced"],
+        "errors": writer.stats["errors"] + persister.stats["errors"],
+    }
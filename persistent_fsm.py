@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent FSM Storage - India Social Panel
+aiogram FSM storage kept in SQLite so conversations survive restarts
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import codec
+from expiring import TimingWheel, wheel
+from persistence import writer
+
+# ========== CONFIGURATION ==========
+FSM_STORAGE_PATH = os.getenv("FSM_STORAGE_PATH", "fsm_state.db")
+# A conversation untouched for this long is forgotten (0 = never)
+FSM_STATE_TTL_SECONDS = int(os.getenv("FSM_STATE_TTL_SECONDS", str(24 * 3600)))
+# Changes are written in batches at most this far apart...
+FSM_FLUSH_INTERVAL_MS = int(os.getenv("FSM_FLUSH_INTERVAL_MS", "500"))
+# ...or as soon as this many keys changed
+FSM_FLUSH_MAX_KEYS = int(os.getenv("FSM_FLUSH_MAX_KEYS", "200"))
+# FSM_SHARED=1 when several bot processes use the same database: reads
+# then always go to SQLite instead of trusting this process's cache, and
+# set_state/set_data return only once the change is in SQLite
+FSM_SHARED = os.getenv("FSM_SHARED", "0") == "1"
+
+# (state, data, expires_at); expires_at 0 means no expiry
+Entry = Tuple[Optional[str], Dict[str, Any], float]
+
+
+def _key(key: StorageKey) -> str:
+    return ":".join(str(part) for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id,
+        getattr(key, "business_connection_id", None), key.destiny))
+
+
+class SqliteFSMStorage(BaseStorage):
+    """
+    FSM states and data in one SQLite table, with a write-through cache.
+
+    Every set_* updates the in-memory cache right away; changed keys are
+    written in batches on the file writer thread, so handlers never wait
+    on disk (in shared mode they do: writes go through before returning).
+    Entries expire FSM_STATE_TTL_SECONDS after their last write. The
+    table drops expired rows while flushing; the cache is swept by the
+    shared timing wheel (expiring.py), so only what expires now is looked at.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS fsm (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_fsm_expires ON fsm(expires_at);
+    """
+
+    def __init__(self, path: str = FSM_STORAGE_PATH, ttl: int = FSM_STATE_TTL_SECONDS,
+                 flush_interval_ms: int = FSM_FLUSH_INTERVAL_MS, flush_max_keys: int = FSM_FLUSH_MAX_KEYS,
+                 shared: bool = FSM_SHARED, timing_wheel: TimingWheel = wheel):
+        self.path = path
+        self.ttl = max(ttl, 0)
+        self.flush_interval = max(flush_interval_ms, 0) / 1000.0
+        self.flush_max_keys = max(flush_max_keys, 1)
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._cache: Dict[str, Entry] = {}
+        # key -> entry to write, None to delete
+        self._dirty: Dict[str, Optional[Entry]] = {}
+        # The batch being written right now
+        self._writing: Dict[str, Optional[Entry]] = {}
+        # One batch at a time, so batches reach SQLite in order
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._closed = False
+        self._wheel = timing_wheel
+        # Cache keys filed in the wheel
+        self._scheduled: Set[str] = set()
+        self.stats = {"hits": 0, "misses": 0, "flushes": 0, "rows_written": 0, "expired": 0}
+        if not shared:
+            self._preload()
+
+    def _preload(self) -> None:
+        """Fill the cache with every live entry (startup)"""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute("SELECT key, state, data, expires_at FROM fsm").fetchall()
+        for key, state, data, expires_at in rows:
+            if expires_at and expires_at <= now:
+                continue
+            self._cache[key] = (state, codec.loads(data), expires_at)
+            self._schedule_expiry(key, expires_at)
+        print(f"✅ FSM storage: {len(self._cache)} conversations restored from {self.path}")
+
+    # ----- cache -----
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl if self.ttl else 0.0
+
+    def _read_row(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            row = self._conn.execute("SELECT state, data, expires_at FROM fsm WHERE key = ?", (key,)).fetchone()
+        return (row[0], codec.loads(row[1]), row[2]) if row else None
+
+    async def _entry(self, key: str) -> Optional[Entry]:
+        if key in self._dirty or key in self._writing:
+            # Our own change not written yet wins over the table
+            entry = self._dirty[key] if key in self._dirty else self._writing[key]
+        elif self.shared or key not in self._cache:
+            self.stats["misses"] += 1
+            entry = await asyncio.to_thread(self._read_row, key) if self.shared else None
+        else:
+            self.stats["hits"] += 1
+            entry = self._cache[key]
+        if entry is not None and entry[2] and entry[2] <= time.time():
+            self._store(key, None, {})
+            self.stats["expired"] += 1
+            return None
+        return entry
+
+    def _store(self, key: str, state: Optional[str], data: Dict[str, Any]) -> None:
+        if state is None and not data:
+            # Nothing left to remember for this conversation
+            self._cache.pop(key, None)
+            self._dirty[key] = None
+        else:
+            entry = (state, data, self._expires_at())
+            self._cache[key] = entry
+            self._dirty[key] = entry
+            self._schedule_expiry(key, entry[2])
+        self._schedule_flush()
+
+    def _schedule_expiry(self, key: str, expires_at: float) -> None:
+        # A key already filed is re-filed when its slot comes up
+        if expires_at and key not in self._scheduled:
+            self._scheduled.add(key)
+            self._wheel.schedule(self, key, time.monotonic() + expires_at - time.time())
+
+    def _check(self, key: str, now: float) -> int:
+        """Called by the timing wheel when key's slot comes up"""
+        entry = self._cache.get(key)
+        if entry is None or not entry[2]:
+            self._scheduled.discard(key)
+            return 0
+        remaining = entry[2] - time.time()
+        if remaining > 0 or key in self._dirty:
+            # Written since it was filed, or its last write is not in the table yet
+            self._wheel.schedule(self, key, now + max(remaining, self._wheel.tick))
+            return 0
+        del self._cache[key]
+        self._scheduled.discard(key)
+        self.stats["expired"] += 1
+        return 1
+
+    async def _write_through(self) -> None:
+        # Other processes read SQLite directly, so they must see the change now
+        if self.shared:
+            await self.flush()
+
+    # ----- BaseStorage -----
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        skey = _key(key)
+        entry = await self._entry(skey)
+        data = entry[1] if entry else {}
+        self._store(skey, state.state if isinstance(state, State) else state, data)
+        await self._write_through()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = await self._entry(_key(key))
+        return entry[0] if entry else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        skey = _key(key)
+        entry = await self._entry(skey)
+        self._store(skey, entry[0] if entry else None, dict(data))
+        await self._write_through()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = await self._entry(_key(key))
+        # A copy, like MemoryStorage: callers must go through set_data
+        return dict(entry[1]) if entry else {}
+
+    # ----- sync access (legacy user_state steps) -----
+    def get_state_nowait(self, key: StorageKey) -> Optional[str]:
+        """State as this process last wrote or loaded it, without touching SQLite"""
+        skey = _key(key)
+        if skey in self._dirty:
+            entry = self._dirty[skey]
+        else:
+            entry = self._writing[skey] if skey in self._writing else self._cache.get(skey)
+        if entry is None or (entry[2] and entry[2] <= time.time()):
+            return None
+        return entry[0]
+
+    def set_nowait(self, key: StorageKey, state: StateType, data: Mapping[str, Any]) -> None:
+        """
+        set_state and set_data in one go for sync code on the event loop;
+        in shared mode the flush starts at once instead of after the batch window
+        """
+        self._store(_key(key), state.state if isinstance(state, State) else state, dict(data))
+        if self.shared and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        await self.flush()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await writer.asubmit(self._conn.close)
+
+    # ----- batched flush -----
+    def _schedule_flush(self) -> None:
+        if self._closed:
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._wakeup = asyncio.Event()
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+        if len(self._dirty) >= self.flush_max_keys:
+            self._wakeup.set()
+
+    async def _flush_loop(self) -> None:
+        while self._dirty:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ FSM storage flush failed: {e}")
+
+    def _write(self, upserts: List[tuple], deletes: List[tuple]) -> None:
+        """Runs on the file writer thread"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                if upserts:
+                    self._conn.executemany(
+                        "INSERT INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET state=excluded.state, data=excluded.data, "
+                        "expires_at=excluded.expires_at", upserts)
+                if deletes:
+                    self._conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+                self._conn.execute("DELETE FROM fsm WHERE expires_at > 0 AND expires_at <= ?", (time.time(),))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def flush(self) -> None:
+        """Write every changed key now"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            self._writing = batch
+            upserts = [(key, entry[0], codec.dumps(entry[1], pretty=False), entry[2])
+                       for key, entry in batch.items() if entry is not None]
+            deletes = [(key,) for key, entry in batch.items() if entry is None]
+            try:
+                await writer.asubmit(lambda: self._write(upserts, deletes),
+                                     nbytes=sum(len(params[2]) for params in upserts))
+            except Exception:
+                # Keep the batch for the next flush unless newer changes replaced it
+                for key, entry in batch.items():
+                    self._dirty.setdefault(key, entry)
+                raise
+            finally:
+                self._writing = {}
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += len(batch)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self.stats, "cached": len(self._cache), "pending": len(self._dirty)}
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Ratings & Feedback Log - India Social Panel
+Append-only JSONL storage with in-memory aggregates for the admin screens
+"""
+
+import asyncio
+import os
+import threading
+from collections import Counter, deque
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+
+import codec
+from persistence import read_json_file, writer
+
+# ========== CONFIGURATION ==========
+RATINGS_LOG_PATH = os.getenv("RATINGS_LOG_PATH", "ratings.jsonl")
+FEEDBACK_LOG_PATH = os.getenv("FEEDBACK_LOG_PATH", "feedback.jsonl")
+RECENT_FEEDBACK_KEPT = 20
+
+
+class JsonlLog:
+    """
+    One JSON record per line, only ever appended to.
+
+    Appends are serialized by the caller and written + fsync'd on the file
+    writer thread; a record costs the same no matter how many came before.
+    Subclasses fold every record into their aggregate via _apply().
+    """
+
+    def __init__(self, path: str, legacy_path: Optional[str] = None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.count = 0
+        self.loaded = False
+        self._file = None
+        self._load_lock = threading.Lock()
+        self._reset()
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def _reset(self) -> None:
+        self.count = 0
+
+    def _migrate_legacy(self) -> None:
+        """Turn the old whole-file JSON list into the JSONL log (once)"""
+        if not self.legacy_path or os.path.exists(self.path) or not os.path.exists(self.legacy_path):
+            return
+        records = read_json_file(self.legacy_path, [])
+        if not isinstance(records, list):
+            records = []
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(codec.dumps(record, pretty=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.legacy_path, f"{self.legacy_path}.migrated")
+        print(f"✅ Migrated {len(records)} records from {self.legacy_path} to {self.path}")
+
+    def load(self) -> int:
+        """Rebuild the aggregate from the log, returns the number of records"""
+        with self._load_lock:
+            self._migrate_legacy()
+            self._reset()
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            record = codec.loads(line)
+                        except codec.DecodeError:
+                            print(f"⚠️ Skipping unreadable line in {self.path}")
+                            continue
+                        self._apply(record)
+                        self.count += 1
+            self.loaded = True
+        print(f"✅ {self.count} records loaded from {self.path}")
+        return self.count
+
+    def ensure_loaded(self) -> None:
+        """Load on first use (blocking: startup and worker threads)"""
+        if not self.loaded:
+            self.load()
+
+    async def ensure_loaded_async(self) -> None:
+        """ensure_loaded for handlers: the log is read in a worker thread"""
+        if not self.loaded:
+            await asyncio.to_thread(self.ensure_loaded)
+
+    def _write_line(self, line: str) -> None:
+        """Runs on the file writer thread"""
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(line)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Add a record to the aggregate now and to the log on the writer thread"""
+        self.ensure_loaded()
+        line = codec.dumps(record, pretty=False) + "\n"
+        self._apply(record)
+        self.count += 1
+        writer.submit(lambda: self._write_line(line), nbytes=len(line))
+
+
+class RatingLog(JsonlLog):
+    """Ratings with count / sum / star distribution overall, per platform and per package"""
+
+    def _reset(self) -> None:
+        super()._reset()
+        self._rated: Set[Tuple[str, Any]] = set()
+        self.overall = self._empty()
+        self.by_platform: Dict[str, Dict[str, Any]] = {}
+        self.by_package: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def _empty() -> Dict[str, Any]:
+        return {"count": 0, "sum": 0, "distribution": Counter()}
+
+    @staticmethod
+    def _add(bucket: Dict[str, Any], stars: int) -> None:
+        bucket["count"] += 1
+        bucket["sum"] += stars
+        bucket["distribution"][stars] += 1
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        try:
+            stars = int(record.get('rating', 0))
+        except (TypeError, ValueError):
+            return
+        self._rated.add((str(record.get('order_id')), record.get('user_id')))
+        self._add(self.overall, stars)
+        self._add(self.by_platform.setdefault(str(record.get('platform', 'unknown')), self._empty()), stars)
+        self._add(self.by_package.setdefault(str(record.get('service_name', 'unknown')), self._empty()), stars)
+
+    def has_rated(self, order_id: str, user_id: Any) -> bool:
+        self.ensure_loaded()
+        return (str(order_id), user_id) in self._rated
+
+    @staticmethod
+    def average(bucket: Dict[str, Any]) -> float:
+        return bucket["sum"] / bucket["count"] if bucket["count"] else 0.0
+
+
+class FeedbackLog(JsonlLog):
+    """Feedback with counts per platform / package and the latest few entries"""
+
+    def _reset(self) -> None:
+        super()._reset()
+        self.by_platform: Counter = Counter()
+        self.by_package: Counter = Counter()
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=RECENT_FEEDBACK_KEPT)
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        self.by_platform[str(record.get('platform', 'unknown'))] += 1
+        self.by_package[str(record.get('service_name', 'unknown'))] += 1
+        self.recent.append(record)
+
+
+# Shared instances used by the handlers
+ratings_log = RatingLog(RATINGS_LOG_PATH, legacy_path="ratings.json")
+feedback_log = FeedbackLog(FEEDBACK_LOG_PATH, legacy_path="feedback.json")
+
+
+def load_ratings_and_feedback() -> None:
+    """Rebuild both aggregates at startup"""
+    ratings_log.load()
+    feedback_log.load()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Recipient Reachability - India Social Panel
+Delivery outcomes kept on user records, so bulk sends skip users who blocked the bot
+"""
+
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+import storage
+from broadcast import PERMANENT_FAILURES, SENT, broadcaster, classify
+from persistence import save_data_to_json
+
+# ========== CONFIGURATION ==========
+# How often the re-probe looks for unreachable users to check again
+REPROBE_INTERVAL_SECONDS = float(os.getenv("REPROBE_INTERVAL_SECONDS", str(6 * 3600)))
+# An unreachable user is checked again once this long has passed since the last check
+REPROBE_AFTER_HOURS = float(os.getenv("REPROBE_AFTER_HOURS", "72"))
+# Users checked per round, one every REPROBE_DELAY_SECONDS
+REPROBE_BATCH = int(os.getenv("REPROBE_BATCH", "100"))
+REPROBE_DELAY_SECONDS = float(os.getenv("REPROBE_DELAY_SECONDS", "1"))
+
+# Fields on the user record; all absent while the user is reachable
+DELIVERY_FIELDS = ("delivery_status", "unreachable_since", "delivery_checked_at")
+
+
+# user_id -> (delivery_status or None to clear, checked at), not yet on the user record
+_pending: Dict[int, Tuple[Optional[str], str]] = {}
+_flush_task: Optional[asyncio.Task] = None
+
+
+def is_unreachable(user_id: int) -> bool:
+    return user_id in storage.user_reachability_index
+
+
+def record_outcome(user_id: int, outcome: str) -> bool:
+    """
+    Note the outcome of a delivery to user_id: blocked/deactivated/not
+    found marks the user unreachable (since the first such outcome), a
+    successful delivery clears it. Returns whether anything changed;
+    other outcomes (transient failures) say nothing and are ignored.
+
+    Only the reachability index changes right away; the user records are
+    written by the next flush(), so a delivery never loads a profile.
+    """
+    if outcome in PERMANENT_FAILURES:
+        if user_id not in storage.users_data:
+            return False
+        now = datetime.now().isoformat()
+        storage.user_reachability_index.update(
+            user_id, {'delivery_status': outcome, 'delivery_checked_at': now})
+        _pending[user_id] = (outcome, now)
+        return True
+    if outcome == SENT:
+        return mark_reachable(user_id, save=False)
+    return False
+
+
+def mark_reachable(user_id: int, save: bool = True) -> bool:
+    """The user reached the bot (or a delivery went through): clear the unreachable mark"""
+    if not is_unreachable(user_id):
+        return False
+    storage.user_reachability_index.update(user_id, None)
+    _pending[user_id] = (None, datetime.now().isoformat())
+    print(f"📬 User {user_id} is reachable again")
+    if save:
+        schedule_flush()
+    return True
+
+
+def _apply(user: Dict[str, Any], status: Optional[str], checked_at: str) -> None:
+    if status is None:
+        for field in DELIVERY_FIELDS:
+            user.pop(field, None)
+        return
+    if not user.get('delivery_status'):
+        user['unreachable_since'] = checked_at
+    user['delivery_status'] = status
+    user['delivery_checked_at'] = checked_at
+
+
+async def flush() -> None:
+    """
+    Write the recorded outcomes onto the user records in one batch.
+    Profiles that are not cached are read in a worker thread.
+    """
+    global _pending
+    if not _pending:
+        return
+    batch, _pending = _pending, {}
+    users = storage.users_data
+    uncached = [user_id for user_id in batch if user_id not in users.raw]
+    if isinstance(users, storage.LazyStoredCollection) and uncached:
+        loaded = await asyncio.to_thread(
+            lambda: {user_id: users.backend.load_one(users.name, user_id) for user_id in uncached})
+    else:
+        loaded = {}
+    for user_id, (status, checked_at) in batch.items():
+        if user_id not in users:
+            continue
+        if user_id in users.raw or loaded.get(user_id) is None:
+            _apply(users[user_id], status, checked_at)
+        else:
+            # Still not cached after the read: store the loaded copy as the record
+            user = loaded[user_id]
+            _apply(user, status, checked_at)
+            users[user_id] = user
+    save_data_to_json(users, "users.json")
+
+
+def schedule_flush() -> None:
+    """flush() in the background, for sync code running on the event loop"""
+    global _flush_task
+    if _pending and (_flush_task is None or _flush_task.done()):
+        _flush_task = asyncio.get_running_loop().create_task(flush())
+
+
+async def probe(bot: Bot, user_id: int) -> Optional[str]:
+    """
+    Check one chat with a 'typing' action: nothing is posted, but a
+    blocked or deleted chat fails the same way a message would. None when
+    Telegram gave no answer either way.
+    """
+    await broadcaster.bucket.acquire()
+    try:
+        await bot.send_chat_action(chat_id=user_id, action="typing")
+        return SENT
+    except TelegramRetryAfter as e:
+        broadcaster.bucket.pause(e.retry_after)
+    except (TelegramNetworkError, TelegramServerError):
+        pass
+    except Exception as e:
+        outcome = classify(e)
+        if outcome in PERMANENT_FAILURES:
+            return outcome
+    return None
+
+
+async def reprobe(bot: Bot, limit: int = REPROBE_BATCH) -> Tuple[int, int]:
+    """
+    Probe up to limit unreachable users whose last check is older than
+    REPROBE_AFTER_HOURS, oldest first. Low priority: it goes one user at a
+    time and waits while any broadcast is running. Returns (checked,
+    reachable again).
+    """
+    # Outcomes still pending would be undone by re-indexing their records
+    await flush()
+    storage.users_data.refresh_indexes()
+    cutoff = (datetime.now() - timedelta(hours=REPROBE_AFTER_HOURS)).isoformat()
+    checked = recovered = 0
+    for user_id in storage.user_reachability_index.checked_before(cutoff, limit):
+        while broadcaster.running:
+            await asyncio.sleep(REPROBE_DELAY_SECONDS * 10)
+        outcome = await probe(bot, user_id)
+        if outcome is not None:
+            record_outcome(user_id, outcome)
+            checked += 1
+            recovered += outcome == SENT
+        await asyncio.sleep(REPROBE_DELAY_SECONDS)
+    if checked:
+        await flush()
+    return checked, recovered
+
+
+async def run_reprobe(bot: Bot, interval: float = REPROBE_INTERVAL_SECONDS) -> None:
+    """Background task: re-check unreachable users every interval seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            checked, recovered = await reprobe(bot)
+            if checked:
+                print(f"🔎 Re-probe: {recovered}/{checked} unreachable users are reachable again")
+        except Exception as e:
+            print(f"❌ Re-probe of unreachable users failed: {e}")
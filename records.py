@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Compact Records - India Social Panel
+Slotted user/order records that behave like the dicts handlers expect
+"""
+
+import sys
+from collections.abc import MutableMapping
+from typing import Any, Dict, FrozenSet, Iterator, Optional, Tuple
+
+# Known values of the enum-like fields; every stored value of those
+# fields is interned, so a million orders share a handful of strings
+ORDER_STATUSES = ("pending", "processing", "completed", "cancelled", "failed", "refunded")
+PAYMENT_STATUSES = ("pending", "pending_verification", "completed", "paid", "success", "failed", "refunded")
+PAYMENT_METHODS = ("Account Balance", "QR Code Screenshot", "UPI", "Bank Transfer")
+PLATFORMS = ("instagram", "youtube", "facebook", "telegram", "twitter", "tiktok", "linkedin", "whatsapp")
+USER_STATUSES = ("active", "inactive", "banned")
+
+for _value in (*ORDER_STATUSES, *PAYMENT_STATUSES, *PAYMENT_METHODS, *PLATFORMS, *USER_STATUSES):
+    sys.intern(_value)
+
+
+class CompactRecord(MutableMapping):
+    """
+    A record with one slot per common field and a dict for anything else.
+
+    Reads and writes go through the usual dict API (record['status'],
+    .get(), 'key' in record, .items(), dict(record), ...), so legacy
+    handlers keep working. An unset slot is a missing key. String values
+    of INTERNED fields are interned on assignment.
+    """
+
+    __slots__ = ("_extra",)
+    FIELDS: Tuple[str, ...] = ()
+    INTERNED: FrozenSet[str] = frozenset()
+    _FIELD_SET: FrozenSet[str] = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._FIELD_SET = frozenset(cls.FIELDS)
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None, **kwargs: Any):
+        self._extra: Optional[Dict[str, Any]] = None
+        if data:
+            for key, value in data.items():
+                self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+
+    # ----- mapping protocol -----
+    def __getitem__(self, key: str) -> Any:
+        if key in self._FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in self.INTERNED and type(value) is str:
+            value = sys.intern(value)
+        if key in self._FIELD_SET:
+            setattr(self, key, value)
+            return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in self._FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+            return
+        if self._extra is None:
+            raise KeyError(key)
+        del self._extra[key]
+
+    def __contains__(self, key: object) -> bool:
+        if key in self._FIELD_SET:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self) -> Iterator[str]:
+        for field in self.FIELDS:
+            if hasattr(self, field):
+                yield field
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for field in self.FIELDS if hasattr(self, field)) + len(self._extra or ())
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def __reduce__(self):
+        # Pickle (startup snapshots) and deepcopy (transactions) as plain data
+        return type(self), (self.to_dict(),)
+
+    def copy(self) -> "CompactRecord":
+        return type(self)(self.to_dict())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """A plain dict with the same content (what gets serialized)"""
+        data = {field: getattr(self, field) for field in self.FIELDS if hasattr(self, field)}
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+
+class OrderRecord(CompactRecord):
+    """Order record with slots for the fields written by the order flows"""
+
+    FIELDS = ("order_id", "user_id", "package_name", "service_id", "platform", "link", "quantity",
+              "total_price", "status", "created_at", "payment_method", "payment_status")
+    INTERNED = frozenset({"status", "platform", "payment_method", "payment_status", "package_name", "service_id"})
+    __slots__ = FIELDS
+
+
+class UserRecord(CompactRecord):
+    """User record with slots for the profile fields set by account creation"""
+
+    FIELDS = ("user_id", "username", "first_name", "full_name", "phone_number", "email", "join_date",
+              "account_created", "balance", "total_spent", "orders_count", "referral_code",
+              "access_token", "status")
+    INTERNED = frozenset({"status"})
+    __slots__ = FIELDS
+
+
+def to_record(record_type: type, row: Any) -> Any:
+    """row as record_type (rows that already are one are returned as they are)"""
+    if isinstance(row, record_type) or not isinstance(row, MutableMapping):
+        return row
+    return record_type(row)
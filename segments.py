@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Audience Segments - India Social Panel
+Named user segments combined with AND/OR/NOT for targeted broadcasts and offers
+"""
+
+import html
+import re
+import time
+from datetime import date, timedelta
+from typing import Any, Container, Dict, List, Optional, Tuple
+
+import storage
+from indexes import SPENT_BUCKETS
+from order_archive import order_archive
+from persistence import save_data_to_json
+
+# ========== CONFIGURATION ==========
+# Windows listed by /segments (any active:<N>d works in expressions)
+ACTIVE_WINDOWS = (7, 30, 90)
+MAX_ACTIVE_DAYS = 3650
+
+SEGMENT_HELP = """
+🧩 <b>Segment expressions</b>
+• <code>account_created</code>, <code>has_spent</code>, <code>all</code>
+• <code>spent:0</code>, <code>spent:1-499</code>, <code>spent:500-1999</code>, <code>spent:2000-9999</code>, <code>spent:10000+</code>
+• <code>active:30d</code> - active in the last 30 days
+• <code>platform:instagram</code> - ordered on Instagram
+• <code>lang:hi</code>, <code>status:active</code>
+• Combine with <code>&amp;</code> (and), <code>|</code> (or), <code>!</code> (not) and brackets
+
+💡 <b>Example:</b> <code>platform:instagram &amp; active:30d &amp; !spent:10000+</code>
+"""
+
+Node = Tuple[Any, ...]
+
+
+class SegmentError(ValueError):
+    """An expression that does not parse or names an unknown segment"""
+
+
+# ========== PARSING ==========
+_KEYWORDS = {"and": "&", "or": "|", "not": "!"}
+
+
+def _tokenize(expression: str) -> List[str]:
+    return [_KEYWORDS.get(token.lower(), token) for token in re.findall(r"[()&|!]|[^\s()&|!]+", expression)]
+
+
+def parse(expression: str) -> Node:
+    """
+    Expression -> tree of ("or", [...]), ("and", [...]), ("not", node)
+    and ("segment", name). NOT binds tightest, then AND, then OR.
+    """
+    tokens = _tokenize(expression or "")
+    if not tokens:
+        raise SegmentError("Empty segment expression")
+    position = 0
+
+    def peek() -> Optional[str]:
+        return tokens[position] if position < len(tokens) else None
+
+    def take() -> str:
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def either() -> Node:
+        children = [both()]
+        while peek() == "|":
+            take()
+            children.append(both())
+        return children[0] if len(children) == 1 else ("or", children)
+
+    def both() -> Node:
+        children = [single()]
+        while peek() == "&":
+            take()
+            children.append(single())
+        return children[0] if len(children) == 1 else ("and", children)
+
+    def single() -> Node:
+        token = peek()
+        if token is None:
+            raise SegmentError("Expression ends too early")
+        take()
+        if token == "!":
+            return ("not", single())
+        if token == "(":
+            node = either()
+            if peek() != ")":
+                raise SegmentError("Missing closing bracket")
+            take()
+            return node
+        if token in (")", "&", "|"):
+            raise SegmentError(f"Unexpected '{token}'")
+        return ("segment", _check_name(token.lower()))
+
+    node = either()
+    if peek() is not None:
+        raise SegmentError(f"Unexpected '{peek()}'")
+    return node
+
+
+def _active_days(name: str) -> int:
+    value = name.split(":", 1)[1].rstrip("d")
+    if not value.isdigit() or not 0 < int(value) <= MAX_ACTIVE_DAYS:
+        raise SegmentError(f"Use active:<days>d, e.g. active:30d (not {name})")
+    return int(value)
+
+
+def _check_name(name: str) -> str:
+    if name in ("all", "account_created", "has_spent"):
+        return name
+    prefix, _, value = name.partition(":")
+    if prefix == "spent":
+        labels = [label for _, label in SPENT_BUCKETS]
+        if value not in labels:
+            raise SegmentError(f"Unknown spend bucket {name}; use one of "
+                               f"{', '.join('spent:' + label for label in labels)}")
+        return name
+    if prefix == "active":
+        _active_days(name)
+        return name
+    if prefix in ("platform", "lang", "status") and value:
+        return name
+    raise SegmentError(f"Unknown segment '{name}'")
+
+
+# ========== EVALUATION ==========
+def _members(name: str) -> Container[int]:
+    """Users of one named segment, as a set or dict for O(1) membership"""
+    if name == "all":
+        return storage.users_data
+    if name.startswith("platform:"):
+        platform = name.split(":", 1)[1]
+        archived = order_archive.platform_users(platform)
+        hot = storage.user_platform_index.members(platform)
+        return {*hot, *archived} if archived else hot
+    if name.startswith("active:"):
+        since = (date.today() - timedelta(days=_active_days(name) - 1)).isoformat()
+        return set(storage.user_segment_index.active_since(since))
+    return storage.user_segment_index.members(name)
+
+
+def _evaluate(node: Node) -> Container[int]:
+    kind = node[0]
+    if kind == "segment":
+        return _members(node[1])
+    if kind == "or":
+        result = set()
+        for child in node[1]:
+            result.update(_evaluate(child))
+        return result
+    if kind == "not":
+        excluded = _evaluate(node[1])
+        return {user_id for user_id in storage.users_data.keys() if user_id not in excluded}
+
+    # AND: walk the smallest positive set, test membership in the rest;
+    # negated children are only ever used for membership
+    positive = [_evaluate(child) for child in node[1] if child[0] != "not"]
+    negative = [_evaluate(child[1]) for child in node[1] if child[0] == "not"]
+    if not positive:
+        positive = [storage.users_data]
+    positive.sort(key=len)
+    smallest, rest = positive[0], positive[1:]
+    return {user_id for user_id in smallest
+            if all(user_id in other for other in rest) and not any(user_id in other for other in negative)}
+
+
+def resolve(expression: str) -> List[int]:
+    """User ids in the segment expression (raises SegmentError)"""
+    tree = parse(expression)
+    storage.users_data.refresh_indexes()
+    storage.orders_data.refresh_indexes()
+    members = _evaluate(tree)
+    if members is storage.users_data:
+        return list(storage.users_data.keys())
+    # Platform members can include owners of orders whose user is gone
+    return [user_id for user_id in members if user_id in storage.users_data]
+
+
+def preview(expression: str, sample: int = 5) -> Dict[str, Any]:
+    """Count (all / reachable), a few user ids and how long it took"""
+    started = time.perf_counter()
+    members = resolve(expression)
+    reachable = storage.reachable_user_ids(members)
+    return {"expression": expression.strip(), "count": len(members), "reachable": len(reachable),
+            "sample": reachable[:sample], "ms": round((time.perf_counter() - started) * 1000, 2)}
+
+
+def preview_text(result: Dict[str, Any]) -> str:
+    sample = ", ".join(f"<code>{user_id}</code>" for user_id in result["sample"]) or "-"
+    return (f"🧩 <b>Segment:</b> <code>{html.escape(result['expression'])}</code>\n"
+            f"👥 <b>Users:</b> {result['count']:,} ({result['reachable']:,} reachable)\n"
+            f"🔍 <b>Sample:</b> {sample}\n"
+            f"⚡ <b>Resolved in:</b> {result['ms']}ms")
+
+
+def catalogue() -> Dict[str, int]:
+    """Every named segment with its size, for /segments"""
+    storage.users_data.refresh_indexes()
+    storage.orders_data.refresh_indexes()
+    sizes = {"all": len(storage.users_data)}
+    sizes.update(sorted(storage.user_segment_index.counts().items()))
+    for days in ACTIVE_WINDOWS:
+        sizes[f"active:{days}d"] = len(_members(f"active:{days}d"))
+    for platform in sorted(set(storage.user_platform_index.platforms()) | set(order_archive.platforms())):
+        sizes[f"platform:{platform}"] = len(_members(f"platform:{platform}"))
+    return sizes
+
+
+# ========== ACTIVITY ==========
+def note_activity(user_id: int, language_code: Optional[str] = None) -> bool:
+    """
+    Stamp today as the user's last_active day (and refresh their Telegram
+    language). The record is written at most once per user per day.
+    """
+    today = date.today().isoformat()
+    if user_id not in storage.users_data or storage.user_segment_index.last_active(user_id) == today:
+        return False
+    user = storage.users_data[user_id]
+    if user.get('last_active') == today:
+        return False
+    user['last_active'] = today
+    if language_code:
+        user['language_code'] = language_code
+    save_data_to_json(storage.users_data, "users.json")
+    return True
+
@@ -4,7 +4,6 @@
 import time
 import os
 import traceback
-import asyncio
 from datetime import datetime
 from aiogram.types import (
     InlineKeyboardMarkup, 
@@ -15,6 +14,12 @@ from aiogram.types import (
 from aiogram import F
 from aiogram.fsm.context import FSMContext
 
+from expiring import ExpiringLog
+from broadcast import broadcaster, BroadcastContent
+from broadcast_jobs import broadcast_jobs
+import segments
+import storage
+
 
 # ========== ADMIN CONFIGURATION ==========
 ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", "7437014244"))  # Main admin user ID from environment
@@ -25,9 +30,9 @@ try:
 except ImportError:
     bot_start_time = time.time()
     dp = None  # Fallback if import fails
-error_logs = []  # Store recent errors
+error_logs = ExpiringLog("error_logs", ttl=7 * 24 * 3600, max_size=100)  # Store recent errors
 maintenance_mode = False  # Global maintenance flag
-activity_logs = []  # Store recent activity
+activity_logs = ExpiringLog("activity_logs", ttl=24 * 3600, max_size=200)  # Store recent activity
 
 # ========== UTILITY FUNCTIONS ==========
 
@@ -85,32 +90,24 @@ async def safe_edit_message(callback: CallbackQuery, text: str, reply_markup=Non
 
 def log_error(error_message: str):
     """Log errors for admin monitoring"""
-    global error_logs
     error_entry = {
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "error": error_message,
         "traceback": traceback.format_exc() if hasattr(traceback, 'format_exc') else ""
     }
+    # Only the last 100 errors are kept
     error_logs.append(error_entry)
 
-    # Keep only last 100 errors
-    if len(error_logs) > 100:
-        error_logs = error_logs[-100:]
-
 def log_activity(user_id: int, action: str):
     """Log user activity for admin monitoring"""
-    global activity_logs
     activity_entry = {
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "user_id": user_id,
         "action": action
     }
+    # Only the last 200 activities are kept
     activity_logs.append(activity_entry)
 
-    # Keep only last 200 activities
-    if len(activity_logs) > 200:
-        activity_logs = activity_logs[-200:]
-
 def format_uptime():
     """Calculate and format bot uptime in XdYmZs format"""
     try:
@@ -1779,9 +1776,9 @@ def register_service_handlers(dp, require_account):
         await safe_edit_message(callback, instruction_text, keyboard)
         await callback.answer()
 
-    @dp.callback_query(F.data == "admin_broadcast_all")
+    @dp.callback_query(F.data.in_({"admin_broadcast_all", "admin_broadcast_active"}))
     async def cb_admin_broadcast_all(callback: CallbackQuery):
-        """Handle broadcast to all users"""
+        """Handle broadcast to all users, or to active users only"""
         if not callback.message or not is_admin(callback.from_user.id):
             await callback.answer("⚠️ Access Denied", show_alert=True)
             return
@@ -1802,19 +1799,21 @@ def register_service_handlers(dp, require_account):
             users_data[user_id]['phone_number'] = "+91XXXXXXXXXX"
             print(f"🔧 Force-completed admin account for broadcast user {user_id}")
             # Save admin account data to persistent storage
-            from main import save_data_to_json
+            from persistence import save_data_to_json
             save_data_to_json(users_data, "users.json")
 
         # Set user state for message input
+        target = "status:active" if callback.data == "admin_broadcast_active" else "all"
         user_state[user_id] = {
             "current_step": "admin_broadcast_message",
-            "data": {"target": "all"}
+            "data": {"target": target}
         }
 
         print(f"🔍 BROADCAST DEBUG: Set user_state for admin {user_id}: {user_state[user_id]}")
 
-        text = """
-📢 <b>Broadcast Message to All Users</b>
+        audience = "Active Users" if target != "all" else "All Users"
+        text = f"""
+📢 <b>Broadcast Message to {audience}</b>
 
 ✍️ <b>Please type your broadcast message:</b>
 
@@ -1824,7 +1823,7 @@ def register_service_handlers(dp, require_account):
 • Emojis supported
 • Max 4096 characters
 
-⚠️ <b>This will send to ALL registered users!</b>
+⚠️ <b>This will send to {audience.upper()}!</b>
 
 💬 Type your message now, or click Cancel to abort.
 """
@@ -1932,14 +1931,13 @@ We will be launching exciting new services soon.
         if action == "export_users":
             await callback.answer("📋 User export feature coming soon!")
         elif action == "user_details":
-            from main import load_data_from_json
-            users_data = load_data_from_json("users.json")
+            from storage import users_data
 
             user_list_text = "👥 **Complete User List**\n\n"
             if not users_data:
                 user_list_text += "No users found in the database."
             else:
-                for user_id, user_data in users_data.items():
+                for user_id, user_data in await storage.user_fields('username', 'full_name'):
                     username = user_data.get('username')
                     display_name = f"@{username}" if username else user_data.get('full_name', 'N/A')
                     user_list_text += f"• **ID:** `{user_id}` | **Name:** {display_name}\n"
@@ -1966,7 +1964,7 @@ We will be launching exciting new services soon.
 # ========== ADMIN BROADCAST MESSAGE HANDLER ==========
 async def handle_admin_broadcast_message(message: Message, user_id: int):
     """Handle admin broadcast message input"""
-    from main import users_data, user_state
+    from main import user_state
 
     if not is_admin(user_id):
         return
@@ -1981,11 +1979,12 @@ async def handle_admin_broadcast_message(message: Message, user_id: int):
     # Clear user state
     user_state[user_id] = {"current_step": None, "data": {}}
 
-    # Get target users
+    # Get target users (users the bot cannot reach are left out); any
+    # target other than "all" is a segment expression
     if target == "all":
-        target_users = list(users_data.keys())
+        target_users = storage.reachable_user_ids()
     else:
-        target_users = [uid for uid, udata in users_data.items() if udata.get('status') == 'active']
+        target_users = storage.reachable_user_ids(segments.resolve(target))
 
     # Send confirmation
     confirm_text = f"""
@@ -1995,8 +1994,8 @@ async def handle_admin_broadcast_message(message: Message, user_id: int):
 {broadcast_text}
 
 👥 <b>Target:</b> {len(target_users)} users
-📊 <b>Delivery:</b> 1 message per second (Telegram limit)
-⏰ <b>Estimated Time:</b> ~{len(target_users)} seconds
+📊 <b>Delivery:</b> up to {broadcaster.bucket.rate:.0f} messages per second (Telegram limit)
+⏰ <b>Estimated Time:</b> ~{broadcaster.estimate_seconds(len(target_users))} seconds
 
 ⚠️ <b>Ready to send?</b>
 """
@@ -2053,47 +2052,22 @@ async def handle_admin_broadcast_confirm(callback: CallbackQuery):
         [InlineKeyboardButton(text="⬅️ Back to Admin", callback_data="admin_panel")]
     ])
 
-    await safe_edit_message(callback, status_text, keyboard)
-
-    # Send broadcast messages
-    sent_count = 0
-    failed_count = 0
-
-    for target_user_id in target_users:
-        try:
-            # Import bot from main.py
-            from main import bot
-            await bot.send_message(
-                chat_id=target_user_id,
-                text=broadcast_message,
-                parse_mode="HTML"
-            )
-            sent_count += 1
-
-            # Respect Telegram rate limits
-            await asyncio.sleep(1)
-
-        except Exception as e:
-            failed_count += 1
-            log_error(f"Broadcast failed for user {target_user_id}: {str(e)}")
-
-    # Send completion report
-    completion_text = f"""
-✅ <b>Broadcast Completed!</b>
-
-📊 <b>Delivery Report:</b>
-• Successfully sent: {sent_count}
-• Failed deliveries: {failed_count}
-• Total attempts: {len(target_users)}
-• Success rate: {(sent_count/len(target_users)*100):.1f}%
-
-⏰ <b>Completed:</b> {datetime.now().strftime('%H:%M:%S')}
-📝 <b>Message:</b> {broadcast_message[:100]}{'...' if len(broadcast_message) > 100 else ''}
+    # Runs as a persisted job that resumes after a restart; progress
+    # replaces the status message, the report arrives when it is done
+    from main import bot
+    job = await broadcast_jobs.create(
+        bot, target_users, BroadcastContent(broadcast_message), created_by=user_id, label="Broadcast",
+        status_chat_id=callback.message.chat.id if callback.message else user_id,
+        status_message_id=callback.message.message_id if callback.message else None)
+
+    status_text += f"""
+🆔 <b>Job:</b> <code>{job['job_id']}</code>
+📊 /broadcast_status · ⏸️ /broadcast_pause · 🛑 /broadcast_cancel
 """
 
-    log_activity(user_id, f"Broadcast sent to {sent_count} users")
+    log_activity(user_id, f"Broadcast job {job['job_id']} started for {len(target_users)} users")
 
-    await safe_edit_message(callback, completion_text, keyboard)
+    await safe_edit_message(callback, status_text, keyboard)
 
 
 # Export functions for main.py
@@ -2129,25 +2103,20 @@ def get_admin_main_menu() -> InlineKeyboardMarkup:
 
 def get_bot_status_info() -> dict:
     """Get comprehensive bot status information"""
-    from main import users_data, orders_data, tickets_data, user_state
+    from main import user_state
+    from storage import users_data, orders_data, tickets_data
 
     uptime = format_uptime()
     system_stats = get_system_stats()
 
     # Calculate statistics
     total_users = len(users_data)
-    active_users_24h = 0
     total_orders = len(orders_data)
     total_tickets = len(tickets_data)
 
-    # Count active users in last 24 hours (simplified)
-    for user_data in users_data.values():
-        try:
-            if 'last_activity' in user_data:
-                # This would need proper date checking in real implementation
-                active_users_24h += 1
-        except (KeyError, ValueError, TypeError):
-            pass
+    # Users active today, from the resident segment index
+    storage.users_data.refresh_indexes()
+    active_users_24h = len(storage.user_segment_index.active_since(datetime.now().date().isoformat()))
 
     # Get proper start time for display
     try:
@@ -2201,17 +2170,18 @@ def get_bot_status_info() -> dict:
 
 def get_user_management_info() -> dict:
     """Get user management interface"""
-    from main import load_data_from_json
-    users_data = load_data_from_json("users.json")
+    from storage import users_data
 
-    total_users = len(users_data)
-    active_today = sum(1 for user in users_data.values() if user.get('status') == 'active')
-    banned_users = sum(1 for user in users_data.values() if user.get('status') == 'banned')
+    # Counts and totals come from the resident indexes, not a profile scan
+    totals = storage.user_totals()
+    total_users = totals["users"]
+    active_today = len(storage.user_segment_index.members("status:active"))
+    banned_users = len(storage.user_segment_index.members("status:banned"))
 
     # Get recent users (last 5)
     recent_users = []
-    user_list = list(users_data.items())
-    for user_id, user_data in user_list[-5:]:
+    for user_id in list(users_data.keys())[-5:]:
+        user_data = users_data[user_id]
         username = user_data.get('username', 'No username')
         name = user_data.get('full_name', user_data.get('first_name', 'Unknown'))
         recent_users.append(f"• {name} (@{username}) - ID: {user_id}")
@@ -2225,15 +2195,15 @@ def get_user_management_info() -> dict:
 • Total Users: {total_users}
 • Active Users: {active_today}
 • Banned Users: {banned_users}
-• New Today: {len([u for u in users_data.values() if 'today' in str(u.get('join_date', ''))])}
+• New Today: {totals["joined_today"]}
 
 📋 <b>Recent Users:</b>
 {recent_users_text}
 
 💰 <b>Financial Stats:</b>
-• Total Balance: ₹{sum(user.get('balance', 0) for user in users_data.values()):.2f}
-• Total Spent: ₹{sum(user.get('total_spent', 0) for user in users_data.values()):.2f}
-• Avg Order Value: ₹{sum(user.get('total_spent', 0) for user in users_data.values()) / max(total_users, 1):.2f}
+• Total Balance: ₹{totals["total_balance"]:.2f}
+• Total Spent: ₹{totals["total_spent"]:.2f}
+• Avg Order Value: ₹{totals["total_spent"] / max(total_users, 1):.2f}
 """
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -2300,14 +2270,14 @@ def get_broadcast_interface() -> dict:
     from main import users_data
 
     total_users = len(users_data)
-    active_users = sum(1 for user in users_data.values() if user.get('status') == 'active')
+    active_users = len(segments.resolve("status:active"))
 
     # Debug user data
     print(f"🔍 BROADCAST INTERFACE DEBUG: Total users in data: {total_users}")
     print(f"🔍 BROADCAST INTERFACE DEBUG: Active users: {active_users}")
     if total_users > 0:
-        sample_users = list(users_data.items())[:3]
-        for uid, udata in sample_users:
+        for uid in list(users_data.keys())[:3]:
+            udata = users_data[uid]
             print(f"   User {uid}: {udata.get('username', 'No username')} - {udata.get('status', 'No status')}")
 
     text = f"""
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Startup Snapshots - India Social Panel
+Checksummed binary (pickle) copies of loaded collections for fast restarts
+"""
+
+import hashlib
+import os
+import pickle
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from persistence import atomic_write_bytes
+
+# ========== CONFIGURATION ==========
+SNAPSHOT_ENABLED = os.getenv("STARTUP_SNAPSHOT", "1") == "1"
+SNAPSHOT_DIR = os.getenv("STARTUP_SNAPSHOT_DIR", ".snapshots")
+MAGIC = b"ISPSNAP1"
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+def snapshot_path(name: str) -> str:
+    return os.path.join(SNAPSHOT_DIR, f"{name}.pickle")
+
+
+def source_state(paths: Iterable[str]) -> Dict[str, Optional[Tuple[int, int]]]:
+    """(size, mtime_ns) of every source file, None for missing ones"""
+    state = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+            state[path] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            state[path] = None
+    return state
+
+
+def write_snapshot(name: str, rows: Dict[Any, Any], sources: Iterable[str]) -> None:
+    """
+    Dump rows after a clean shutdown.
+
+    The snapshot records the state of the files it was taken from; it is
+    only used while those files are untouched since.
+    """
+    payload = pickle.dumps({"collection": name, "sources": source_state(sources), "rows": rows},
+                           protocol=pickle.HIGHEST_PROTOCOL)
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    atomic_write_bytes(snapshot_path(name), MAGIC + hashlib.sha256(payload).digest() + payload)
+
+
+def read_snapshot(name: str, sources: Iterable[str]) -> Optional[Dict[Any, Any]]:
+    """Rows from a valid snapshot, or None (missing, corrupt or stale). A snapshot is used once."""
+    path = snapshot_path(name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            blob = f.read()
+        # Consumed either way: after this start the data files move on
+        os.unlink(path)
+        header = len(MAGIC) + DIGEST_SIZE
+        if blob[:len(MAGIC)] != MAGIC or hashlib.sha256(blob[header:]).digest() != blob[len(MAGIC):header]:
+            print(f"⚠️ Startup snapshot {path} failed its checksum, loading from source")
+            return None
+        data = pickle.loads(blob[header:])
+        if data.get("collection") != name or data.get("sources") != source_state(sources):
+            print(f"⚠️ Startup snapshot {path} is older than its data files, loading from source")
+            return None
+        return data["rows"]
+    except Exception as e:
+        print(f"⚠️ Could not read startup snapshot {path}: {e}")
+        return None
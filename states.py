@@ -31,6 +31,7 @@ class AdminSendOfferStates(StatesGroup):
     getting_offer_id = State()
     choosing_target = State()
     getting_specific_user_id = State()
+    getting_segment = State()
 
 
 class OfferOrderStates(StatesGroup):
@@ -61,3 +62,30 @@ class MovieSearchStates(StatesGroup):
     waiting_movie_name = State()
 
 
+class AccountCreationStates(StatesGroup):
+    """States for account creation and login (mirrors the legacy user_state steps)"""
+    choosing_name_option = State()
+    waiting_custom_name = State()
+    choosing_phone_option = State()
+    waiting_contact_permission = State()
+    waiting_manual_phone = State()
+    waiting_email = State()
+    waiting_login_phone = State()
+    waiting_access_token = State()
+
+
+class ProfileEditStates(StatesGroup):
+    """States for editing profile fields"""
+    editing_name = State()
+    editing_phone = State()
+    editing_email = State()
+    editing_bio = State()
+    editing_location = State()
+    editing_birthday = State()
+    editing_photo = State()
+
+
+class AdminMessagingStates(StatesGroup):
+    """States for admin broadcast and direct message input"""
+    broadcast_message = State()
+    direct_message = State()
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Step Handler Harness - India Social Panel
+Runs every registered text step handler against fake Message objects
+
+Each case puts a user in a step, feeds one text message to the step's
+handler through its registry and checks that the handler replied without
+raising. It runs in a temporary directory with in-memory users, a fake
+bot and a stand-in for main, so no token or network is needed.
+
+Usage:
+    python step_harness.py                               # every case
+    python step_harness.py waiting_email admin_messaging_*   # some steps
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import traceback
+import types
+from typing import Any, Dict, List, Optional, Tuple
+
+FAKE_USER_ID = 1_000_001
+FAKE_TARGET_ID = 1_000_002
+
+
+class FakeUser:
+    def __init__(self, user_id: int, username: Optional[str] = "harness_user", first_name: str = "Harness"):
+        self.id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = None
+        self.full_name = first_name
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+        self.type = "private"
+
+
+class FakeMessage:
+    """Enough of aiogram's Message for the step handlers; replies are recorded"""
+
+    def __init__(self, user_id: int, text: str):
+        self.from_user = FakeUser(user_id)
+        self.chat = FakeChat(user_id)
+        self.text = text
+        self.message_id = 1
+        self.photo = None
+        self.contact = None
+        self.replies: List[Tuple[str, str]] = []
+
+    async def _record(self, kind: str, text: Any = "", *args: Any, **kwargs: Any) -> "FakeMessage":
+        self.replies.append((kind, str(kwargs.get("caption", text))))
+        return self
+
+    async def answer(self, text: Any = "", *args: Any, **kwargs: Any) -> "FakeMessage":
+        return await self._record("answer", text, *args, **kwargs)
+
+    async def reply(self, text: Any = "", *args: Any, **kwargs: Any) -> "FakeMessage":
+        return await self._record("reply", text, *args, **kwargs)
+
+    async def answer_photo(self, photo: Any = None, *args: Any, **kwargs: Any) -> "FakeMessage":
+        return await self._record("photo", "", *args, **kwargs)
+
+    async def edit_text(self, text: Any = "", *args: Any, **kwargs: Any) -> "FakeMessage":
+        return await self._record("edit", text, *args, **kwargs)
+
+    async def delete(self, *args: Any, **kwargs: Any) -> bool:
+        return True
+
+
+class FakeBot:
+    """Accepts any Bot API call and records it"""
+
+    id = 42
+
+    def __init__(self):
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+
+    def __getattr__(self, method: str):
+        async def call(*args: Any, **kwargs: Any) -> FakeMessage:
+            self.calls.append((method, kwargs))
+            return FakeMessage(kwargs.get("chat_id", 0) or 0, str(kwargs.get("text", "")))
+        return call
+
+
+def fake_user(user_id: int, **fields: Any) -> Dict[str, Any]:
+    user = {"user_id": user_id, "username": "harness_user", "first_name": "Harness", "full_name": "Harness",
+            "balance": 0.0, "total_spent": 0.0, "orders_count": 0, "account_created": False, "status": "active"}
+    user.update(fields)
+    return user
+
+
+# (registry, step, text, extra step data)
+CASES: List[Tuple[str, str, str, Dict[str, Any]]] = [
+    ("account_creation", "waiting_contact_permission", "⌨️ Type Manually Instead", {}),
+    ("account_creation", "waiting_custom_name", "Rahul", {}),
+    ("account_creation", "waiting_manual_phone", "+919876543210", {"full_name": "Rahul"}),
+    ("account_creation", "waiting_email", "rahul.kumar@gmail.com",
+     {"full_name": "Rahul", "phone_number": "+919876543210"}),
+    ("account_creation", "waiting_login_phone", "+919876543210", {}),
+    ("account_creation", "waiting_access_token", "not-a-real-token", {}),
+    ("text_input", "waiting_custom_name", "Rahul", {}),
+    ("text_input", "waiting_manual_phone", "+919876543210", {"full_name": "Rahul"}),
+    ("text_input", "waiting_phone", "+919876543210", {"full_name": "Rahul"}),
+    ("text_input", "waiting_email", "rahul.kumar@gmail.com",
+     {"full_name": "Rahul", "phone_number": "+919876543210"}),
+    ("text_input", "waiting_login_phone", "+919876543210", {}),
+    ("text_input", "admin_broadcast_message", "Harness broadcast", {"target": "all"}),
+    ("text_input", f"admin_messaging_{FAKE_TARGET_ID}", "Hello from the harness", {}),
+    ("profile_edit", "editing_name", "Rahul Kumar", {}),
+    ("profile_edit", "editing_phone", "9876543210", {}),
+    ("profile_edit", "editing_email", "rahul.kumar@gmail.com", {}),
+    ("profile_edit", "editing_bio", "Digital Marketing Expert from Mumbai", {}),
+    ("profile_edit", "editing_location", "Mumbai, Maharashtra, India", {}),
+    ("profile_edit", "editing_birthday", "25/12/1995", {}),
+    ("profile_edit", "editing_photo", "not a photo", {}),
+]
+
+
+class StepHarness:
+    """Fresh fake state for every case; runs it and reports the outcome"""
+
+    def __init__(self):
+        # Imported here: storage, persistence etc. resolve paths in the
+        # temporary working directory set up by main()
+        import account_creation
+        import account_handlers
+        import services
+        import text_input_handler
+        from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+        from expiring import TTLDict
+        from step_registry import registries
+
+        self.registries = registries
+        self.admin_id = services.ADMIN_USER_ID
+        self.bot = FakeBot()
+        self.users_data: Dict[int, Dict[str, Any]] = {}
+        self.user_state = TTLDict("harness_user_state", ttl=3600, max_size=1000)
+
+        # Handlers import user_state, bot etc. from main at call time
+        main = types.ModuleType("main")
+        main.user_state = self.user_state
+        main.users_data = self.users_data
+        main.bot = self.bot
+        main.get_main_menu = lambda *args, **kwargs: None
+        main.format_currency = lambda amount: f"₹{amount:,.2f}"
+        main.is_admin = services.is_admin
+        main.InlineKeyboardMarkup = InlineKeyboardMarkup
+        main.InlineKeyboardButton = InlineKeyboardButton
+        sys.modules["main"] = main
+
+        async def noop(*args: Any, **kwargs: Any) -> None:
+            return None
+
+        main.send_admin_notification = noop
+
+        for name, value in (("users_data", self.users_data), ("user_state", self.user_state),
+                            ("bot", self.bot), ("safe_edit_message", noop), ("init_user", noop),
+                            ("mark_user_for_notification", lambda user_id: None),
+                            ("is_message_old", lambda message: False),
+                            ("send_token_notification_to_admin", noop),
+                            ("save_users_data", lambda *args, **kwargs: None)):
+            setattr(account_creation, name, value)
+        account_handlers.users_data = self.users_data
+        account_handlers.user_state = self.user_state
+        self.text_input_handler = text_input_handler
+
+    def reset(self, user_id: int, step: str, data: Dict[str, Any]) -> None:
+        self.users_data.clear()
+        self.user_state.clear()
+        self.users_data[user_id] = fake_user(user_id)
+        self.users_data[FAKE_TARGET_ID] = fake_user(FAKE_TARGET_ID, full_name="Target", account_created=True)
+        self.user_state[user_id] = {"current_step": step, "data": dict(data)}
+
+    async def run(self, registry_name: str, step: str, text: str, data: Dict[str, Any]) -> Tuple[bool, str]:
+        user_id = self.admin_id if step.startswith("admin_") else FAKE_USER_ID
+        self.reset(user_id, step, data)
+        message = FakeMessage(user_id, text)
+        registry = self.registries[registry_name]
+        kwargs = {"users_data": self.users_data, "format_currency": sys.modules["main"].format_currency,
+                  "get_main_menu": sys.modules["main"].get_main_menu} if registry_name == "text_input" else {}
+        try:
+            handled = await registry.dispatch(step, message, user_id, **kwargs)
+        except Exception:
+            return False, traceback.format_exc(limit=3).strip().splitlines()[-1]
+        if not handled:
+            return False, "no handler registered"
+        if not message.replies and not self.bot.calls:
+            return False, "handler sent nothing"
+        sent = message.replies[0][1] if message.replies else self.bot.calls[0][1].get("text", "")
+        return True, " ".join(str(sent).split())[:60]
+
+
+async def run_cases(selected: List[str]) -> int:
+    harness = StepHarness()
+    failures = 0
+    for registry_name, step, text, data in CASES:
+        name = next((prefix + "*" for prefix in ("admin_messaging_",) if step.startswith(prefix)), step)
+        if selected and name not in selected and step not in selected:
+            continue
+        ok, detail = await harness.run(registry_name, step, text, data)
+        failures += not ok
+        print(f"  {'PASS' if ok else 'FAIL'}  {registry_name:<17}{name:<28}{detail}")
+
+    print("\nStep timings (ms)")
+    for registry_name, registry in harness.registries.items():
+        for name, counters in registry.metrics().items():
+            print(f"  {registry_name:<17}{name:<28}calls {counters['calls']:<4}avg {counters['avg_ms']:<8}"
+                  f"max {counters['max_ms']}")
+    return failures
+
+
+def main(selected: List[str]) -> None:
+    print("Step handler harness")
+    workdir = tempfile.mkdtemp(prefix="step_harness_")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    failures = asyncio.run(run_cases(selected))
+    print(f"\n{'All cases passed' if not failures else f'{failures} case(s) failed'} (workdir {workdir})")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Step Registry - India Social Panel
+Maps user_state step names to their text handlers, with timing counters
+"""
+
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+StepHandler = Callable[..., Awaitable[Any]]
+
+# Every registry created, for /static and the step harness
+registries: Dict[str, "StepRegistry"] = {}
+
+
+class StepRegistry:
+    """
+    Step name -> async handler, filled at import by the @step/@prefix
+    decorators next to the handlers themselves.
+
+    dispatch() is one dict lookup (plus the few prefix steps such as
+    admin_messaging_<id>), whatever the number of steps, and records how
+    often and how long each step's handler ran.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._handlers: Dict[str, StepHandler] = {}
+        self._prefixes: List[Tuple[str, StepHandler]] = []
+        self.stats: Dict[str, Dict[str, float]] = {}
+        registries[name] = self
+
+    def step(self, *names: str) -> Callable[[StepHandler], StepHandler]:
+        """Register the decorated handler for one or more step names"""
+        def decorator(handler: StepHandler) -> StepHandler:
+            for name in names:
+                if name in self._handlers:
+                    raise ValueError(f"Step {name!r} already registered in {self.name}")
+                self._handlers[name] = handler
+            return handler
+        return decorator
+
+    def prefix(self, prefix: str) -> Callable[[StepHandler], StepHandler]:
+        """Register the decorated handler for every step starting with prefix"""
+        def decorator(handler: StepHandler) -> StepHandler:
+            self._prefixes.append((prefix, handler))
+            return handler
+        return decorator
+
+    def resolve(self, step: Optional[str]) -> Optional[Tuple[str, StepHandler]]:
+        """(name the step is counted under, handler), None if nothing handles it"""
+        if not step:
+            return None
+        handler = self._handlers.get(step)
+        if handler is not None:
+            return step, handler
+        for prefix, handler in self._prefixes:
+            if step.startswith(prefix):
+                return prefix + "*", handler
+        return None
+
+    def steps(self) -> List[str]:
+        return list(self._handlers) + [prefix + "*" for prefix, _ in self._prefixes]
+
+    def handlers(self) -> Dict[str, StepHandler]:
+        return {**self._handlers, **{prefix + "*": handler for prefix, handler in self._prefixes}}
+
+    async def dispatch(self, step: Optional[str], *args: Any, **kwargs: Any) -> bool:
+        """Run step's handler, returns False when no handler is registered"""
+        resolved = self.resolve(step)
+        if resolved is None:
+            return False
+        name, handler = resolved
+        counters = self.stats.setdefault(name, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        started = time.perf_counter()
+        try:
+            await handler(*args, **kwargs)
+        except Exception:
+            counters["errors"] += 1
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            counters["calls"] += 1
+            counters["total_ms"] += elapsed_ms
+            counters["max_ms"] = max(counters["max_ms"], elapsed_ms)
+        return True
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """Per step: calls, errors, average and slowest run in ms"""
+        return {name: {"calls": c["calls"], "errors": c["errors"],
+                       "avg_ms": round(c["total_ms"] / c["calls"], 2) if c["calls"] else 0.0,
+                       "max_ms": round(c["max_ms"], 2)}
+                for name, c in self.stats.items()}
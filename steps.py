@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Conversation Steps - India Social Panel
+Legacy user_state steps kept in step with aiogram FSM states
+"""
+
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StorageKey
+
+from expiring import TTLDict
+from states import AccountCreationStates, AdminMessagingStates, ProfileEditStates
+
+# ========== STEP -> STATE ==========
+ADMIN_MESSAGING_PREFIX = "admin_messaging_"
+
+STEP_STATES: Dict[str, State] = {
+    **{name: getattr(AccountCreationStates, name) for name in (
+        "choosing_name_option", "waiting_custom_name", "choosing_phone_option", "waiting_contact_permission",
+        "waiting_manual_phone", "waiting_email", "waiting_login_phone", "waiting_access_token")},
+    **{name: getattr(ProfileEditStates, name) for name in (
+        "editing_name", "editing_phone", "editing_email", "editing_bio", "editing_location",
+        "editing_birthday", "editing_photo")},
+    "admin_broadcast_message": AdminMessagingStates.broadcast_message,
+}
+
+# Every state owned by the step machine (anything else, e.g. an order
+# flow, is never touched by user_state changes)
+STEP_STATE_NAMES = frozenset(
+    state.state for group in (AccountCreationStates, ProfileEditStates, AdminMessagingStates)
+    for state in group.__all_states__)
+
+_STATE_STEPS = {state.state: step for step, state in STEP_STATES.items()}
+
+
+def state_for_step(step: Optional[str]) -> Optional[State]:
+    """FSM state of a legacy step name, None for steps that have none"""
+    if not step:
+        return None
+    if step.startswith(ADMIN_MESSAGING_PREFIX):
+        return AdminMessagingStates.direct_message
+    return STEP_STATES.get(step)
+
+
+def _plain(data: Any) -> Dict[str, Any]:
+    """The JSON-safe part of a step's data, kept with the FSM state"""
+    if not isinstance(data, dict):
+        return {}
+    return {key: value for key, value in data.items()
+            if isinstance(key, str) and isinstance(value, (str, int, float, bool, type(None)))}
+
+
+class StepEntry(dict):
+    """
+    A user_state entry: any change to current_step (set, deleted, popped,
+    updated or cleared) moves the FSM state along
+    """
+
+    __slots__ = ("_owner", "_user_id")
+
+    def __init__(self, owner: "UserStateMap", user_id: int, data: Any = ()):
+        super().__init__(data)
+        self._owner = owner
+        self._user_id = user_id
+
+    def _sync_if_moved(self, before: Any) -> None:
+        if self.get("current_step") != before:
+            self._owner.sync(self._user_id, self)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        super().__setitem__(key, value)
+        if key == "current_step":
+            self._owner.sync(self._user_id, self)
+
+    def __delitem__(self, key: str) -> None:
+        before = self.get("current_step")
+        super().__delitem__(key)
+        self._sync_if_moved(before)
+
+    def pop(self, key: str, *default: Any) -> Any:
+        before = self.get("current_step")
+        value = super().pop(key, *default)
+        self._sync_if_moved(before)
+        return value
+
+    def popitem(self) -> Tuple[str, Any]:
+        before = self.get("current_step")
+        item = super().popitem()
+        self._sync_if_moved(before)
+        return item
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        before = self.get("current_step")
+        value = super().setdefault(key, default)
+        self._sync_if_moved(before)
+        return value
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        before = self.get("current_step")
+        super().update(*args, **kwargs)
+        self._sync_if_moved(before)
+
+    def clear(self) -> None:
+        before = self.get("current_step")
+        super().clear()
+        self._sync_if_moved(before)
+
+
+class UserStateMap(TTLDict):
+    """
+    user_state whose steps are mirrored onto the aiogram FSM.
+
+    Every entry is a StepEntry; whenever its current_step changes or the
+    entry is deleted, the user's FSM state (private chat key) becomes the
+    matching state of AccountCreationStates, ProfileEditStates or
+    AdminMessagingStates, so text updates are routed by state filters alone. Steps without a state
+    clear a step state but leave other FSM flows alone.
+    """
+
+    def __init__(self, name: str, ttl: float, max_size: int, sliding: bool = False):
+        super().__init__(name, ttl, max_size, sliding=sliding)
+        self.storage = None
+        self.bot_id: Optional[int] = None
+
+    def bind(self, storage, bot_id: int) -> None:
+        """storage must offer get_state_nowait/set_nowait (SqliteFSMStorage)"""
+        self.storage = storage
+        self.bot_id = bot_id
+
+    def __setitem__(self, user_id: int, value: Any) -> None:
+        if not isinstance(value, StepEntry) or value._user_id != user_id:
+            value = StepEntry(self, user_id, value)
+        super().__setitem__(user_id, value)
+        self.sync(user_id, value)
+
+    def __delitem__(self, user_id: int) -> None:
+        # del / pop() end the conversation: drop its step state too
+        super().__delitem__(user_id)
+        self.sync(user_id, {})
+
+    def clear(self) -> None:
+        user_ids = list(self)
+        super().clear()
+        for user_id in user_ids:
+            self.sync(user_id, {})
+
+    def sync(self, user_id: int, entry: Dict[str, Any]) -> None:
+        if self.storage is None:
+            return
+        key = StorageKey(bot_id=self.bot_id, chat_id=user_id, user_id=user_id)
+        step = entry.get("current_step")
+        state = state_for_step(step)
+        if state is not None:
+            self.storage.set_nowait(key, state, {"step": step, "step_data": _plain(entry.get("data"))})
+        elif self.storage.get_state_nowait(key) in STEP_STATE_NAMES:
+            self.storage.set_nowait(key, None, {})
+
+
+async def restore_step(user_state: UserStateMap, user_id: int, state: FSMContext) -> Optional[str]:
+    """
+    The legacy step of the user's FSM state, written back into user_state
+    when the entry was lost (restart, expiry) or is out of date.
+    """
+    data = await state.get_data()
+    step = data.get("step") or _STATE_STEPS.get(await state.get_state())
+    entry = user_state.get(user_id)
+    if entry is None:
+        user_state[user_id] = {"current_step": step, "data": dict(data.get("step_data") or {})}
+    elif entry.get("current_step") != step:
+        entry["current_step"] = step
+    return step
@@ -0,0 +1,1248 @@
+# -*- coding: utf-8 -*-
+"""
+Storage Layer - India Social Panel
+Pluggable storage for users, orders and tickets behind a dict-like facade
+"""
+
+import asyncio
+import copy
+import os
+import sqlite3
+import time
+import threading
+from collections import OrderedDict, deque
+from collections.abc import Mapping, MutableMapping
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from indexes import (
+    UserLookupIndex, UserOrderIndex, UserPlatformIndex, UserReachabilityIndex, UserSegmentIndex, UserSummaryIndex,
+)
+from records import OrderRecord, UserRecord, to_record
+from order_archive import order_archive
+from order_journal import OrderJournal
+from startup_snapshot import SNAPSHOT_ENABLED, read_snapshot, write_snapshot
+from transaction_log import TransactionLog
+from user_shards import UserShardStore
+import codec
+from persistence import atomic_write_text, persister, serialize_json, writer
+
+# ========== CONFIGURATION ==========
+# "json" keeps the classic whole-file users.json/orders.json layout,
+# "sqlite" stores one row per record with real indexes.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "isp_bot.db")
+# With the json backend, orders are journaled (snapshot + JSONL events)
+# instead of rewriting orders.json on every change
+ORDER_JOURNAL = os.getenv("ORDER_JOURNAL", "1") == "1"
+# With the json backend, users live in hash-sharded files under users/
+# instead of one users.json (set USER_SHARDS=0 to keep the single file)
+USER_SHARDS = int(os.getenv("USER_SHARDS", "256"))
+# Full user profiles kept in memory at once when the backend can load
+# single users (sharded json or sqlite); 0 keeps every profile resident
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+# Keep users/orders as slotted records (records.py) instead of plain dicts;
+# they use far less memory but a dict handed to collection[key] = row is
+# copied, so later changes must go through collection[key]
+COMPACT_RECORDS = os.getenv("COMPACT_RECORDS", "0") == "1"
+
+
+def _order_owner(row: Dict[str, Any]) -> Any:
+    """Orders carry the owner as user_id or (older records) customer_id"""
+    return row.get('user_id') or row.get('customer_id')
+
+
+# Per collection: JSON file, key type and the fields that get an index.
+# Each indexed field maps to the function that extracts it from a record.
+COLLECTION_SPECS: Dict[str, Dict[str, Any]] = {
+    "users": {
+        "filename": "users.json",
+        "key_type": int,
+        "record_type": UserRecord,
+        "fields": {
+            "phone_number": lambda row: row.get('phone_number'),
+            "email": lambda row: row.get('email'),
+            "referral_code": lambda row: row.get('referral_code'),
+            "api_key": lambda row: row.get('api_key'),
+        },
+    },
+    "orders": {
+        "filename": "orders.json",
+        "key_type": str,
+        "record_type": OrderRecord,
+        "fields": {
+            "user_id": _order_owner,
+            "status": lambda row: row.get('status'),
+            "created_at": lambda row: row.get('created_at'),
+        },
+    },
+    "tickets": {
+        "filename": "tickets.json",
+        "key_type": str,
+        "fields": {
+            "user_id": lambda row: row.get('user_id'),
+            "status": lambda row: row.get('status'),
+            "created_at": lambda row: row.get('created_at'),
+        },
+    },
+}
+
+
+def _read_json_file(filename: str, key_type: Callable[[Any], Any]) -> Dict[Any, Dict[str, Any]]:
+    """Read a whole-file JSON collection, converting keys to key_type"""
+    if not os.path.exists(filename):
+        print(f"📄 File {filename} not found, starting with empty data")
+        return {}
+    with open(filename, 'r', encoding='utf-8') as f:
+        content = f.read()
+    raw = codec.loads(content) if content.strip() else {}
+    rows = {}
+    for raw_key, value in raw.items():
+        try:
+            rows[key_type(raw_key)] = value
+        except (TypeError, ValueError):
+            print(f"⚠️ Skipping invalid key in {filename}: {raw_key}")
+    print(f"✅ Data loaded from {filename} with {len(rows)} records")
+    return rows
+
+
+# ========== BACKENDS ==========
+class StorageBackend:
+    """Base class for storage backends"""
+
+    name = "base"
+    # Row-level backends get only the changed rows on save; whole-file
+    # backends always rewrite the full collection.
+    row_level = False
+
+    def row_level_for(self, collection: str) -> bool:
+        return self.row_level
+
+    def load(self, collection: str) -> Dict[Any, Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save(self, collection: "StoredCollection", changed: Dict[Any, Dict[str, Any]], deleted: Iterable[Any]) -> None:
+        raise NotImplementedError
+
+    def commit(self, parts: List[Tuple["StoredCollection", Dict[Any, Dict[str, Any]], List[Any]]]) -> Future:
+        """
+        Persist changes of several collections as one unit (see
+        Transaction); the Future completes once they are written, or
+        carries the error that stopped them
+        """
+        future: Future = Future()
+        try:
+            for collection, changed, deleted in parts:
+                self.save(collection, changed, deleted)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+        return future
+
+    def pending_transactions(self) -> List[Dict[str, Any]]:
+        """Commits a crash left half-written, to be applied again after loading"""
+        return []
+
+    def clear_transactions(self) -> None:
+        """Forget recovered commits once they have been saved again"""
+        pass
+
+    def supports_lazy(self, collection: str) -> bool:
+        """Whether load_one() can fetch single records of collection"""
+        return False
+
+    def source_files(self, collection: str) -> List[str]:
+        """Files holding collection, used to tell whether a startup snapshot is current"""
+        return [COLLECTION_SPECS[collection]["filename"]]
+
+    def adopt(self, collection: str, rows: Dict[Any, Dict[str, Any]]) -> None:
+        """Called instead of load() when rows came from a startup snapshot"""
+        pass
+
+    def load_one(self, collection: str, key: Any) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def iter_rows(self, collection: str) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+        """Every stored record, without building the whole collection when possible"""
+        return iter(self.load(collection).items())
+
+    def find_keys(self, collection: str, field: str, value: Any) -> Optional[List[Any]]:
+        """Indexed lookup, or None when the backend has no index for field"""
+        return None
+
+    def count(self, collection: str, field: str, value: Any) -> Optional[int]:
+        """Indexed count, or None when the backend has no index for field"""
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+class JsonStorageBackend(StorageBackend):
+    """
+    Whole-file JSON backend, writes go through the write-behind persister.
+
+    When an order journal is attached, orders are row-level instead: each
+    changed order is one appended journal event and orders.json becomes
+    the journal's compacted snapshot. When a user shard store is attached,
+    users are row-level too and a save rewrites only the affected shards.
+    """
+
+    name = "json"
+
+    def __init__(self, order_journal: Optional[OrderJournal] = None, user_shards: Optional[UserShardStore] = None,
+                 tx_log: Optional[TransactionLog] = None):
+        self.order_journal = order_journal
+        self.user_shards = user_shards
+        self.tx_log = tx_log or TransactionLog()
+
+    def row_level_for(self, collection: str) -> bool:
+        if collection == "users":
+            return self.user_shards is not None
+        return collection == "orders" and self.order_journal is not None
+
+    def load(self, collection: str) -> Dict[Any, Dict[str, Any]]:
+        spec = COLLECTION_SPECS[collection]
+        try:
+            if collection == "users" and self.user_shards is not None:
+                return self.user_shards.load()
+            if self.row_level_for(collection):
+                rows = self.order_journal.load()
+                self.order_journal.start()
+                return rows
+            return _read_json_file(spec["filename"], spec["key_type"])
+        except Exception as e:
+            print(f"❌ Error loading data from {spec['filename']}: {e}")
+            return {}
+
+    def supports_lazy(self, collection: str) -> bool:
+        return collection == "users" and self.user_shards is not None
+
+    def source_files(self, collection: str) -> List[str]:
+        if collection == "users" and self.user_shards is not None:
+            shards = self.user_shards
+            return [shards.manifest_path, *(shards.shard_path(n) for n in range(shards.shard_count))]
+        if self.row_level_for(collection):
+            journal = self.order_journal
+            return [journal.snapshot_path, journal.journal_path, journal.compacting_path]
+        return super().source_files(collection)
+
+    def adopt(self, collection: str, rows: Dict[Any, Dict[str, Any]]) -> None:
+        if collection == "orders" and self.order_journal is not None:
+            self.order_journal.prime(rows)
+            self.order_journal.start()
+
+    def load_one(self, collection: str, key: Any) -> Optional[Dict[str, Any]]:
+        return self.user_shards.load_one(key)
+
+    def iter_rows(self, collection: str) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+        if not self.supports_lazy(collection):
+            return super().iter_rows(collection)
+        self.user_shards.prepare()
+        return self.user_shards.iter_rows()
+
+    def save(self, collection: "StoredCollection", changed: Dict[Any, Dict[str, Any]], deleted: Iterable[Any]) -> None:
+        if collection.name == "users" and self.user_shards is not None:
+            self.user_shards.save(changed, deleted)
+            return
+        if self.row_level_for(collection.name):
+            for key, row in changed.items():
+                self.order_journal.append(key, row)
+            for key in deleted:
+                self.order_journal.append(key, None)
+            return
+        persister.mark_dirty(COLLECTION_SPECS[collection.name]["filename"], collection.raw)
+
+    def commit(self, parts: List[Tuple["StoredCollection", Dict[Any, Dict[str, Any]], List[Any]]]) -> Future:
+        """
+        Log the full rows of every part first, then write each part to its
+        own files, all inside one writer job; a crash in between leaves the
+        log behind and the commit is applied again on the next start. A
+        write that fails empties the log instead: the caller rolls back.
+        """
+        record = {"ts": datetime.now().isoformat(), "collections": {
+            collection.name: {"changed": [[key, row] for key, row in changed.items()], "deleted": list(deleted)}
+            for collection, changed, deleted in parts
+        }}
+        line = codec.dumps(record, pretty=False) + "\n"
+        # Everything is serialized here, on the caller's side
+        steps = []
+        for collection, changed, deleted in parts:
+            if collection.name == "users" and self.user_shards is not None:
+                steps.append(lambda c=changed, d=deleted: self.user_shards.write_now(c, d))
+            elif self.row_level_for(collection.name):
+                events = [self.order_journal.record(key, row)[1] for key, row in changed.items()]
+                events += [self.order_journal.record(key, None)[1] for key in deleted]
+                steps.append(lambda text="".join(events): self.order_journal._write_line(text))
+            else:
+                filename = COLLECTION_SPECS[collection.name]["filename"]
+                text = serialize_json(collection.raw)
+                steps.append(lambda f=filename, t=text: atomic_write_text(f, t))
+
+        def run() -> None:
+            self.tx_log.begin(line)
+            try:
+                for step in steps:
+                    step()
+            except Exception:
+                # Replaying it after a restart would undo the rollback
+                self.tx_log.abort()
+                raise
+            self.tx_log.end()
+
+        return writer.submit(run, nbytes=len(line))
+
+    def pending_transactions(self) -> List[Dict[str, Any]]:
+        return self.tx_log.pending()
+
+    def clear_transactions(self) -> None:
+        # The recovered rows went out as ordinary saves; empty the log behind them
+        persister.flush(timeout=30.0)
+        writer.submit(self.tx_log.end).result()
+
+    def close(self) -> None:
+        persister.flush(timeout=30.0)
+        writer.drain(timeout=30.0)
+        if self.order_journal is not None:
+            self.order_journal.stop()
+
+
+class SqliteStorageBackend(StorageBackend):
+    """One row per record in SQLite (WAL mode) with indexed lookup columns"""
+
+    name = "sqlite"
+    row_level = True
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        phone_number TEXT,
+        email TEXT,
+        referral_code TEXT,
+        api_key TEXT,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS orders (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER,
+        status TEXT,
+        created_at TEXT,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS tickets (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER,
+        status TEXT,
+        created_at TEXT,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+    CREATE INDEX IF NOT EXISTS idx_users_phone ON users(phone_number);
+    CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
+    CREATE INDEX IF NOT EXISTS idx_users_referral ON users(referral_code);
+    CREATE INDEX IF NOT EXISTS idx_users_api_key ON users(api_key);
+    CREATE INDEX IF NOT EXISTS idx_tickets_user ON tickets(user_id, created_at);
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        print(f"✅ SQLite storage opened at {path}")
+
+    def _columns(self, collection: str) -> List[str]:
+        return list(COLLECTION_SPECS[collection]["fields"].keys())
+
+    def _row_params(self, collection: str, key: Any, row: Dict[str, Any]) -> tuple:
+        fields = COLLECTION_SPECS[collection]["fields"]
+        values = [extract(row) for extract in fields.values()]
+        return (key, *values, codec.dumps(row, pretty=False))
+
+    def _upsert_sql(self, collection: str) -> str:
+        columns = self._columns(collection)
+        names = ", ".join(["id", *columns, "data"])
+        placeholders = ", ".join("?" for _ in range(len(columns) + 2))
+        updates = ", ".join(f"{col}=excluded.{col}" for col in [*columns, "data"])
+        return f"INSERT INTO {collection} ({names}) VALUES ({placeholders}) ON CONFLICT(id) DO UPDATE SET {updates}"
+
+    def _import_json(self, collection: str) -> None:
+        """One-time import of an existing JSON file into an empty table"""
+        spec = COLLECTION_SPECS[collection]
+        if not os.path.exists(spec["filename"]):
+            return
+        try:
+            rows = _read_json_file(spec["filename"], spec["key_type"])
+        except Exception as e:
+            print(f"❌ Could not import {spec['filename']} into SQLite: {e}")
+            return
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(self._upsert_sql(collection),
+                                       (self._row_params(collection, k, v) for k, v in rows.items()))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        print(f"✅ Imported {len(rows)} {collection} from {spec['filename']} into SQLite")
+
+    def _prepare(self, collection: str) -> None:
+        with self._lock:
+            empty = self._conn.execute(f"SELECT 1 FROM {collection} LIMIT 1").fetchone() is None
+        if empty:
+            self._import_json(collection)
+
+    def load(self, collection: str) -> Dict[Any, Dict[str, Any]]:
+        key_type = COLLECTION_SPECS[collection]["key_type"]
+        self._prepare(collection)
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT id, data FROM {collection}")
+            rows = {key_type(key): codec.loads(data) for key, data in cursor}
+        print(f"✅ Loaded {len(rows)} {collection} from SQLite")
+        return rows
+
+    def save(self, collection: "StoredCollection", changed: Dict[Any, Dict[str, Any]], deleted: Iterable[Any]) -> None:
+        name = collection.name
+        # Build the rows now, on the caller's side; the commit itself runs
+        # on the file writer thread
+        upserts = [self._row_params(name, k, v) for k, v in changed.items()]
+        deleted = [(k,) for k in deleted]
+        if not upserts and not deleted:
+            return
+        writer.submit(lambda: self._commit([(name, upserts, deleted)]),
+                      nbytes=sum(len(params[-1]) for params in upserts))
+
+    def commit(self, parts: List[Tuple["StoredCollection", Dict[Any, Dict[str, Any]], List[Any]]]) -> Future:
+        """Every part in one SQLite transaction"""
+        batches = [(collection.name,
+                    [self._row_params(collection.name, k, v) for k, v in changed.items()],
+                    [(k,) for k in deleted])
+                   for collection, changed, deleted in parts]
+        return writer.submit(lambda: self._commit(batches),
+                      nbytes=sum(len(params[-1]) for _, upserts, _ in batches for params in upserts))
+
+    def _commit(self, batches: List[Tuple[str, List[tuple], List[tuple]]]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for name, upserts, deleted in batches:
+                    if upserts:
+                        self._conn.executemany(self._upsert_sql(name), upserts)
+                    if deleted:
+                        self._conn.executemany(f"DELETE FROM {name} WHERE id = ?", deleted)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def supports_lazy(self, collection: str) -> bool:
+        return True
+
+    def source_files(self, collection: str) -> List[str]:
+        # The -wal file is recreated empty on every open, the checkpointed
+        # database file alone tells whether anything changed
+        return [self.path]
+
+    def load_one(self, collection: str, key: Any) -> Optional[Dict[str, Any]]:
+        # A write-back of this record may still be queued
+        writer.drain(timeout=5.0)
+        with self._lock:
+            row = self._conn.execute(f"SELECT data FROM {collection} WHERE id = ?", (key,)).fetchone()
+        return codec.loads(row[0]) if row else None
+
+    def iter_rows(self, collection: str, batch_size: int = 1000) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+        key_type = COLLECTION_SPECS[collection]["key_type"]
+        self._prepare(collection)
+        writer.drain(timeout=5.0)
+        last = None
+        while True:
+            # Keyset pagination: the lock is never held while the caller iterates
+            with self._lock:
+                if last is None:
+                    batch = self._conn.execute(f"SELECT id, data FROM {collection} ORDER BY id LIMIT ?",
+                                               (batch_size,)).fetchall()
+                else:
+                    batch = self._conn.execute(f"SELECT id, data FROM {collection} WHERE id > ? ORDER BY id LIMIT ?",
+                                               (last, batch_size)).fetchall()
+            for key, data in batch:
+                yield key_type(key), codec.loads(data)
+            if len(batch) < batch_size:
+                return
+            last = batch[-1][0]
+
+    def find_keys(self, collection: str, field: str, value: Any) -> Optional[List[Any]]:
+        if field not in COLLECTION_SPECS[collection]["fields"]:
+            return None
+        order = " ORDER BY created_at DESC" if "created_at" in COLLECTION_SPECS[collection]["fields"] else ""
+        key_type = COLLECTION_SPECS[collection]["key_type"]
+        # Queries must see our own queued commits
+        writer.drain(timeout=5.0)
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT id FROM {collection} WHERE {field} = ?{order}", (value,))
+            return [key_type(row[0]) for row in cursor]
+
+    def count(self, collection: str, field: str, value: Any) -> Optional[int]:
+        if field not in COLLECTION_SPECS[collection]["fields"]:
+            return None
+        writer.drain(timeout=5.0)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {collection} WHERE {field} = ?", (value,)).fetchone()[0]
+
+    def close(self) -> None:
+        writer.drain(timeout=30.0)
+        with self._lock:
+            self._conn.close()
+
+
+def create_backend(name: str = STORAGE_BACKEND) -> StorageBackend:
+    """Create the configured storage backend"""
+    if name == "sqlite":
+        return SqliteStorageBackend()
+    if name != "json":
+        print(f"⚠️ Unknown STORAGE_BACKEND '{name}', falling back to json")
+    journal = OrderJournal(snapshot_path=COLLECTION_SPECS["orders"]["filename"]) if ORDER_JOURNAL else None
+    shards = UserShardStore(shard_count=USER_SHARDS, legacy_path=COLLECTION_SPECS["users"]["filename"]) if USER_SHARDS > 0 else None
+    return JsonStorageBackend(order_journal=journal, user_shards=shards)
+
+
+# ========== COLLECTION FACADE ==========
+class StoredCollection(MutableMapping):
+    """
+    Dict-like view over one stored collection.
+
+    Legacy handlers keep using collection[key] and mutating the returned
+    record in place; save() then persists whatever was assigned or read
+    since the last save. Handlers can switch to find_keys()/count() to
+    use backend indexes instead of scanning values().
+    """
+
+    def __init__(self, name: str, backend: StorageBackend, compact: bool = False):
+        self.name = name
+        self.backend = backend
+        # Records are stored as this slotted type (None = plain dicts)
+        self.record_type = COLLECTION_SPECS[name].get("record_type") if compact else None
+        self._rows: Dict[Any, Dict[str, Any]] = {}
+        self._touched: set = set()
+        self._deleted: set = set()
+        self._fingerprints: Dict[Any, int] = {}
+        self._indexes: List[Any] = []
+        self._index_stale: set = set()
+        self._subscribers: List[Callable[[Any, Optional[Dict[str, Any]]], None]] = []
+        # Bumped on every change that reaches the collection; readers can
+        # cache derived data and recompute only when the version moved
+        self.version = 0
+
+    @property
+    def raw(self) -> Dict[Any, Dict[str, Any]]:
+        """The underlying dict (used for whole-file serialization)"""
+        return self._rows
+
+    # ----- mapping protocol -----
+    def __getitem__(self, key: Any) -> Dict[str, Any]:
+        row = self._rows[key]
+        # The caller may mutate the record in place, so save() rechecks it
+        self._touched.add(key)
+        if self._indexes:
+            self._index_stale.add(key)
+        return row
+
+    def __setitem__(self, key: Any, value: Dict[str, Any]) -> None:
+        if self.record_type is not None:
+            value = to_record(self.record_type, value)
+        self._rows[key] = value
+        self._touched.add(key)
+        self._deleted.discard(key)
+        self._index_stale.discard(key)
+        for index in self._indexes:
+            index.update(key, value)
+        self._notify(key, value)
+
+    def __delitem__(self, key: Any) -> None:
+        del self._rows[key]
+        self._touched.discard(key)
+        self._index_stale.discard(key)
+        self._fingerprints.pop(key, None)
+        self._deleted.add(key)
+        for index in self._indexes:
+            index.update(key, None)
+        self._notify(key, None)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._rows
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def keys(self):
+        return self._rows.keys()
+
+    def values(self):
+        return self._rows.values()
+
+    def items(self):
+        return self._rows.items()
+
+    def __repr__(self) -> str:
+        return f"<StoredCollection {self.name} ({len(self._rows)} records, {self.backend.name})>"
+
+    def touch(self, key: Any) -> None:
+        """Mark a record changed that was mutated via values()/items()"""
+        if key in self._rows:
+            self._touched.add(key)
+            if self._indexes:
+                self._index_stale.add(key)
+
+    # ----- change notifications -----
+    def subscribe(self, callback: Callable[[Any, Optional[Dict[str, Any]]], None]) -> None:
+        """
+        Call callback(key, record) whenever a record is assigned, deleted
+        (record is None) or saved after an in-place change.
+        """
+        self._subscribers.append(callback)
+
+    def _notify(self, key: Any, row: Optional[Dict[str, Any]]) -> None:
+        self.version += 1
+        for callback in self._subscribers:
+            try:
+                callback(key, row)
+            except Exception as e:
+                print(f"❌ {self.name} change subscriber failed for {key}: {e}")
+
+    # ----- secondary indexes -----
+    def add_index(self, index: Any) -> None:
+        """Attach an index object with rebuild(rows) and update(key, row)"""
+        self._indexes.append(index)
+        index.rebuild(self._rows)
+
+    def refresh_indexes(self) -> None:
+        """Re-index records that may have been mutated in place"""
+        if not self._index_stale:
+            return
+        stale = self._index_stale
+        self._index_stale = set()
+        for key in stale:
+            row = self._rows.get(key)
+            for index in self._indexes:
+                index.update(key, row)
+
+    # ----- persistence -----
+    def load(self) -> int:
+        """Replace the in-memory contents with what the backend has stored"""
+        rows = None
+        if SNAPSHOT_ENABLED:
+            rows = read_snapshot(self.name, self.backend.source_files(self.name))
+        if rows is not None:
+            self.backend.adopt(self.name, rows)
+            print(f"⚡ {self.name}: {len(rows)} records loaded from startup snapshot")
+        else:
+            rows = self.backend.load(self.name)
+        if self.record_type is not None:
+            rows = {key: to_record(self.record_type, row) for key, row in rows.items()}
+        self._rows = rows
+        self._touched.clear()
+        self._deleted.clear()
+        self._fingerprints.clear()
+        self._index_stale.clear()
+        for index in self._indexes:
+            index.rebuild(self._rows)
+        self.version += 1
+        return len(self._rows)
+
+    def write_snapshot(self) -> None:
+        """Write a startup snapshot; only valid right after everything was saved and closed"""
+        write_snapshot(self.name, self._rows, self.backend.source_files(self.name))
+
+    def has_pending_changes(self) -> bool:
+        """Whether records were assigned, read or deleted since the last save"""
+        return bool(self._touched or self._deleted)
+
+    def save(self) -> None:
+        """Persist records changed since the last save"""
+        self.refresh_indexes()
+        if not self.backend.row_level_for(self.name):
+            # Whole-file backends cannot tell reads from in-place writes,
+            # so every touched record counts as changed
+            touched = [key for key in self._touched if key in self._rows]
+            self._touched.clear()
+            self._deleted.clear()
+            self.backend.save(self, {}, ())
+            for key in touched:
+                self._notify(key, self._rows[key])
+            return
+
+        changed = {}
+        for key in self._touched:
+            row = self._rows.get(key)
+            if row is None:
+                continue
+            # Only rows whose content really changed reach the backend
+            fingerprint = self._fingerprint(row)
+            if self._fingerprints.get(key) != fingerprint:
+                self._fingerprints[key] = fingerprint
+                changed[key] = row
+        deleted = list(self._deleted)
+        self._touched.clear()
+        self._deleted.clear()
+        if changed or deleted:
+            self.backend.save(self, changed, deleted)
+        for key, row in changed.items():
+            self._notify(key, row)
+
+    def _settle(self, written: Dict[Any, int], deleted: Iterable[Any]) -> None:
+        """
+        Records a transaction wrote (key -> fingerprint of what was
+        written): no longer pending for save() unless changed since
+        """
+        self.refresh_indexes()
+        for key, fingerprint in written.items():
+            self._fingerprints[key] = fingerprint
+            row = self._rows.get(key)
+            if row is None:
+                continue
+            if self._fingerprint(row) == fingerprint:
+                self._touched.discard(key)
+            self._notify(key, row)
+        for key in deleted:
+            self._deleted.discard(key)
+
+    @staticmethod
+    def _fingerprint(row: Dict[str, Any]) -> int:
+        return hash(codec.dumps(row, pretty=False, sort_keys=True))
+
+    # ----- indexed lookups -----
+    def _extract(self, field: str) -> Callable[[Dict[str, Any]], Any]:
+        return COLLECTION_SPECS[self.name]["fields"].get(field, lambda row: row.get(field))
+
+    def _sync_for_query(self) -> None:
+        """Push unsaved changes so backend indexes see them"""
+        if self.backend.row_level_for(self.name) and (self._touched or self._deleted):
+            self.save()
+
+    def find_keys(self, field: str, value: Any) -> List[Any]:
+        """Keys of records whose field equals value"""
+        self._sync_for_query()
+        keys = self.backend.find_keys(self.name, field, value)
+        if keys is not None:
+            return [key for key in keys if key in self._rows]
+        extract = self._extract(field)
+        return [key for key, row in self.items() if extract(row) == value]
+
+    def find_one(self, field: str, value: Any) -> Optional[Any]:
+        """First key whose field equals value, or None"""
+        keys = self.find_keys(field, value)
+        return keys[0] if keys else None
+
+    def count(self, field: str, value: Any) -> int:
+        """Number of records whose field equals value"""
+        self._sync_for_query()
+        result = self.backend.count(self.name, field, value)
+        if result is not None:
+            return result
+        extract = self._extract(field)
+        return sum(1 for row in self.values() if extract(row) == value)
+
+
+class LazyStoredCollection(StoredCollection):
+    """
+    StoredCollection that keeps only a compact summary of every record
+    resident and loads full records on demand into an LRU cache.
+
+    Membership and len() come from the summary index, so they never load
+    a profile. Records read or assigned since the last save are pinned,
+    and so are saved records until their write is on disk (the backend
+    still holds them); the rest are kept in least-recently-unpinned
+    order and evicted once more than cache_size records are cached. One
+    changed after its last save is written back on eviction.
+    values()/items() save pending changes and then stream every record
+    from the backend as a read-only view without filling the cache;
+    change records through [].
+    """
+
+    def __init__(self, name: str, backend: StorageBackend, cache_size: int,
+                 summary: Optional[Any] = None, compact: bool = False):
+        super().__init__(name, backend, compact)
+        self.cache_size = max(cache_size, 1)
+        self.summary = summary if summary is not None else UserSummaryIndex()
+        self._indexes.append(self.summary)
+        # Cached records that may be evicted, oldest first
+        self._lru: "OrderedDict[Any, None]" = OrderedDict()
+        # key -> saves of it still queued on the file writer
+        self._writing: Dict[Any, int] = {}
+        # Keys whose write landed, appended by the writer thread
+        self._landed: deque = deque()
+        self.cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "write_backs": 0}
+
+    def _fetch(self, key: Any) -> Dict[str, Any]:
+        row = self._rows.get(key)
+        if row is not None:
+            self.cache_stats["hits"] += 1
+            return row
+        if key not in self.summary:
+            raise KeyError(key)
+        self.cache_stats["misses"] += 1
+        row = self.backend.load_one(self.name, key)
+        if row is None:
+            raise KeyError(key)
+        if self.record_type is not None:
+            row = to_record(self.record_type, row)
+        self._rows[key] = row
+        # Baseline so that a read-only access is not written back
+        self._fingerprints[key] = self._fingerprint(row)
+        return row
+
+    # ----- pinning -----
+    def _pin(self, key: Any) -> None:
+        self._lru.pop(key, None)
+
+    def _unpin(self, keys: Iterable[Any]) -> None:
+        for key in keys:
+            if key in self._rows and key not in self._touched and key not in self._writing:
+                self._lru[key] = None
+                self._lru.move_to_end(key)
+
+    def _track_write(self, keys: List[Any]) -> None:
+        """
+        Pin keys until what was just handed to the backend is on disk. Every
+        lazy backend writes on the file writer thread in order, so a no-op
+        job queued now completes after those writes.
+        """
+        if not keys:
+            return
+        for key in keys:
+            self._writing[key] = self._writing.get(key, 0) + 1
+        try:
+            loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        def landed(_: Future) -> None:
+            # Runs on the writer thread; the collection is only touched on the loop
+            self._landed.append(keys)
+            if loop is not None and not loop.is_closed():
+                loop.call_soon_threadsafe(self._release_writes)
+
+        writer.submit(lambda: None).add_done_callback(landed)
+
+    def _release_writes(self) -> None:
+        """Unpin records whose write landed and evict down to cache_size"""
+        released = []
+        while self._landed:
+            for key in self._landed.popleft():
+                count = self._writing.get(key, 0) - 1
+                if count > 0:
+                    self._writing[key] = count
+                else:
+                    self._writing.pop(key, None)
+                    released.append(key)
+        self._unpin(released)
+        self._evict()
+
+    def _evict(self) -> None:
+        while len(self._rows) > self.cache_size and self._lru:
+            key, _ = self._lru.popitem(last=False)
+            row = self._rows.pop(key)
+            self.cache_stats["evictions"] += 1
+            if key in self._index_stale:
+                self._index_stale.discard(key)
+                for index in self._indexes:
+                    index.update(key, row)
+            # Changed after the last save by someone still holding it
+            if self._fingerprints.get(key) != self._fingerprint(row):
+                self.backend.save(self, {key: row}, ())
+                self.cache_stats["write_backs"] += 1
+                self._notify(key, row)
+            self._fingerprints.pop(key, None)
+
+    # ----- mapping protocol -----
+    def __getitem__(self, key: Any) -> Dict[str, Any]:
+        row = self._fetch(key)
+        self._touched.add(key)
+        self._index_stale.add(key)
+        self._pin(key)
+        self._release_writes()
+        return row
+
+    def __setitem__(self, key: Any, value: Dict[str, Any]) -> None:
+        super().__setitem__(key, value)
+        self._pin(key)
+        self._release_writes()
+
+    def __delitem__(self, key: Any) -> None:
+        if key not in self.summary:
+            raise KeyError(key)
+        self._rows.pop(key, None)
+        self._pin(key)
+        self._touched.discard(key)
+        self._index_stale.discard(key)
+        self._fingerprints.pop(key, None)
+        self._deleted.add(key)
+        for index in self._indexes:
+            index.update(key, None)
+        self._notify(key, None)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.summary
+
+    def touch(self, key: Any) -> None:
+        super().touch(key)
+        self._pin(key)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(list(self.summary))
+
+    def __len__(self) -> int:
+        return len(self.summary)
+
+    def keys(self):
+        return list(self.summary)
+
+    def items(self):
+        # Pending changes first, so the backend stream is current; the
+        # stream itself may be consumed in a worker thread
+        self.save()
+        return self._stream()
+
+    def _stream(self) -> Iterator[Tuple[Any, Mapping[str, Any]]]:
+        for key, row in self.backend.iter_rows(self.name):
+            if key in self.summary:
+                yield key, MappingProxyType(row)
+
+    def values(self):
+        return (row for _, row in self.items())
+
+    def __repr__(self) -> str:
+        return (f"<LazyStoredCollection {self.name} ({len(self.summary)} records, "
+                f"{len(self._rows)} cached, {self.backend.name})>")
+
+    # ----- secondary indexes -----
+    def add_index(self, index: Any) -> None:
+        self._indexes.append(index)
+        index.rebuild({})
+        if self.version:
+            for key, row in self.items():
+                index.update(key, row)
+
+    # ----- persistence -----
+    def save(self) -> None:
+        self._release_writes()
+        saved = [key for key in self._touched if key in self._rows]
+        super().save()
+        self._track_write(saved)
+
+    def _settle(self, written: Dict[Any, int], deleted: Iterable[Any]) -> None:
+        super()._settle(written, deleted)
+        # The transaction's write is on disk already
+        self._unpin(written)
+        self._evict()
+
+    def load(self) -> int:
+        """Rebuild the summary and indexes by streaming the backend; no profile stays cached"""
+        self._rows.clear()
+        self._lru.clear()
+        self._touched.clear()
+        self._deleted.clear()
+        self._fingerprints.clear()
+        self._index_stale.clear()
+        for index in self._indexes:
+            index.rebuild({})
+        for key, row in self.backend.iter_rows(self.name):
+            for index in self._indexes:
+                index.update(key, row)
+        self.version += 1
+        print(f"✅ {self.name}: {len(self.summary)} records indexed, up to {self.cache_size} profiles cached")
+        return len(self.summary)
+
+
+# ========== TRANSACTIONS ==========
+class Transaction:
+    """
+    Changes to records of several collections that are saved together.
+
+    Records take part through get() / put() / delete(); get() returns the
+    live record to mutate after keeping a copy, so rollback() can put
+    every record back. commit() hands just these records to the backend
+    as one unit: one SQLite transaction, or one logged writer job with
+    the JSON backend, and waits until it is written. The collections
+    count the records as saved only then; if the write fails, the
+    records are rolled back and rewritten by the next save. Use it
+    through storage.transaction().
+    """
+
+    def __init__(self, backend: StorageBackend):
+        self.backend = backend
+        # (collection name, key) -> (collection, key, copy before the change or None if absent)
+        self._originals: Dict[Tuple[str, Any], Tuple[StoredCollection, Any, Optional[Dict[str, Any]]]] = {}
+        # Set once the backend may have written part of the commit
+        self._submitted = False
+
+    def _enlist(self, collection: StoredCollection, key: Any) -> None:
+        slot = (collection.name, key)
+        if slot not in self._originals:
+            original = copy.deepcopy(collection[key]) if key in collection else None
+            self._originals[slot] = (collection, key, original)
+
+    def get(self, collection: StoredCollection, key: Any) -> Dict[str, Any]:
+        """The live record, to be changed in place"""
+        self._enlist(collection, key)
+        return collection[key]
+
+    def put(self, collection: StoredCollection, key: Any, row: Dict[str, Any]) -> None:
+        self._enlist(collection, key)
+        collection[key] = row
+
+    def delete(self, collection: StoredCollection, key: Any) -> None:
+        self._enlist(collection, key)
+        del collection[key]
+
+    async def commit(self) -> None:
+        parts: Dict[str, Tuple[StoredCollection, Dict[Any, Dict[str, Any]], List[Any]]] = {}
+        for collection, key, original in self._originals.values():
+            _, changed, deleted = parts.setdefault(collection.name, (collection, {}, []))
+            if key in collection:
+                changed[key] = collection[key]
+            elif original is not None:
+                deleted.append(key)
+        if not parts:
+            return
+        # What is written now, not what the records may become while waiting
+        written = {name: {key: collection._fingerprint(row) for key, row in changed.items()}
+                   for name, (collection, changed, _) in parts.items()}
+        self._submitted = True
+        await asyncio.wrap_future(self.backend.commit(list(parts.values())))
+        for name, (collection, _, deleted) in parts.items():
+            collection._settle(written[name], deleted)
+
+    def rollback(self) -> None:
+        for collection, key, original in reversed(list(self._originals.values())):
+            if self._submitted:
+                # Part of the commit may be on disk: the next save rewrites the record
+                collection._fingerprints.pop(key, None)
+            if original is not None:
+                collection[key] = original
+            elif key in collection:
+                del collection[key]
+        self._originals.clear()
+
+
+@asynccontextmanager
+async def transaction() -> AsyncIterator[Transaction]:
+    """
+    async with storage.transaction() as tx: ... commits the records
+    enlisted in tx when the block ends and waits for the write, or
+    restores them if the block or the write fails.
+    """
+    tx = Transaction(backend)
+    try:
+        yield tx
+        await tx.commit()
+    except BaseException:
+        tx.rollback()
+        raise
+
+
+# ========== SHARED INSTANCES ==========
+backend = create_backend()
+# (account_created, balance) of every user, always resident
+user_summary_index = UserSummaryIndex()
+if USER_CACHE_SIZE > 0 and backend.supports_lazy("users"):
+    users_data: StoredCollection = LazyStoredCollection("users", backend, USER_CACHE_SIZE, summary=user_summary_index,
+                                                        compact=COMPACT_RECORDS)
+else:
+    users_data = StoredCollection("users", backend, compact=COMPACT_RECORDS)
+    users_data.add_index(user_summary_index)
+orders_data = StoredCollection("orders", backend, compact=COMPACT_RECORDS)
+tickets_data = StoredCollection("tickets", backend)
+
+user_orders_index = UserOrderIndex()
+orders_data.add_index(user_orders_index)
+
+user_lookup_index = UserLookupIndex()
+users_data.add_index(user_lookup_index)
+
+user_reachability_index = UserReachabilityIndex()
+users_data.add_index(user_reachability_index)
+
+# Audience segments (segments.py): profile segments and platforms ordered
+user_segment_index = UserSegmentIndex()
+users_data.add_index(user_segment_index)
+user_platform_index = UserPlatformIndex()
+orders_data.add_index(user_platform_index)
+
+
+def user_order_ids(user_id: int, offset: int = 0, limit: Optional[int] = None) -> List[str]:
+    """Order ids of one user, newest first, one page at a time"""
+    orders_data.refresh_indexes()
+    return user_orders_index.orders_for_user(user_id, offset, limit)
+
+
+def user_order_count(user_id: int, status: Optional[str] = None) -> int:
+    """Number of orders of one user (archived ones included), optionally filtered by status"""
+    orders_data.refresh_indexes()
+    return user_orders_index.count_for_user(user_id, status) + order_archive.count_for_user(user_id, status)
+
+
+def user_order_page(user_id: int, offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    One page of a user's orders: hot orders newest first, then archived ones.
+
+    The archive is only opened once the page runs past the hot orders.
+    """
+    page = [orders_data[order_id] for order_id in user_order_ids(user_id, offset, limit)]
+    hot_count = user_orders_index.count_for_user(user_id)
+    if limit is not None and len(page) >= limit:
+        return page
+    # archive_orders() keeps every order in exactly one of the two
+    return page + order_archive.orders_for_user(
+        user_id, max(offset - hot_count, 0), None if limit is None else limit - len(page))
+
+
+def find_users_by_phone(phone: Any) -> List[int]:
+    """User ids registered with this phone number (any common format)"""
+    users_data.refresh_indexes()
+    return user_lookup_index.by_phone(phone)
+
+
+def find_users_by_email(email: Any) -> List[int]:
+    """User ids registered with this email (case-insensitive)"""
+    users_data.refresh_indexes()
+    return user_lookup_index.by_email(email)
+
+
+def find_users_by_access_token(access_token: Any) -> List[int]:
+    """User ids holding this access token"""
+    users_data.refresh_indexes()
+    return user_lookup_index.by_access_token(access_token)
+
+
+def find_users_by_phone_and_email(phone: Any, email: Any) -> List[int]:
+    """User ids matching both phone and email"""
+    users_data.refresh_indexes()
+    return user_lookup_index.by_phone_and_email(phone, email)
+
+
+def user_totals() -> Dict[str, Any]:
+    """User count, created accounts, balance/spend totals and today's joins without loading profiles"""
+    users_data.refresh_indexes()
+    return {
+        "users": len(user_summary_index),
+        "accounts_created": user_summary_index.accounts_created,
+        "total_balance": round(user_summary_index.total_balance, 2),
+        "total_spent": round(user_summary_index.total_spent, 2),
+        "users_with_orders": user_summary_index.users_with_orders,
+        "joined_today": user_summary_index.joined_on(datetime.now().date().isoformat()),
+    }
+
+
+async def user_fields(*fields: str) -> List[Tuple[int, Dict[str, Any]]]:
+    """
+    (user_id, {field: value}) for every user, with only the fields a user
+    has. Lazily loaded profiles are streamed in a worker thread, so the
+    event loop never waits on the shard files.
+    """
+    def project(rows: Iterable[Tuple[int, Mapping[str, Any]]]) -> List[Tuple[int, Dict[str, Any]]]:
+        return [(user_id, {field: row[field] for field in fields if field in row}) for user_id, row in rows]
+
+    if isinstance(users_data, LazyStoredCollection):
+        return await asyncio.to_thread(project, users_data.items())
+    return project(users_data.items())
+
+
+def reachable_user_ids(user_ids: Optional[Iterable[int]] = None) -> List[int]:
+    """user_ids (every user by default) without the ones the bot cannot reach"""
+    users_data.refresh_indexes()
+    if user_ids is None:
+        user_ids = users_data.keys()
+    return [user_id for user_id in user_ids if user_id not in user_reachability_index]
+
+
+def user_reachability() -> Dict[str, Any]:
+    """Reachable vs unreachable users, unreachable ones per delivery status"""
+    users_data.refresh_indexes()
+    unreachable = len(user_reachability_index)
+    return {"reachable": len(users_data) - unreachable, "unreachable": unreachable,
+            "by_status": user_reachability_index.status_counts()}
+
+
+def user_cache_stats() -> Dict[str, Any]:
+    """Profile cache figures for /static (all zero when every profile is resident)"""
+    if isinstance(users_data, LazyStoredCollection):
+        return {**users_data.cache_stats, "cached": len(users_data.raw), "capacity": users_data.cache_size}
+    return {"hits": 0, "misses": 0, "evictions": 0, "write_backs": 0,
+            "cached": len(users_data), "capacity": 0}
+
+
+def recover_transactions() -> int:
+    """Apply again any transaction a crash cut off mid-write, returns how many"""
+    records = backend.pending_transactions()
+    if not records:
+        return 0
+    collections = {c.name: c for c in (users_data, orders_data, tickets_data)}
+    for record in records:
+        for name, change in record.get("collections", {}).items():
+            collection = collections[name]
+            key_type = COLLECTION_SPECS[name]["key_type"]
+            for key, row in change.get("changed", []):
+                collection[key_type(key)] = row
+            for key in change.get("deleted", []):
+                if key_type(key) in collection:
+                    del collection[key_type(key)]
+    save_all()
+    backend.clear_transactions()
+    print(f"♻️ Recovered {len(records)} interrupted transaction(s)")
+    return len(records)
+
+
+def load_all() -> None:
+    """Load every collection from the configured backend"""
+    users_data.load()
+    orders_data.load()
+    tickets_data.load()
+    recover_transactions()
+
+
+async def load_all_async() -> Dict[str, float]:
+    """Load every collection concurrently in worker threads, returns milliseconds per collection"""
+    async def timed_load(collection: StoredCollection):
+        started = time.perf_counter()
+        await asyncio.to_thread(collection.load)
+        return collection.name, round((time.perf_counter() - started) * 1000, 1)
+
+    results = await asyncio.gather(*(timed_load(c) for c in (users_data, orders_data, tickets_data)))
+    await asyncio.to_thread(recover_transactions)
+    return dict(results)
+
+
+def save_all() -> None:
+    """Persist pending changes of every collection"""
+    for collection in (users_data, orders_data, tickets_data):
+        if collection.has_pending_changes():
+            collection.save()
+
+
+def close() -> None:
+    """Save everything, close the backend and leave startup snapshots behind"""
+    save_all()
+    backend.close()
+    if not SNAPSHOT_ENABLED:
+        return
+    for collection in (users_data, orders_data, tickets_data):
+        # Lazy collections never hold every record, nothing to snapshot
+        if isinstance(collection, LazyStoredCollection):
+            continue
+        try:
+            collection.write_snapshot()
+        except Exception as e:
+            print(f"⚠️ Could not write startup snapshot for {collection.name}: {e}")
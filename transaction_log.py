@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Transaction Log - India Social Panel
+Write-ahead record of multi-collection commits for the JSON storage backend
+"""
+
+import os
+from typing import Any, Dict, List
+
+import codec
+
+# ========== CONFIGURATION ==========
+TRANSACTION_LOG_PATH = os.getenv("TRANSACTION_LOG_PATH", "transactions.jsonl")
+
+
+class TransactionLog:
+    """
+    Holds the commit that is being written, if any.
+
+    A commit first appends its full rows here (fsync'd), then writes them
+    to their own files (user shards, order journal, ...) and finally
+    empties the log. Commits run one at a time on the file writer thread,
+    so whatever is still in the log at startup belongs to a commit that a
+    crash cut off, and is applied again.
+    """
+
+    def __init__(self, path: str = TRANSACTION_LOG_PATH):
+        self.path = path
+        self.stats = {"commits": 0, "aborted": 0, "recovered": 0}
+
+    def begin(self, line: str) -> None:
+        """Runs on the file writer thread"""
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def end(self) -> None:
+        """Runs on the file writer thread, after every file of the commit is written"""
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats["commits"] += 1
+
+    def abort(self) -> None:
+        """Runs on the file writer thread, when a commit failed part way and is being rolled back"""
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats["aborted"] += 1
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """Commits that were logged but never finished"""
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(codec.loads(line))
+                except codec.DecodeError:
+                    # Torn while being logged: its files were never touched
+                    print(f"⚠️ Skipping unreadable line in {self.path}")
+        self.stats["recovered"] += len(records)
+        return records
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+User Shards - India Social Panel
+Users stored in hash-sharded JSON files so one profile edit rewrites one small file
+
+Usage:
+    python user_shards.py migrate [users.json]
+"""
+
+import json
+import os
+import sys
+import threading
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+import codec
+from persistence import atomic_write_json, atomic_write_text, serialize_json, writer
+
+# ========== CONFIGURATION ==========
+USER_SHARD_DIR = os.getenv("USER_SHARD_DIR", "users")
+USER_SHARD_COUNT = int(os.getenv("USER_SHARDS", "256"))
+MANIFEST_NAME = "_manifest.json"
+STREAM_CHUNK_SIZE = 1 << 20
+
+
+# ========== STREAMING READER ==========
+class _StreamingObjectReader:
+    """Yields (key, value) pairs of a top-level JSON object without loading the whole file"""
+
+    WHITESPACE = " \t\r\n"
+
+    def __init__(self, f, chunk_size: int = STREAM_CHUNK_SIZE):
+        self._file = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """Append the next chunk to the buffer, returns False at end of file"""
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in self.WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char: str) -> None:
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' at offset {self._pos}, found '{found or 'EOF'}'")
+        self._pos += 1
+
+    def _value(self) -> Any:
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # Value continues in the next chunk
+                if not self._fill():
+                    raise
+                continue
+            # A number right at the end of the buffer may be cut in half
+            if end == len(self._buf) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        if self._peek() == "":
+            return
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            yield key, self._value()
+            separator = self._peek()
+            self._pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError(f"Expected ',' or '}}' at offset {self._pos - 1}, found '{separator or 'EOF'}'")
+
+
+def iter_json_object(path: str) -> Iterator[Tuple[str, Any]]:
+    """Stream the entries of a JSON object file one at a time"""
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from _StreamingObjectReader(f)
+
+
+# ========== SHARD STORE ==========
+class UserShardStore:
+    """
+    Users split over N JSON files by user_id.
+
+    Nothing is kept resident here: a save records the changed users as a
+    pending patch of their shard and queues one rewrite of that shard on
+    the file writer thread. Patches that pile up before the rewrite runs
+    are folded into it. Single users can be read back with load_one(),
+    which is what the lazy users collection uses on a cache miss.
+    """
+
+    def __init__(self, directory: str = USER_SHARD_DIR, shard_count: int = USER_SHARD_COUNT,
+                 legacy_path: str = "users.json"):
+        self.directory = directory
+        self.shard_count = max(shard_count, 1)
+        self.legacy_path = legacy_path
+        # Held while a shard is read or rewritten, so readers never see a
+        # shard between "patch taken" and "file replaced"
+        self._lock = threading.RLock()
+        # shard -> user_id -> record (None = deleted), not yet on disk
+        self._pending: Dict[int, Dict[int, Optional[Dict[str, Any]]]] = {}
+        self.stats = {"shard_writes": 0, "users_written": 0, "shard_reads": 0}
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    def shard_of(self, user_id: Any) -> int:
+        try:
+            return int(user_id) % self.shard_count
+        except (TypeError, ValueError):
+            return sum(str(user_id).encode("utf-8")) % self.shard_count
+
+    def shard_path(self, shard: int) -> str:
+        return os.path.join(self.directory, f"shard_{shard:03d}.json")
+
+    def _read_manifest(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return codec.loads(f.read())
+
+    # ----- migration -----
+    def migrate(self, source: Optional[str] = None) -> int:
+        """
+        Split a whole-file users.json into shards, streaming it entry by entry.
+
+        Records are first appended to one JSONL spool file per shard, then
+        each spool becomes its shard file, so peak memory is about one
+        shard rather than the whole file. The source is kept as
+        <source>.migrated. Returns the number of users migrated.
+        """
+        source = source or self.legacy_path
+        os.makedirs(self.directory, exist_ok=True)
+        spool_paths = [os.path.join(self.directory, f"shard_{n:03d}.spool") for n in range(self.shard_count)]
+        spools = [open(path, 'w', encoding='utf-8') for path in spool_paths]
+        migrated = 0
+        try:
+            for raw_key, user in iter_json_object(source):
+                try:
+                    user_id = int(raw_key)
+                except (TypeError, ValueError):
+                    print(f"⚠️ Skipping invalid key in {source}: {raw_key}")
+                    continue
+                spools[self.shard_of(user_id)].write(codec.dumps([user_id, user], pretty=False) + "\n")
+                migrated += 1
+        finally:
+            for spool in spools:
+                spool.close()
+
+        for shard, spool_path in enumerate(spool_paths):
+            rows = {}
+            with open(spool_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    user_id, user = codec.loads(line)
+                    rows[user_id] = user
+            atomic_write_json(self.shard_path(shard), rows)
+            os.unlink(spool_path)
+
+        # The manifest is written last: without it, a crashed migration reruns
+        atomic_write_text(self.manifest_path, codec.dumps(
+            {"shards": self.shard_count, "users": migrated, "migrated_from": source}, pretty=True))
+        os.replace(source, f"{source}.migrated")
+        print(f"✅ Migrated {migrated} users from {source} into {self.shard_count} shards in {self.directory}/")
+        return migrated
+
+    # ----- loading and saving -----
+    def prepare(self) -> None:
+        """Create the shard directory, migrating users.json first if needed"""
+        manifest = self._read_manifest()
+        if manifest is None:
+            if os.path.exists(self.legacy_path):
+                self.migrate()
+            else:
+                os.makedirs(self.directory, exist_ok=True)
+                atomic_write_text(self.manifest_path, codec.dumps({"shards": self.shard_count, "users": 0}, pretty=True))
+            manifest = self._read_manifest() or {}
+        shard_count = int(manifest.get("shards", self.shard_count))
+        if shard_count != self.shard_count:
+            # Re-sharding would move every user; stay on the existing layout
+            print(f"⚠️ {self.directory}/ has {shard_count} shards, ignoring USER_SHARDS={self.shard_count}")
+            self.shard_count = shard_count
+
+    def load(self) -> Dict[int, Dict[str, Any]]:
+        """Load every shard into one dict"""
+        self.prepare()
+        users = dict(self.iter_rows())
+        print(f"✅ Users loaded: {len(users)} from {self.shard_count} shards in {self.directory}/")
+        return users
+
+    def _read_shard(self, shard: int) -> Dict[int, Dict[str, Any]]:
+        """Shard contents on disk with its pending patch applied"""
+        path = self.shard_path(shard)
+        rows: Dict[int, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            if content.strip():
+                rows = {int(raw_key): user for raw_key, user in codec.loads(content).items()}
+            self.stats["shard_reads"] += 1
+        for user_id, user in self._pending.get(shard, {}).items():
+            if user is None:
+                rows.pop(user_id, None)
+            else:
+                rows[user_id] = user
+        return rows
+
+    def iter_rows(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Every stored user, one shard in memory at a time"""
+        for shard in range(self.shard_count):
+            with self._lock:
+                rows = self._read_shard(shard)
+            yield from rows.items()
+
+    def load_one(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """One user read from its shard (or its pending patch)"""
+        shard = self.shard_of(user_id)
+        with self._lock:
+            patch = self._pending.get(shard, {})
+            if user_id in patch:
+                return patch[user_id]
+            return self._read_shard(shard).get(user_id)
+
+    def _write_shard(self, shard: int) -> None:
+        """Runs on the file writer thread: fold the shard's pending patch into its file"""
+        with self._lock:
+            if not self._pending.get(shard):
+                return  # already folded into an earlier rewrite
+            rows = self._read_shard(shard)
+            text = serialize_json(rows)
+            atomic_write_text(self.shard_path(shard), text)
+            del self._pending[shard]
+            self.stats["shard_writes"] += 1
+
+    def save(self, changed: Dict[Any, Dict[str, Any]], deleted: Iterable[Any]) -> None:
+        """Record changed/deleted users and queue a rewrite of only their shards"""
+        scheduled = []
+        with self._lock:
+            for user_id, user in [*changed.items(), *((user_id, None) for user_id in deleted)]:
+                shard = self.shard_of(user_id)
+                patch = self._pending.setdefault(shard, {})
+                if not patch:
+                    scheduled.append(shard)
+                patch[user_id] = user
+            self.stats["users_written"] += len(changed)
+        for shard in scheduled:
+            writer.submit(lambda shard=shard: self._write_shard(shard))
+
+    def write_now(self, changed: Dict[Any, Dict[str, Any]], deleted: Iterable[Any]) -> None:
+        """Runs on the file writer thread: rewrite these users' shards right away (transaction commit)"""
+        with self._lock:
+            shards = set()
+            for user_id, user in [*changed.items(), *((user_id, None) for user_id in deleted)]:
+                shard = self.shard_of(user_id)
+                # A patch already pending was recorded after this commit was
+                # queued (older ones were written by earlier jobs), so it wins
+                self._pending.setdefault(shard, {}).setdefault(user_id, user)
+                shards.add(shard)
+            for shard in sorted(shards):
+                self._write_shard(shard)
+            self.stats["users_written"] += len(changed)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Usage: python user_shards.py migrate [users.json]")
+        sys.exit(1)
+    store = UserShardStore()
+    if store._read_manifest() is not None:
+        print(f"⚠️ {store.directory}/ is already migrated")
+        sys.exit(1)
+    store.migrate(sys.argv[2] if len(sys.argv) > 2 else None)